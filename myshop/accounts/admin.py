@@ -1,18 +1,40 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
+from django.db.models import Q
 from .models import *
+from .paginator import EstimatedCountPaginator
+from .search import search_products
+
+# Связи в списках загружаются через JOIN (list_select_related), внешние ключи редактируются
+# через поиск или ввод id вместо <select> со всеми строками таблицы, а общее число строк
+# больших таблиц берётся из статистики базы без COUNT(*).
 
 
 class ProductAdmin(admin.ModelAdmin):
     list_display = ('id', 'title', 'price', 'number', 'is_published', 'category', 'creator',)
     list_display_links = ('id', 'title')
+    list_select_related = ('category', 'creator')
     search_fields = ('title',)
     list_editable = ('is_published', 'category', 'creator',)
-    list_filter = ('is_published', 'creator')
+    list_filter = ('is_published', 'category', ('creator', admin.RelatedOnlyFieldListFilter))
+    autocomplete_fields = ('category',)
+    raw_id_fields = ('creator',)
     prepopulated_fields = {"slug": ("title",)}
     exclude = ('views',)
     # readonly_fields = ('creator',)
     list_per_page = 20
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_search_results(self, request, queryset, search_term):
+        """Поиск по индексу слов (SearchTerm) или по id вместо LIKE '%...%' по всей таблице."""
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        found = Q(pk__in=search_products(search_term, published=False).values('product'))
+        if search_term.isdigit():
+            found |= Q(pk=search_term)
+        return queryset.filter(found), False
 
 
 class CategoryAdmin(admin.ModelAdmin):
@@ -27,13 +49,48 @@ class UserAdmin(admin.ModelAdmin):
     list_display_links = ('id', 'username')
     search_fields = ('username',)
     list_editable = ('is_seller',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_search_results(self, request, queryset, search_term):
+        """Поиск по началу имени: LIKE 'имя%' идёт по индексу уникального username."""
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        if search_term.isdigit():
+            return queryset.filter(Q(pk=search_term) | Q(username__startswith=search_term)), False
+        return queryset.filter(username__startswith=search_term), False
 
 
 class OrderAdmin(admin.ModelAdmin):
-    list_display = ('name_seller', 'product', 'price', 'number', 'paid', 'order_number')
+    list_display = ('name_seller', 'product', 'price', 'number', 'paid', 'order_number', 'paid_at')
+    list_select_related = ('name_seller', 'product')
+    list_filter = ('paid',)
+    search_fields = ('order_number',)
+    raw_id_fields = ('header', 'name_seller', 'product')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_search_results(self, request, queryset, search_term):
+        """Поиск по точному номеру заказа (индекс по order_number)."""
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        if not search_term.isdigit():
+            return queryset.none(), False
+        return queryset.filter(order_number=search_term), False
+
+
+class OrderHeaderAdmin(admin.ModelAdmin):
+    list_display = ('id', 'buyer', 'total', 'time_create')
+    list_select_related = ('buyer',)
+    raw_id_fields = ('buyer',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 
 admin.site.register(Product, ProductAdmin)
 admin.site.register(Category, CategoryAdmin)
 admin.site.register(User, UserAdmin)
-admin.site.register(Order, OrderAdmin)
\ No newline at end of file
+admin.site.register(Order, OrderAdmin)
+admin.site.register(OrderHeader, OrderHeaderAdmin)
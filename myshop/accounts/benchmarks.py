@@ -0,0 +1,181 @@
+import asyncio
+import math
+import random
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+from django.db import connection, connections
+from django.test import AsyncClient, Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import Category, Product
+
+SAMPLE_SIZE = 200
+
+
+def percentile(values, p):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+class Recorder:
+    """Собирает время ответа, количество и суммарное время SQL-запросов по каждому адресу."""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+
+    def measure(self, name, request, *args, **kwargs):
+        with CaptureQueriesContext(connection) as queries:
+            start = perf_counter()
+            response = request(*args, **kwargs)
+            elapsed = perf_counter() - start
+        sql_time = sum(float(query['time']) for query in queries.captured_queries)
+        self.samples[name].append((elapsed, len(queries), sql_time, response.status_code))
+        return response
+
+    def report(self):
+        report = {}
+        for name, samples in self.samples.items():
+            latency = [s[0] * 1000 for s in samples]
+            queries = [s[1] for s in samples]
+            sql = [s[2] * 1000 for s in samples]
+            report[name] = {
+                'requests': len(samples),
+                'errors': sum(1 for s in samples if s[3] >= 400),
+                'p50_ms': round(percentile(latency, 50), 2),
+                'p95_ms': round(percentile(latency, 95), 2),
+                'max_ms': round(max(latency), 2),
+                'queries_p50': percentile(queries, 50),
+                'queries_max': max(queries),
+                'sql_ms_p50': round(percentile(sql, 50), 2),
+                'sql_ms_p95': round(percentile(sql, 95), 2),
+            }
+        return report
+
+
+def run_benchmarks(client, iterations, seed=None):
+    """
+    Проходит сценарий покупателя iterations раз: главная, категория, товар, добавление в корзину,
+    корзина, оформление и оплата заказа. client должен быть авторизован.
+    """
+    rnd = random.Random(seed)
+    products = list(Product.objects.filter(is_published=True).order_by('-views')
+                    .values_list('id', 'slug')[:SAMPLE_SIZE])
+    categories = list(Category.objects.filter(product_count__gt=0).values_list('slug', flat=True)[:SAMPLE_SIZE])
+    recorder = Recorder()
+
+    for _ in range(iterations):
+        product_id, product_slug = rnd.choice(products)
+        recorder.measure('home', client.get, reverse('home'))
+        recorder.measure('category', client.get, reverse('category', kwargs={'category_slug': rnd.choice(categories)}))
+        recorder.measure('product', client.get, reverse('product', kwargs={'product_slug': product_slug}))
+        recorder.measure('cart_add', client.post, reverse('cart:cart_add', kwargs={'product_id': product_id}),
+                         {'quantity': rnd.randint(1, 3)})
+        recorder.measure('cart_detail', client.get, reverse('cart:cart_detail'))
+        response = recorder.measure('create_order', client.post, reverse('create_order'))
+        if response.context and response.context.get('order_number'):
+            recorder.measure('CheckOrder', client.post, reverse('CheckOrder'),
+                             {'amount': str(response.context['price']), 'label': response.context['order_number']})
+
+    return {
+        'meta': {
+            'iterations': iterations,
+            'database': connection.vendor,
+            'products': Product.objects.count(),
+            'time': timezone.now().isoformat(),
+        },
+        'endpoints': recorder.report(),
+    }
+
+
+def compare_reports(old, new):
+    """Строки с изменением p50/p95 и числа запросов относительно прошлого прогона."""
+    lines = []
+    for name, stats in new['endpoints'].items():
+        before = old['endpoints'].get(name)
+        if before is None:
+            continue
+        lines.append('%-13s p50 %8.2f -> %8.2f ms  p95 %8.2f -> %8.2f ms  queries %3s -> %3s' % (
+            name, before['p50_ms'], stats['p50_ms'], before['p95_ms'], stats['p95_ms'],
+            before['queries_p50'], stats['queries_p50']))
+    return lines
+
+
+def concurrency_paths():
+    """Адреса главной, категории, товара и корзины."""
+    category = Category.objects.filter(product_count__gt=0).values_list('slug', flat=True).first()
+    product = Product.objects.filter(is_published=True).order_by('-views').values_list('slug', flat=True).first()
+    return [reverse('home'),
+            reverse('category', kwargs={'category_slug': category}),
+            reverse('product', kwargs={'product_slug': product}),
+            reverse('cart:cart_detail')]
+
+
+def _summary(results, elapsed):
+    latency = [seconds * 1000 for seconds, status in results]
+    return {
+        'requests': len(results),
+        'errors': sum(1 for seconds, status in results if status >= 400),
+        'rps': round(len(results) / elapsed, 1),
+        'p50_ms': round(percentile(latency, 50), 2),
+        'p95_ms': round(percentile(latency, 95), 2),
+        'max_ms': round(max(latency), 2),
+    }
+
+
+def _wsgi_load(clients, paths, per_client):
+    def worker(client):
+        results = []
+        try:
+            for i in range(per_client):
+                start = perf_counter()
+                response = client.get(paths[i % len(paths)])
+                results.append((perf_counter() - start, response.status_code))
+        finally:
+            connections.close_all()
+        return results
+
+    with ThreadPoolExecutor(len(clients)) as pool:
+        return [result for results in pool.map(worker, clients) for result in results]
+
+
+async def _asgi_load(clients, paths, per_client):
+    async def worker(client):
+        results = []
+        for i in range(per_client):
+            start = perf_counter()
+            response = await client.get(paths[i % len(paths)])
+            results.append((perf_counter() - start, response.status_code))
+        return results
+
+    return [result for results in await asyncio.gather(*map(worker, clients)) for result in results]
+
+
+def run_concurrency_benchmark(user, mode, concurrency, requests):
+    """
+    Нагружает страницы каталога, товара и корзины с concurrency одновременными клиентами.
+
+    wsgi - view через WSGIHandler из потоков, asgi - те же view через ASGIHandler, asgi-async -
+    асинхронные view из myshop.asgi_urls через ASGIHandler. Возвращает пропускную способность
+    и p50/p95 времени ответа.
+    """
+    if mode == 'asgi-async':
+        with override_settings(ROOT_URLCONF='myshop.asgi_urls'):
+            return run_concurrency_benchmark(user, 'asgi', concurrency, requests)
+    paths = concurrency_paths()
+    clients = [(Client if mode == 'wsgi' else AsyncClient)() for _ in range(concurrency)]
+    for client in clients:
+        client.force_login(user)
+    per_client = max(1, requests // concurrency)
+
+    start = perf_counter()
+    if mode == 'wsgi':
+        results = _wsgi_load(clients, paths, per_client)
+    else:
+        results = asyncio.run(_asgi_load(clients, paths, per_client))
+    return _summary(results, perf_counter() - start)
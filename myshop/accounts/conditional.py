@@ -0,0 +1,99 @@
+from hashlib import md5
+from time import time
+
+from django.conf import settings
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+from .pagecache import PAGE_CACHE_TIMEOUT, RECOMMENDATIONS, last_change, page_cache_enabled
+from .utils import get_categories
+
+
+def request_variant(request):
+    """
+    Всё, что на странице зависит от посетителя: пользователь и корзина. CSRF-токен форм в ETag
+    не входит: он остаётся действительным, пока у посетителя та же cookie, а при входе в аккаунт
+    cookie меняется вместе с пользователем.
+    """
+    user_id = request.user.pk if request.user.is_authenticated else 0
+    return user_id, request.session.get(settings.CART_SESSION_ID)
+
+
+def make_etag(*parts):
+    return quote_etag(md5(repr(parts).encode()).hexdigest())
+
+
+def sidebar_state():
+    return [(category.pk, category.name, category.slug, category.product_count) for category in get_categories()]
+
+
+def listing_validators(request, group):
+    """
+    Проверка для списков товаров без запросов к базе. Сигналы Product и Category при каждом
+    изменении товара записывают в версию группы страниц текущее время, так что она служит
+    временем последнего изменения товаров группы. Порядок по просмотрам меняется без сигналов,
+    поэтому проверка устаревает не реже, чем истекает кэш страниц. Без общего кэша версии групп
+    не видят изменений из других процессов, а считать по самим товарам пришлось бы COUNT и MAX
+    по всему списку на каждый запрос, поэтому списки тогда не проверяются (None).
+    """
+    if not page_cache_enabled():
+        return None
+    changed = last_change(group)
+    period = time() // PAGE_CACHE_TIMEOUT * PAGE_CACHE_TIMEOUT
+    etag = make_etag(request.get_full_path(), changed, period, request_variant(request))
+    return etag, int(max(changed, period))
+
+
+def product_validators(request, product, recommendations):
+    """
+    Проверка для страницы товара: время изменения товара, просмотры, посетитель и версия группы
+    RECOMMENDATIONS, которая учитывает и сброс всех страниц (боковое меню). Без общего кэша вместо
+    версии в ETag входят само боковое меню и рекомендации (recommendations() - список товаров
+    для блока «С этим товаром покупают»), а Last-Modified не отдаётся.
+    """
+    etag_parts = [product.pk, product.time_update.isoformat(), product.views, request_variant(request)]
+    if not page_cache_enabled():
+        recommended = [(item.pk, item.time_update.isoformat()) for item in recommendations()]
+        return make_etag(*etag_parts, sidebar_state(), recommended), None
+    changed = last_change(RECOMMENDATIONS)
+    last_modified = int(max(product.time_update.timestamp(), changed))
+    return make_etag(*etag_parts, changed), last_modified
+
+
+def not_modified(request, validators):
+    """Ответ 304 (или 412), если у клиента та же версия страницы, иначе None."""
+    etag, last_modified = validators
+    return get_conditional_response(request, etag=etag, last_modified=last_modified)
+
+
+def add_validators(response, validators):
+    etag, last_modified = validators
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, no_cache=True)
+    patch_vary_headers(response, ('Cookie',))
+    return response
+
+
+class ConditionalGetMixin:
+    """
+    Условные GET-запросы. Страница получает ETag и Last-Modified из get_validators(), а на запрос
+    с подходящими If-None-Match или If-Modified-Since отдаётся 304 без отрисовки шаблона.
+    Cache-Control: no-cache заставляет браузер и прокси переспрашивать сервер перед каждым показом.
+    """
+
+    def get_validators(self):
+        """(ETag, время изменения в секундах или None) или None, если страницу нельзя проверить."""
+        return None
+
+    def dispatch(self, request, *args, **kwargs):
+        validators = self.get_validators() if request.method in ('GET', 'HEAD') else None
+        if validators is None:
+            return super().dispatch(request, *args, **kwargs)
+        response = not_modified(request, validators)
+        if response is None:
+            response = super().dispatch(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+        return add_validators(response, validators)
@@ -0,0 +1,181 @@
+import atexit
+import json
+import logging
+import os
+import tempfile
+import threading
+from collections import Counter
+from time import monotonic
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import DatabaseError, connection
+from django.db.models import Case, F, PositiveIntegerField, Value, When
+
+from .models import Product
+
+logger = logging.getLogger(__name__)
+
+FLUSH_CHUNK = 500
+
+
+def write_views(increments):
+    """Прибавляет просмотры пачкой: один UPDATE ... CASE на каждые FLUSH_CHUNK товаров."""
+    items = list(increments.items())
+    for start in range(0, len(items), FLUSH_CHUNK):
+        chunk = items[start:start + FLUSH_CHUNK]
+        delta = Case(*[When(pk=pk, then=Value(count)) for pk, count in chunk],
+                     default=Value(0), output_field=PositiveIntegerField())
+        Product.objects.filter(pk__in=[pk for pk, count in chunk]).update(views=F('views') + delta)
+
+
+def current_database():
+    return str(connection.settings_dict['NAME'])
+
+
+class ViewCounter:
+    """
+    Буфер просмотров товаров с отложенной записью.
+
+    Просмотры копятся в памяти процесса и сбрасываются в базу одним сгруппированным UPDATE,
+    когда набирается flush_size просмотров или проходит flush_interval секунд с прошлого сброса.
+    При остановке процесса буфер сбрасывается через atexit; если база недоступна, остаток
+    дописывается в spill_file и подхватывается при следующем запуске.
+
+    Буфер помнит, к какой базе относятся просмотры: тесты подменяют базу, и их просмотры
+    не должны попасть в рабочую, когда после тестов настройки возвращаются обратно.
+    """
+
+    def __init__(self, flush_interval=10, flush_size=100, spill_file=None):
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.spill_file = spill_file
+        self.pending = Counter()
+        self.database = None
+        self.lock = threading.Lock()
+        self.last_flush = monotonic()
+
+    def add(self, product_id, count=1):
+        database = current_database()
+        if self.database != database:
+            self.flush()
+            self.database = database
+            self.restore()
+        with self.lock:
+            self.pending[product_id] += count
+            due = (sum(self.pending.values()) >= self.flush_size
+                   or self.flush_interval is not None and monotonic() - self.last_flush >= self.flush_interval)
+        if due:
+            self.flush()
+
+    def pending_for(self, product_id):
+        return self.pending.get(product_id, 0)
+
+    def flush(self):
+        with self.lock:
+            batch, self.pending = self.pending, Counter()
+            self.last_flush = monotonic()
+        if not batch:
+            return 0
+        if self.database != current_database():
+            logger.warning('Просмотры для базы %s отброшены: подключение указывает на другую базу', self.database)
+            return 0
+        try:
+            write_views(batch)
+        except DatabaseError:
+            logger.exception('Не удалось записать просмотры, они будут повторены позже')
+            with self.lock:
+                self.pending.update(batch)
+            return 0
+        return sum(batch.values())
+
+    def _append(self, lines):
+        with open(self.spill_file, 'a', encoding='utf-8') as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def spill(self):
+        with self.lock:
+            batch, self.pending = self.pending, Counter()
+        if not batch or not self.spill_file or self.database != current_database():
+            return
+        counts = {str(pk): count for pk, count in batch.items()}
+        self._append([json.dumps({'db': self.database, 'views': counts}) + '\n'])
+
+    def restore(self):
+        """Забирает просмотры, которые прошлые процессы сохранили в spill_file для текущей базы."""
+        if not self.spill_file:
+            return
+        claimed = '%s.%s' % (self.spill_file, os.getpid())
+        try:
+            # Переименование атомарно, поэтому файл заберёт только один из воркеров
+            os.replace(self.spill_file, claimed)
+        except FileNotFoundError:
+            return
+        foreign = []
+        with open(claimed, encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                batch = json.loads(line)
+                if batch['db'] != self.database:
+                    foreign.append(line)
+                    continue
+                with self.lock:
+                    self.pending.update({int(pk): count for pk, count in batch['views'].items()})
+        if foreign:
+            self._append(foreign)
+        os.remove(claimed)
+
+    def shutdown(self):
+        self.flush()
+        self.spill()
+
+
+_view_counter = None
+_view_counter_lock = threading.Lock()
+
+
+def create_view_counter():
+    """
+    Буфер по настройкам VIEW_COUNTER_*. С VIEW_COUNTER_WRITE_BEHIND = False (так делают тесты)
+    буфер не сбрасывается по таймеру, не пишет spill-файл и не регистрирует сброс в atexit:
+    просмотры живут только в памяти и уходят в базу по flush_size или явным flush().
+    """
+    if not getattr(settings, 'VIEW_COUNTER_WRITE_BEHIND', True):
+        return ViewCounter(flush_interval=None, flush_size=getattr(settings, 'VIEW_COUNTER_FLUSH_SIZE', 100))
+    counter = ViewCounter(
+        flush_interval=getattr(settings, 'VIEW_COUNTER_FLUSH_INTERVAL', 10),
+        flush_size=getattr(settings, 'VIEW_COUNTER_FLUSH_SIZE', 100),
+        spill_file=getattr(settings, 'VIEW_COUNTER_SPILL_FILE',
+                           os.path.join(tempfile.gettempdir(), 'myshop-views.jsonl')),
+    )
+    atexit.register(counter.shutdown)
+    return counter
+
+
+def get_view_counter():
+    """Общий буфер просмотров процесса; создаётся при первом обращении."""
+    global _view_counter
+    if _view_counter is None:
+        with _view_counter_lock:
+            if _view_counter is None:
+                _view_counter = create_view_counter()
+    return _view_counter
+
+
+def set_view_counter(counter):
+    """Подменяет общий буфер (например, в тестах) и возвращает прежний."""
+    global _view_counter
+    previous, _view_counter = _view_counter, counter
+    return previous
+
+
+def reset_view_counter(setting, **kwargs):
+    """После смены настроек VIEW_COUNTER_* (override_settings) буфер создаётся заново."""
+    if setting.startswith('VIEW_COUNTER_'):
+        set_view_counter(None)
+
+
+setting_changed.connect(reset_view_counter)
@@ -1,7 +1,9 @@
 from django import forms
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm, PasswordChangeForm, PasswordResetForm
 from django.core.exceptions import ValidationError
+from django.template import loader
 
+from .mail import queue_email
 from .models import *
 
 
@@ -85,3 +87,16 @@ class ChangePasswordForm(PasswordChangeForm):
         model = User
         fields = ('old_password', 'new_password1', 'new_password2')
 
+
+class OutboxPasswordResetForm(PasswordResetForm):
+    """Письмо для сброса пароля не отправляется сразу, а ставится в очередь."""
+
+    def send_mail(self, subject_template_name, email_template_name,
+                  context, from_email, to_email, html_email_template_name=None):
+        subject = loader.render_to_string(subject_template_name, context)
+        subject = ''.join(subject.splitlines())
+        body = loader.render_to_string(email_template_name, context)
+        html_body = ''
+        if html_email_template_name is not None:
+            html_body = loader.render_to_string(html_email_template_name, context)
+        queue_email(subject, body, to_email, from_email=from_email, html_body=html_body)
@@ -0,0 +1,91 @@
+import os
+import threading
+from time import time
+
+from django.conf import settings
+from django.core import checks
+from django.core.exceptions import ImproperlyConfigured
+
+# 64-битный идентификатор: миллисекунды от EPOCH (41 бит), номер процесса (10 бит), счётчик (12 бит).
+# Идентификаторы растут со временем и не повторяются между процессами без обращения к базе.
+# Они больше 2 ** 53, поэтому в JSON для JavaScript их нужно отдавать строками.
+EPOCH = 1609459200000
+WORKER_BITS = 10
+SEQUENCE_BITS = 12
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+
+MAX_WORKER = (1 << WORKER_BITS) - 1
+
+
+def id_worker():
+    """
+    Номер процесса из настройки ID_WORKER, а без неё - из pid. pid различаются только внутри
+    одного хоста, поэтому при нескольких хостах ID_WORKER обязателен.
+    """
+    worker = getattr(settings, 'ID_WORKER', None)
+    if worker is None:
+        return os.getpid() & MAX_WORKER
+    if not 0 <= worker <= MAX_WORKER:
+        raise ImproperlyConfigured('ID_WORKER должен быть от 0 до %s.' % MAX_WORKER)
+    return worker
+
+
+@checks.register()
+def check_id_worker(app_configs, **kwargs):
+    if getattr(settings, 'ID_WORKER', None) is None and not settings.DEBUG:
+        return [checks.Warning(
+            'ID_WORKER не задан, номер процесса для идентификаторов берётся из pid.',
+            hint='На нескольких хостах pid совпадают: задайте каждому воркеру свой ID_WORKER от 0 до %s.'
+                 % MAX_WORKER,
+            id='accounts.W002',
+        )]
+    return []
+
+
+class IdGenerator:
+    """
+    Номер процесса определяется при первом идентификаторе, а не при импорте: серверы с pre-fork
+    (gunicorn --preload) импортируют код до fork, и все воркеры получили бы номер мастера.
+    """
+
+    def __init__(self, worker=None):
+        self.explicit_worker = worker
+        self.reset()
+
+    def reset(self):
+        self.lock = threading.Lock()
+        self.worker = self.explicit_worker
+        self.last = 0
+        self.sequence = 0
+
+    def __call__(self):
+        with self.lock:
+            if self.worker is None:
+                self.worker = id_worker()
+            now = int(time() * 1000)
+            if now <= self.last:
+                # Часы не сдвинулись (или ушли назад): продолжаем счётчик от последней миллисекунды
+                now = self.last
+                self.sequence = (self.sequence + 1) & MAX_SEQUENCE
+                if self.sequence == 0:
+                    now += 1
+            else:
+                self.sequence = 0
+            self.last = now
+            return ((now - EPOCH) << (WORKER_BITS + SEQUENCE_BITS)) | (self.worker << SEQUENCE_BITS) | self.sequence
+
+
+next_id = IdGenerator()
+# Дочерний процесс после fork определяет номер заново и начинает счётчик с нуля
+os.register_at_fork(after_in_child=next_id.reset)
+
+
+def base36(number):
+    result = ''
+    while True:
+        number, digit = divmod(number, 36)
+        result = DIGITS[digit] + result
+        if not number:
+            return result
@@ -0,0 +1,77 @@
+import logging
+import os
+import re
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Ширины уменьшенных копий: превью в списках выводятся не шире 300px, 600 - для экранов с плотностью 2x
+VARIANT_WIDTHS = (150, 300, 600)
+VARIANT_FORMATS = (('webp', 'WEBP'), ('jpg', 'JPEG'))
+QUALITY = 80
+
+
+def variant_name(name, width, ext):
+    root, _ = os.path.splitext(name)
+    return '%s_w%s.%s' % (root, width, ext)
+
+
+def variant_widths(width):
+    """Ширины, для которых есть копии. Увеличенных копий не делаем."""
+    if not width:
+        return []
+    return [w for w in VARIANT_WIDTHS if w < width]
+
+
+def remove_stale_variants(name, keep):
+    """Удаляет копии файла name, которых нет в keep: ширины и форматы прошлых настроек."""
+    directory, basename = os.path.split(name)
+    root, _ = os.path.splitext(basename)
+    pattern = re.compile(r'%s_w\d+\.\w+$' % re.escape(root))
+    try:
+        files = default_storage.listdir(directory)[1]
+    except (FileNotFoundError, NotImplementedError):
+        return
+    for file in files:
+        path = os.path.join(directory, file)
+        if pattern.match(file) and path not in keep:
+            default_storage.delete(path)
+
+
+def _save(image, name, fmt):
+    buffer = BytesIO()
+    image.save(buffer, fmt, quality=QUALITY, optimize=True)
+    if default_storage.exists(name):
+        default_storage.delete(name)
+    default_storage.save(name, ContentFile(buffer.getvalue()))
+
+
+def build_variants(name):
+    """
+    Создаёт для файла из MEDIA_ROOT копии в WebP и JPEG на каждую ширину из VARIANT_WIDTHS
+    и удаляет копии, оставшиеся от прежних ширин и форматов. Возвращает (ширина, высота) оригинала или None, если файл не читается как изображение.
+    """
+    try:
+        with default_storage.open(name) as f:
+            image = Image.open(f)
+            image = ImageOps.exif_transpose(image)
+            image.load()
+    except (OSError, ValueError):
+        logger.warning('Не удалось открыть изображение %s', name, exc_info=True)
+        return None
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+
+    width, height = image.size
+    saved = set()
+    for target in variant_widths(width):
+        resized = image.resize((target, max(1, round(height * target / width))), Image.LANCZOS)
+        for ext, fmt in VARIANT_FORMATS:
+            saved.add(variant_name(name, target, ext))
+            _save(resized, variant_name(name, target, ext), fmt)
+    remove_stale_variants(name, saved)
+    return width, height
@@ -0,0 +1,191 @@
+import csv
+import json
+import os
+from datetime import date
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import DatabaseError, transaction
+
+from .models import Category, Product, User, get_slug
+from .pagecache import ALL_PAGES, purge
+from .search import index_products
+from .utils import rebuild_category_counts
+
+FALSE_VALUES = {'0', 'false', 'no', 'нет', 'n', ''}
+
+
+class RowError(ValueError):
+    pass
+
+
+def read_rows(path, fmt=None):
+    """Читает CSV (с заголовком) или JSONL. Отдаёт пары (номер строки, словарь или RowError)."""
+    fmt = fmt or ('jsonl' if path.endswith(('.jsonl', '.json')) else 'csv')
+    with open(path, encoding='utf-8-sig', newline='') as file:
+        if fmt == 'csv':
+            reader = csv.DictReader(file)
+            for row in reader:
+                yield reader.line_num, row
+            return
+        for line, text in enumerate(file, 1):
+            if not text.strip():
+                continue
+            try:
+                row = json.loads(text)
+            except ValueError as error:
+                yield line, RowError('некорректный JSON: %s' % error)
+                continue
+            yield line, row if isinstance(row, dict) else RowError('ожидался объект JSON')
+
+
+def _text(row, name, max_length, required=True):
+    value = str(row.get(name) or '').strip()
+    if required and not value:
+        raise RowError('не заполнено поле %s' % name)
+    if len(value) > max_length:
+        raise RowError('поле %s длиннее %s символов' % (name, max_length))
+    return value
+
+
+def _number(row, name, minimum):
+    try:
+        value = float(str(row.get(name)).replace(',', '.'))
+    except (TypeError, ValueError):
+        raise RowError('поле %s должно быть числом' % name)
+    if value != value or value < minimum:
+        raise RowError('поле %s должно быть не меньше %s' % (name, minimum))
+    return value
+
+
+def _flag(row, name):
+    value = row.get(name)
+    if value is None:
+        return True
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() not in FALSE_VALUES
+
+
+class ProductImporter:
+    """
+    Массовая загрузка товаров из строк-словарей с полями title, content, price, number, category
+    (slug или id), creator (имя продавца, если не задан продавец по умолчанию), photo и is_published.
+
+    Строки вставляются пачками через bulk_create, адреса генерирует get_slug без обращений к базе.
+    Сигналы при bulk_create не срабатывают, поэтому счётчики категорий, поисковый индекс и кэш
+    страниц обновляются после каждой пачки и в конце загрузки. Копии фотографий создаёт
+    команда build_thumbnails.
+    """
+
+    def __init__(self, creator=None, photos_dir=None, batch_size=1000, dry_run=False):
+        self.creator = creator
+        self.photos_dir = photos_dir
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.categories = {}
+        for pk, slug in Category.objects.values_list('id', 'slug'):
+            self.categories[slug] = pk
+            self.categories[str(pk)] = pk
+        self.sellers = {}
+        self.created = 0
+        self.errors = []
+        self.touched_categories = set()
+
+    def run(self, rows):
+        """Загружает строки из read_rows. Возвращает (создано товаров, [(номер строки, ошибка), ...])."""
+        batch = []
+        for line, row in rows:
+            batch.append((line, row))
+            if len(batch) >= self.batch_size:
+                self.load_batch(batch)
+                batch = []
+        if batch:
+            self.load_batch(batch)
+        if self.touched_categories:
+            rebuild_category_counts(self.touched_categories)
+            purge(ALL_PAGES)
+        return self.created, self.errors
+
+    def load_batch(self, batch):
+        self.load_sellers(row.get('creator') for line, row in batch if isinstance(row, dict))
+        products = []
+        for line, row in batch:
+            try:
+                if isinstance(row, RowError):
+                    raise row
+                products.append((line, self.build(row)))
+            except RowError as error:
+                self.errors.append((line, str(error)))
+        if products and not self.dry_run:
+            self.insert(products)
+
+    def load_sellers(self, usernames):
+        missing = {str(name).strip() for name in usernames if name} - self.sellers.keys()
+        if missing:
+            self.sellers.update((username, pk) for username, pk in User.objects
+                                .filter(username__in=missing, is_seller=True).values_list('username', 'id'))
+            self.sellers.update((username, None) for username in missing - self.sellers.keys())
+
+    def build(self, row):
+        category = self.categories.get(str(row.get('category') or '').strip())
+        if category is None:
+            raise RowError('категория %r не найдена' % row.get('category'))
+        creator = self.creator
+        if row.get('creator'):
+            creator = self.sellers.get(str(row['creator']).strip())
+            if creator is None:
+                raise RowError('продавец %r не найден' % row['creator'])
+        if creator is None:
+            raise RowError('не указан продавец')
+        title = _text(row, 'title', 255)
+        return Product(title=title, slug=get_slug(title), content=_text(row, 'content', 1000),
+                       price=_number(row, 'price', 1), number=_number(row, 'number', 0),
+                       is_published=_flag(row, 'is_published'), photo=self.photo(row.get('photo')),
+                       category_id=category, creator_id=creator)
+
+    def photo(self, path):
+        """Путь внутри MEDIA_ROOT оставляем как есть, файл из photos_dir копируем в хранилище."""
+        path = str(path or '').strip()
+        if not path:
+            return ''
+        if self.photos_dir:
+            source = os.path.join(self.photos_dir, path)
+            if os.path.isfile(source):
+                if self.dry_run:
+                    return path
+                name = date.today().strftime('photos/%Y/%m/%d/') + os.path.basename(path)
+                with open(source, 'rb') as file:
+                    return default_storage.save(name, File(file))
+        if default_storage.exists(path):
+            return path
+        raise RowError('файл %s не найден' % path)
+
+    def insert(self, products):
+        objects = [product for line, product in products]
+        try:
+            with transaction.atomic():
+                Product.objects.bulk_create(objects)
+        except DatabaseError:
+            # Пачка не вставилась целиком: повторяем по одной строке, чтобы найти виноватые
+            objects = []
+            for line, product in products:
+                try:
+                    with transaction.atomic():
+                        Product.objects.bulk_create([product])
+                except DatabaseError as error:
+                    self.errors.append((line, str(error)))
+                else:
+                    objects.append(product)
+        if not objects:
+            return
+        # SQLite и MySQL не возвращают id из bulk_create, поэтому забираем их по уникальным адресам
+        without_pk = [product for product in objects if product.pk is None]
+        if without_pk:
+            ids = dict(Product.objects.filter(slug__in=[product.slug for product in without_pk])
+                       .values_list('slug', 'id'))
+            for product in without_pk:
+                product.pk = ids[product.slug]
+        index_products(objects, replace=False)
+        self.created += len(objects)
+        self.touched_categories.update(product.category_id for product in objects)
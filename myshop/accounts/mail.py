@@ -0,0 +1,86 @@
+import logging
+from datetime import timedelta
+
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .models import OutgoingEmail
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 8
+RETRY_DELAY = 60
+# Сколько секунд взятая в работу пачка не видна другим обработчикам
+LEASE = 300
+
+
+def queue_email(subject, body, to_email, from_email='', html_body=''):
+    """Кладёт письмо в очередь. Отправит его send_queued_emails из фонового процесса."""
+    return OutgoingEmail.objects.create(subject=subject, body=body, to_email=to_email,
+                                        from_email=from_email or '', html_body=html_body or '')
+
+
+def _claim(batch_size):
+    now = timezone.now()
+    with transaction.atomic():
+        batch = list(OutgoingEmail.objects.select_for_update(skip_locked=True)
+                     .filter(sent_at__isnull=True, attempts__lt=MAX_ATTEMPTS, next_attempt__lte=now)
+                     .order_by('next_attempt')[:batch_size])
+        OutgoingEmail.objects.filter(pk__in=[email.pk for email in batch]) \
+            .update(next_attempt=now + timedelta(seconds=LEASE))
+    return batch
+
+
+def _message(email, connection):
+    message = EmailMultiAlternatives(email.subject, email.body, email.from_email or None, [email.to_email],
+                                     connection=connection)
+    if email.html_body:
+        message.attach_alternative(email.html_body, 'text/html')
+    return message
+
+
+def _retry(email, error):
+    email.attempts += 1
+    email.next_attempt = timezone.now() + timedelta(seconds=RETRY_DELAY * 2 ** (email.attempts - 1))
+    email.last_error = str(error)[:1000]
+
+
+def send_queued_emails(batch_size=100):
+    """
+    Отправляет пачку писем из очереди через одно SMTP-соединение.
+
+    Неотправленные письма откладываются с экспоненциально растущей задержкой
+    (RETRY_DELAY, 2 * RETRY_DELAY, ...), после MAX_ATTEMPTS попыток письмо остаётся в таблице
+    с текстом последней ошибки. Возвращает (отправлено, с ошибкой).
+    """
+    batch = _claim(batch_size)
+    if not batch:
+        return 0, 0
+
+    sent, failed = [], []
+    connection = get_connection()
+    try:
+        connection.open()
+    except Exception as error:
+        logger.exception('Не удалось подключиться к почтовому серверу')
+        for email in batch:
+            _retry(email, error)
+        failed = batch
+    else:
+        try:
+            for email in batch:
+                try:
+                    connection.send_messages([_message(email, connection)])
+                except Exception as error:
+                    logger.warning('Не удалось отправить письмо %s', email.pk, exc_info=True)
+                    _retry(email, error)
+                    failed.append(email)
+                else:
+                    sent.append(email.pk)
+        finally:
+            connection.close()
+
+    OutgoingEmail.objects.filter(pk__in=sent).update(sent_at=timezone.now())
+    OutgoingEmail.objects.bulk_update(failed, ['attempts', 'next_attempt', 'last_error'])
+    return len(sent), len(failed)
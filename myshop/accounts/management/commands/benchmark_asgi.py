@@ -0,0 +1,38 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.test.utils import setup_test_environment
+
+from accounts.benchmarks import run_concurrency_benchmark
+from accounts.models import User
+
+MODES = ('wsgi', 'asgi', 'asgi-async')
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает пропускную способность и время ответа страниц каталога, товара и корзины через WSGI, '
+            'ASGI и асинхронные view под ASGI')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=400, help='Запросов на каждый прогон')
+        parser.add_argument('--concurrency', default='1,8,32',
+                            help='Числа одновременных клиентов через запятую')
+        parser.add_argument('--modes', default=','.join(MODES))
+        parser.add_argument('--username', default='bench-buyer')
+        parser.add_argument('--output', default=None, help='Сохранить отчёт в JSON')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        user, created = User.objects.get_or_create(username=options['username'],
+                                                   defaults={'email': 'bench-buyer@example.com'})
+        report = []
+        for concurrency in [int(value) for value in options['concurrency'].split(',')]:
+            for mode in options['modes'].split(','):
+                stats = run_concurrency_benchmark(user, mode, concurrency, options['requests'])
+                report.append({'mode': mode, 'concurrency': concurrency, **stats})
+                self.stdout.write('%-10s x%-3s %8.1f rps  p50 %8.2f ms  p95 %8.2f ms  ошибок %s' % (
+                    mode, concurrency, stats['rps'], stats['p50_ms'], stats['p95_ms'], stats['errors']))
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            self.stdout.write(self.style.SUCCESS('Отчёт сохранён в %s' % options['output']))
@@ -0,0 +1,24 @@
+from time import monotonic
+
+from django.core.management.base import BaseCommand
+
+from accounts.recommendations import CHUNK_SIZE, MAX_BASKET, MIN_ORDERS, TOP_K, build_recommendations
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает рекомендации «С этим товаром покупают» по оплаченным заказам'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=TOP_K, help='Сколько соседей хранить для товара')
+        parser.add_argument('--min-orders', type=int, default=MIN_ORDERS,
+                            help='Минимум совместных заказов для пары')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                            help='Сколько строк заказов обрабатывать за раз')
+        parser.add_argument('--max-basket', type=int, default=MAX_BASKET,
+                            help='Заказы с большим числом товаров пропускаются')
+
+    def handle(self, *args, **options):
+        start = monotonic()
+        written = build_recommendations(options['top'], options['min_orders'], options['chunk_size'],
+                                        options['max_basket'])
+        self.stdout.write(self.style.SUCCESS('Рекомендаций: %s, %.1f с' % (written, monotonic() - start)))
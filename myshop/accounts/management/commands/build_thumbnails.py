@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from accounts.images import build_variants
+from accounts.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Создаёт уменьшенные копии фотографий товаров и сохраняет их размеры'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Обработать все фотографии, а не только те, у которых нет размеров')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        products = Product.objects.exclude(photo='').only('id', 'photo')
+        if not options['all']:
+            products = products.filter(photo_width__isnull=True)
+
+        sizes = {}
+        batch = []
+        processed = failed = 0
+        for product in products.iterator(chunk_size=options['batch_size']):
+            name = product.photo.name
+            if name not in sizes:
+                sizes[name] = build_variants(name)
+            if sizes[name] is None:
+                failed += 1
+                continue
+            product.photo_width, product.photo_height = sizes[name]
+            batch.append(product)
+            if len(batch) >= options['batch_size']:
+                Product.objects.bulk_update(batch, ['photo_width', 'photo_height'])
+                processed += len(batch)
+                batch = []
+        Product.objects.bulk_update(batch, ['photo_width', 'photo_height'])
+        processed += len(batch)
+        self.stdout.write(self.style.SUCCESS('Обработано: %s, с ошибками: %s' % (processed, failed)))
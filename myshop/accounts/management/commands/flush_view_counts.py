@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from accounts.counters import current_database, get_view_counter
+
+
+class Command(BaseCommand):
+    help = 'Записывает в базу просмотры, сохранённые в файл остановленными процессами'
+
+    def handle(self, *args, **options):
+        view_counter = get_view_counter()
+        view_counter.database = current_database()
+        view_counter.restore()
+        written = view_counter.flush()
+        self.stdout.write(self.style.SUCCESS('Записано просмотров: %s' % written))
@@ -0,0 +1,91 @@
+import random
+from time import time
+
+from django.core.management.base import BaseCommand
+
+from accounts.models import Category, Order, OrderHeader, Product, User
+from accounts.utils import rebuild_category_counts
+
+WORDS = ['Видеокарта', 'Процессор', 'Монитор', 'Клавиатура', 'Мышь', 'Ноутбук', 'Накопитель', 'Память',
+         'Корпус', 'Блок питания', 'Кулер', 'Роутер', 'Наушники', 'Колонки', 'Веб-камера']
+ADJECTIVES = ['игровой', 'офисный', 'тихий', 'быстрый', 'компактный', 'беспроводной', 'новый', 'мощный']
+
+
+class Command(BaseCommand):
+    help = 'Заполняет базу синтетическим каталогом для нагрузочных тестов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sellers', type=int, default=10000)
+        parser.add_argument('--categories', type=int, default=50)
+        parser.add_argument('--products', type=int, default=500000)
+        parser.add_argument('--orders', type=int, default=1000000, help='Количество строк заказов')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--prefix', default=None, help='Префикс имён и адресов, по умолчанию bench<время>')
+
+    def handle(self, *args, **options):
+        self.rnd = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        prefix = options['prefix'] or 'bench%s' % int(time())
+
+        sellers = self.create_sellers(prefix, options['sellers'])
+        categories = self.create_categories(prefix, options['categories'])
+        products = self.create_products(prefix, options['products'], sellers, categories)
+        self.create_orders(options['orders'], products)
+        rebuild_category_counts()
+        self.stdout.write(self.style.SUCCESS('Каталог %s создан' % prefix))
+
+    def bulk(self, model, objects):
+        batch = []
+        for obj in objects:
+            batch.append(obj)
+            if len(batch) >= self.batch_size:
+                model.objects.bulk_create(batch)
+                batch = []
+        model.objects.bulk_create(batch)
+
+    def create_sellers(self, prefix, count):
+        self.bulk(User, (User(username='%s-seller%s' % (prefix, i), email='%s-seller%s@example.com' % (prefix, i),
+                              password='!', is_seller=True)
+                         for i in range(count)))
+        self.stdout.write('Продавцов: %s' % count)
+        return list(User.objects.filter(username__startswith=prefix + '-seller').values_list('id', flat=True))
+
+    def create_categories(self, prefix, count):
+        self.bulk(Category, (Category(name='%s %s' % (self.rnd.choice(WORDS), i), slug='%s-category%s' % (prefix, i))
+                             for i in range(count)))
+        self.stdout.write('Категорий: %s' % count)
+        return list(Category.objects.filter(slug__startswith=prefix + '-category').values_list('id', flat=True))
+
+    def create_products(self, prefix, count, sellers, categories):
+        rnd = self.rnd
+        self.bulk(Product, (Product(title='%s %s %s' % (rnd.choice(WORDS), rnd.choice(ADJECTIVES), i),
+                                    slug='%s-product%s' % (prefix, i),
+                                    content=' '.join(rnd.choice(ADJECTIVES) for _ in range(20)),
+                                    price=rnd.randint(100, 100000), number=rnd.randint(0, 100),
+                                    views=int(rnd.paretovariate(1.2)) - 1, is_published=rnd.random() < 0.95,
+                                    category_id=rnd.choice(categories), creator_id=rnd.choice(sellers))
+                            for i in range(count)))
+        self.stdout.write('Товаров: %s' % count)
+        return list(Product.objects.filter(slug__startswith=prefix + '-product')
+                    .values_list('id', 'creator_id', 'price'))
+
+    def create_orders(self, count, products):
+        rnd = self.rnd
+        created = 0
+        while created < count:
+            headers, lines = [], []
+            while created < count and len(lines) < self.batch_size:
+                header = OrderHeader()
+                paid = rnd.random() < 0.7
+                for _ in range(min(rnd.randint(1, 5), count - created)):
+                    product_id, seller_id, price = rnd.choice(products)
+                    number = rnd.randint(1, 3)
+                    header.total += price * number
+                    lines.append(Order(header_id=header.pk, order_number=header.pk, name_seller_id=seller_id,
+                                       product_id=product_id, price=price, number=number, paid=paid))
+                    created += 1
+                headers.append(header)
+            OrderHeader.objects.bulk_create(headers)
+            Order.objects.bulk_create(lines)
+        self.stdout.write('Строк заказов: %s' % count)
@@ -0,0 +1,44 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.imports import ProductImporter, read_rows
+from accounts.models import User
+
+
+class Command(BaseCommand):
+    help = 'Загружает товары из CSV или JSONL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], default=None,
+                            help='По умолчанию определяется по расширению файла')
+        parser.add_argument('--creator', default=None,
+                            help='Продавец для строк без поля creator')
+        parser.add_argument('--photos-dir', default=None,
+                            help='Каталог, относительно которого указаны пути фотографий')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help='Только проверить строки')
+
+    def handle(self, *args, **options):
+        creator = None
+        if options['creator']:
+            creator = User.objects.filter(username=options['creator'], is_seller=True) \
+                .values_list('id', flat=True).first()
+            if creator is None:
+                raise CommandError('Продавец %s не найден' % options['creator'])
+
+        start = perf_counter()
+        importer = ProductImporter(creator=creator, photos_dir=options['photos_dir'],
+                                   batch_size=options['batch_size'], dry_run=options['dry_run'])
+        try:
+            created, errors = importer.run(read_rows(options['path'], options['format']))
+        except OSError as error:
+            raise CommandError(error)
+
+        for line, message in errors:
+            self.stderr.write('Строка %s: %s' % (line, message))
+        self.stdout.write(self.style.SUCCESS('Загружено товаров: %s, строк с ошибками: %s, %.1f с'
+                                             % (created, len(errors), perf_counter() - start)))
+        if created and options['photos_dir']:
+            self.stdout.write('Уменьшенные копии фотографий создаст команда build_thumbnails')
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from accounts.utils import rebuild_category_counts
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает количество опубликованных товаров в категориях'
+
+    def handle(self, *args, **options):
+        changed = rebuild_category_counts()
+        self.stdout.write(self.style.SUCCESS('Исправлено счётчиков: %s' % changed))
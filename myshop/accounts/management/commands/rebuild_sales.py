@@ -0,0 +1,19 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from accounts.models import ProductDailySales, SellerDailySales
+from accounts.sales import rebuild_sales
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает дневные сводки продаж по оплаченным заказам'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=date.fromisoformat, default=None,
+                            help='Пересчитать начиная с дня ГГГГ-ММ-ДД, по умолчанию - всё')
+
+    def handle(self, *args, **options):
+        rebuild_sales(options['since'])
+        self.stdout.write(self.style.SUCCESS('Сводок продавцов: %s, товаров: %s' % (
+            SellerDailySales.objects.count(), ProductDailySales.objects.count())))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from accounts.models import Product
+from accounts.search import index_products
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает поисковый индекс по всем товарам'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        products = Product.objects.only('id', 'title', 'content').order_by('id')
+        indexed = terms = 0
+        batch = []
+        for product in products.iterator(chunk_size=batch_size):
+            batch.append(product)
+            if len(batch) >= batch_size:
+                terms += index_products(batch)
+                indexed += len(batch)
+                batch = []
+        if batch:
+            terms += index_products(batch)
+            indexed += len(batch)
+        self.stdout.write(self.style.SUCCESS('Проиндексировано товаров: %s, слов: %s' % (indexed, terms)))
@@ -0,0 +1,24 @@
+from time import sleep
+
+from django.core.management.base import BaseCommand
+
+from accounts.stock import release_expired_reservations
+
+
+class Command(BaseCommand):
+    help = 'Возвращает на склад товар из неоплаченных заказов с истёкшим резервом. С --loop работает постоянно'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--loop', action='store_true', help='Не завершаться, а проверять заказы постоянно')
+        parser.add_argument('--interval', type=float, default=30, help='Пауза в секундах, когда освобождать нечего')
+
+    def handle(self, *args, **options):
+        while True:
+            released = release_expired_reservations(options['batch_size'])
+            if released:
+                self.stdout.write('Освобождено строк заказов: %s' % released)
+            if not options['loop'] and released < options['batch_size']:
+                break
+            if released < options['batch_size']:
+                sleep(options['interval'])
@@ -0,0 +1,43 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.test.utils import setup_test_environment
+
+from accounts.benchmarks import compare_reports, run_benchmarks
+from accounts.models import User
+
+
+class Command(BaseCommand):
+    help = ('Прогоняет сценарий покупателя через тестовый клиент и сохраняет p50/p95 времени ответа, '
+            'число и время SQL-запросов по каждому адресу. Создаёт настоящие заказы в текущей базе')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--username', default='bench-buyer')
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--output', default='benchmark.json')
+        parser.add_argument('--compare', default=None, help='Отчёт прошлого прогона для сравнения')
+
+    def handle(self, *args, **options):
+        # Тестовому клиенту нужны testserver в ALLOWED_HOSTS и сохранение контекста шаблонов
+        setup_test_environment()
+        user, created = User.objects.get_or_create(username=options['username'],
+                                                   defaults={'email': 'bench-buyer@example.com'})
+        client = Client()
+        client.force_login(user)
+
+        report = run_benchmarks(client, options['iterations'], options['seed'])
+        with open(options['output'], 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+        for name, stats in report['endpoints'].items():
+            self.stdout.write('%-13s p50 %8.2f ms  p95 %8.2f ms  queries %3s  sql p50 %8.2f ms' % (
+                name, stats['p50_ms'], stats['p95_ms'], stats['queries_p50'], stats['sql_ms_p50']))
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as f:
+                previous = json.load(f)
+            self.stdout.write('Сравнение с %s:' % options['compare'])
+            for line in compare_reports(previous, report):
+                self.stdout.write(line)
+        self.stdout.write(self.style.SUCCESS('Отчёт сохранён в %s' % options['output']))
@@ -0,0 +1,24 @@
+from time import sleep
+
+from django.core.management.base import BaseCommand
+
+from accounts.mail import send_queued_emails
+
+
+class Command(BaseCommand):
+    help = 'Отправляет письма из очереди. С --loop работает как фоновый обработчик'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--loop', action='store_true', help='Не завершаться, а проверять очередь постоянно')
+        parser.add_argument('--interval', type=float, default=5, help='Пауза в секундах, когда очередь пуста')
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = send_queued_emails(options['batch_size'])
+            if sent or failed:
+                self.stdout.write('Отправлено: %s, с ошибкой: %s' % (sent, failed))
+            if not options['loop']:
+                break
+            if sent + failed < options['batch_size']:
+                sleep(options['interval'])
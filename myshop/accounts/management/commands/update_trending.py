@@ -0,0 +1,22 @@
+from time import sleep
+
+from django.core.management.base import BaseCommand
+
+from accounts.trending import BATCH_SIZE, update_trending
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает сортировку «В тренде» по свежим просмотрам и продажам. С --loop работает постоянно'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--loop', action='store_true', help='Не завершаться, а пересчитывать периодически')
+        parser.add_argument('--interval', type=float, default=600, help='Пауза между пересчётами в секундах')
+
+    def handle(self, *args, **options):
+        while True:
+            changed = update_trending(batch_size=options['batch_size'])
+            self.stdout.write('Обновлено товаров: %s' % changed)
+            if not options['loop']:
+                break
+            sleep(options['interval'])
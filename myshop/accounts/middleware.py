@@ -0,0 +1,135 @@
+import logging
+import re
+import threading
+from collections import Counter, defaultdict
+from contextlib import ExitStack
+from time import perf_counter
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# Допустимое число SQL-запросов на страницу по имени адреса. Тесты проверяют, что бюджет
+# не превышен, а middleware пишет предупреждение в лог, если это случилось на живом сайте.
+QUERY_BUDGETS = getattr(settings, 'QUERY_BUDGETS', {
+    'home': 4,
+    'home_sort_price_down': 4,
+    'home_sort_price_up': 4,
+    'home_sort_trending': 4,
+    'category': 4,
+    'sort_price_down': 4,
+    'sort_price_up': 4,
+    'sort_trending': 4,
+    'product': 4,
+    'search': 5,
+    'profile': 4,
+    'cart:cart_detail': 3,
+    'cart:cart_add': 4,
+    'create_order': 9,
+    'CheckOrder': 10,
+    'dashboard': 5,
+})
+
+IN_LIST_RE = re.compile(r'\(\s*%s(?:\s*,\s*%s)*\s*\)')
+
+
+def fingerprint(sql):
+    """SQL без параметров; списки IN разной длины сводятся к одному виду."""
+    return IN_LIST_RE.sub('(...)', sql)
+
+
+class QueryStats:
+    """Обёртка для connection.execute_wrapper: считает запросы, их время и повторы одинаковых запросов."""
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.time += perf_counter() - start
+            self.fingerprints[fingerprint(sql)] += 1
+
+    @property
+    def duplicates(self):
+        return {sql: count for sql, count in self.fingerprints.items() if count > 1}
+
+
+class QueryReport:
+    """Сводка по всем запросам процесса, сгруппированная по имени адреса."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.pages = defaultdict(lambda: {'requests': 0, 'queries': 0, 'max_queries': 0, 'time': 0.0,
+                                          'over_budget': 0, 'duplicates': Counter()})
+
+    def add(self, url_name, stats, over_budget):
+        with self.lock:
+            page = self.pages[url_name]
+            page['requests'] += 1
+            page['queries'] += stats.count
+            page['max_queries'] = max(page['max_queries'], stats.count)
+            page['time'] += stats.time
+            page['over_budget'] += over_budget
+            page['duplicates'].update(stats.duplicates.keys())
+
+    def as_dict(self):
+        with self.lock:
+            return {url_name: {
+                'requests': page['requests'],
+                'avg_queries': round(page['queries'] / page['requests'], 2),
+                'max_queries': page['max_queries'],
+                'avg_db_ms': round(page['time'] * 1000 / page['requests'], 2),
+                'budget': QUERY_BUDGETS.get(url_name),
+                'over_budget': page['over_budget'],
+                'duplicates': dict(page['duplicates'].most_common(10)),
+            } for url_name, page in self.pages.items()}
+
+
+query_report = QueryReport()
+
+
+def get_url_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else None
+
+
+class QueryCountMiddleware:
+    """
+    Считает SQL-запросы каждого запроса и складывает их в query_report.
+
+    Вне продакшена (DEBUG или QUERY_STATS_HEADERS = True) добавляет заголовки
+    X-DB-Queries, X-DB-Time и X-DB-Duplicates.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = QueryStats()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(stats))
+            response = self.get_response(request)
+
+        url_name = get_url_name(request)
+        budget = QUERY_BUDGETS.get(url_name)
+        over_budget = budget is not None and stats.count > budget
+        if over_budget:
+            logger.warning('%s: %s SQL-запросов при бюджете %s', url_name, stats.count, budget)
+        query_report.add(url_name, stats, over_budget)
+
+        if getattr(settings, 'QUERY_STATS_HEADERS', settings.DEBUG):
+            response['X-DB-Queries'] = str(stats.count)
+            response['X-DB-Time'] = '%.2f' % (stats.time * 1000)
+            response['X-DB-Duplicates'] = str(sum(count - 1 for count in stats.duplicates.values()))
+        return response
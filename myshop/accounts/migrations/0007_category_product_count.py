@@ -0,0 +1,26 @@
+# Generated by Django 3.2.8 on 2026-10-18 12:55
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def fill_product_count(apps, schema_editor):
+    Category = apps.get_model('accounts', 'Category')
+    for category in Category.objects.annotate(published=Count('product', filter=Q(product__is_published=True))):
+        Category.objects.filter(pk=category.pk).update(product_count=category.published)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0006_auto_20230127_1227'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='product_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Опубликовано товаров'),
+        ),
+        migrations.RunPython(fill_product_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 3.2.8 on 2026-10-18 13:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0012_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='reserved_until',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Товар зарезервирован до'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('paid', False), ('reserved_until__isnull', False)), fields=['reserved_until'], name='order_reservation_idx'),
+        ),
+    ]
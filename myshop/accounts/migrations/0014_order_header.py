@@ -0,0 +1,52 @@
+# Generated by Django 3.2.8 on 2026-10-18 13:31
+
+import accounts.models
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import F, FloatField, Sum
+
+
+def create_headers(apps, schema_editor):
+    # Старые номера заказов - секунды от 1970 года, они меньше любых номеров next_id
+    Order = apps.get_model('accounts', 'Order')
+    OrderHeader = apps.get_model('accounts', 'OrderHeader')
+    numbers = (Order.objects.values('order_number').order_by('order_number')
+               .annotate(total=Sum(F('price') * F('number'), output_field=FloatField())))
+    OrderHeader.objects.bulk_create([OrderHeader(id=row['order_number'], total=row['total']) for row in numbers],
+                                    batch_size=1000)
+    Order.objects.update(header=F('order_number'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0013_order_reservation'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='order_number',
+            field=models.BigIntegerField(db_index=True, verbose_name='Номер заказа'),
+        ),
+        migrations.CreateModel(
+            name='OrderHeader',
+            fields=[
+                ('id', models.BigIntegerField(default=accounts.models.new_order_id, editable=False, primary_key=True, serialize=False, verbose_name='Номер заказа')),
+                ('total', models.FloatField(default=0, verbose_name='Сумма')),
+                ('time_create', models.DateTimeField(auto_now_add=True, verbose_name='Время оформления')),
+                ('buyer', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='orders', to=settings.AUTH_USER_MODEL, verbose_name='Покупатель')),
+            ],
+            options={
+                'verbose_name': 'Заказ покупателя',
+                'verbose_name_plural': 'Заказы покупателей',
+            },
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='header',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='lines', to='accounts.orderheader', verbose_name='Заказ'),
+        ),
+        migrations.RunPython(create_headers, migrations.RunPython.noop),
+    ]
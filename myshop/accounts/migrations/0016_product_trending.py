@@ -0,0 +1,43 @@
+# Generated by Django 3.2.8 on 2026-10-18 13:42
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def mark_views_seen(apps, schema_editor):
+    # Накопленные до этого просмотры не считаются свежими, иначе старые товары сразу попадут в тренд
+    apps.get_model('accounts', 'Product').objects.update(views_seen=F('views'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0015_product_recommendations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='trend_views',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='trending',
+            field=models.FloatField(default=0, editable=False, verbose_name='Тренд'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='views_seen',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_published', True)), fields=['-trending', '-id'], name='product_trending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_published', True)), fields=['category', '-trending', '-id'], name='product_cat_trending_idx'),
+        ),
+        migrations.RunPython(mark_views_seen, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.2.8 on 2026-10-18 13:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0016_product_trending'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrendingState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_run', models.FloatField(verbose_name='Последний пересчёт (Unix-время)')),
+            ],
+            options={
+                'verbose_name': 'Состояние тренда',
+                'verbose_name_plural': 'Состояние тренда',
+            },
+        ),
+    ]
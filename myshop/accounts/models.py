@@ -1,15 +1,23 @@
 from django.db import models
+from django.db.models import Q
 from django.contrib.auth.models import AbstractUser
 from django.urls import reverse
+from django.utils import timezone
 from django.core.validators import MinValueValidator, MaxValueValidator
-from transliterate import slugify, translit
-from time import time
+from django.utils.text import slugify
+from transliterate import get_translit_function
+
+from .ids import base36, next_id
+
+# Один экземпляр языкового пакета: translit() создаёт новый на каждый вызов, а это заметно при массовой загрузке
+translit_ru = get_translit_function('ru')
 
 
 def get_slug(s):
-    new_slug = translit(s, 'ru')
-    new_slug = slugify(new_slug)
-    return new_slug + '-' + str(int(time()))
+    """Адрес из названия и уникального суффикса next_id: одинаковые названия не конфликтуют даже в одну секунду."""
+    new_slug = translit_ru(translit_ru(s), reversed=True)
+    new_slug = slugify(new_slug) or 'product'
+    return new_slug[:240] + '-' + base36(next_id())
 
 
 class Product(models.Model):
@@ -19,10 +27,16 @@ class Product(models.Model):
     price = models.FloatField(max_length=10, verbose_name="Цена", validators=[MinValueValidator(1)])
     number = models.FloatField(max_length=10, verbose_name="Количество", validators=[MinValueValidator(0)])
     photo = models.ImageField(upload_to="photos/%Y/%m/%d/", verbose_name="Фотограция")
+    photo_width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    photo_height = models.PositiveIntegerField(null=True, blank=True, editable=False)
     time_create = models.DateTimeField(auto_now_add=True)
     time_update = models.DateTimeField(auto_now=True)
     is_published = models.BooleanField(default=True, verbose_name="Опубликовано")
     views = models.PositiveIntegerField(default=0, verbose_name="Просмотров")
+    # Сортировка «В тренде»: пересчитывается пачками командой update_trending (см. accounts.trending)
+    trending = models.FloatField(default=0, editable=False, verbose_name="Тренд")
+    trend_views = models.FloatField(default=0, editable=False)
+    views_seen = models.PositiveIntegerField(default=0, editable=False)
     category = models.ForeignKey('Category', on_delete=models.PROTECT, verbose_name="Категория")
     creator = models.ForeignKey('User', on_delete=models.PROTECT, default=1, verbose_name="Создатель")
 
@@ -41,11 +55,25 @@ class Product(models.Model):
         verbose_name = 'Товары'
         verbose_name_plural = 'Товары'
         # ordering = ['-views']
+        # Порядок полей совпадает с сортировками каталога (CATALOG_SORTS) вместе с id для курсора.
+        # Индексы частичные: в каталоге бывают только опубликованные товары
+        indexes = [
+            models.Index(fields=['-views', '-id'], name='product_views_idx', condition=Q(is_published=True)),
+            models.Index(fields=['price', 'id'], name='product_price_idx', condition=Q(is_published=True)),
+            models.Index(fields=['category', '-views', '-id'], name='product_cat_views_idx',
+                         condition=Q(is_published=True)),
+            models.Index(fields=['category', 'price', 'id'], name='product_cat_price_idx',
+                         condition=Q(is_published=True)),
+            models.Index(fields=['-trending', '-id'], name='product_trending_idx', condition=Q(is_published=True)),
+            models.Index(fields=['category', '-trending', '-id'], name='product_cat_trending_idx',
+                         condition=Q(is_published=True)),
+        ]
 
 
 class Category(models.Model):
     name = models.CharField(max_length=100, db_index=True, verbose_name="Категория")
     slug = models.SlugField(max_length=255, unique=True, db_index=True, verbose_name="URL")
+    product_count = models.PositiveIntegerField(default=0, editable=False, verbose_name="Опубликовано товаров")
 
     def __str__(self):
         return self.name
@@ -81,15 +109,130 @@ class User(AbstractUser):
         return reverse('profile', kwargs={'profile_id': self.pk})
 
 
+def new_order_id():
+    return next_id()
+
+
+class OrderHeader(models.Model):
+    # Номер заказа выдаёт next_id без обращения к базе: он уникален, растёт со временем и виден покупателю
+    id = models.BigIntegerField(primary_key=True, default=new_order_id, editable=False, verbose_name="Номер заказа")
+    buyer = models.ForeignKey('User', on_delete=models.PROTECT, null=True, blank=True, related_name='orders',
+                              verbose_name="Покупатель")
+    total = models.FloatField(default=0, verbose_name="Сумма")
+    time_create = models.DateTimeField(auto_now_add=True, verbose_name="Время оформления")
+
+    def __str__(self):
+        return str(self.id)
+
+    class Meta:
+        verbose_name = 'Заказ покупателя'
+        verbose_name_plural = 'Заказы покупателей'
+
+
 class Order(models.Model):
+    header = models.ForeignKey('OrderHeader', on_delete=models.PROTECT, null=True, blank=True,
+                               related_name='lines', verbose_name="Заказ")
     name_seller = models.ForeignKey('User', on_delete=models.PROTECT, verbose_name="Продавец", default="0")
     product = models.ForeignKey('Product', on_delete=models.PROTECT, verbose_name="Товар")
     price = models.FloatField(max_length=10, verbose_name="Цена", validators=[MinValueValidator(1)])
     number = models.FloatField(max_length=10, verbose_name="Количество", validators=[MinValueValidator(0)])
     paid = models.BooleanField(default=False, verbose_name="Оплата")
-    order_number = models.FloatField(verbose_name="Номер заказа")
+    # Совпадает с header_id, по нему платёжная система сообщает об оплате
+    order_number = models.BigIntegerField(db_index=True, verbose_name="Номер заказа")
+    paid_at = models.DateTimeField(null=True, blank=True, verbose_name="Время оплаты")
+    reserved_until = models.DateTimeField(null=True, blank=True, verbose_name="Товар зарезервирован до")
 
     class Meta:
         verbose_name = 'Заказ'
         verbose_name_plural = 'Заказы'
+        indexes = [
+            models.Index(fields=['reserved_until'], name='order_reservation_idx',
+                         condition=Q(paid=False, reserved_until__isnull=False)),
+        ]
+
+
+class SellerDailySales(models.Model):
+    seller = models.ForeignKey('User', on_delete=models.CASCADE, related_name='daily_sales', verbose_name="Продавец")
+    day = models.DateField(verbose_name="День")
+    units = models.FloatField(default=0, verbose_name="Продано единиц")
+    revenue = models.FloatField(default=0, verbose_name="Выручка")
+    orders = models.PositiveIntegerField(default=0, verbose_name="Заказов")
+
+    class Meta:
+        verbose_name = 'Продажи продавца за день'
+        verbose_name_plural = 'Продажи продавцов по дням'
+        unique_together = ('seller', 'day')
+
+
+class ProductDailySales(models.Model):
+    product = models.ForeignKey('Product', on_delete=models.CASCADE, related_name='daily_sales', verbose_name="Товар")
+    seller = models.ForeignKey('User', on_delete=models.CASCADE, related_name='product_daily_sales',
+                               verbose_name="Продавец")
+    day = models.DateField(verbose_name="День")
+    units = models.FloatField(default=0, verbose_name="Продано единиц")
+    revenue = models.FloatField(default=0, verbose_name="Выручка")
+
+    class Meta:
+        verbose_name = 'Продажи товара за день'
+        verbose_name_plural = 'Продажи товаров по дням'
+        unique_together = ('product', 'day')
+        indexes = [models.Index(fields=['seller', 'day'], name='product_sales_seller_day_idx')]
 
+
+class ProductRecommendation(models.Model):
+    product = models.ForeignKey('Product', on_delete=models.CASCADE, related_name='recommendations',
+                                verbose_name="Товар")
+    recommended = models.ForeignKey('Product', on_delete=models.CASCADE, related_name='+',
+                                    verbose_name="Рекомендуемый товар")
+    rank = models.PositiveSmallIntegerField(verbose_name="Место")
+    score = models.FloatField(verbose_name="Близость")
+    orders = models.PositiveIntegerField(verbose_name="Совместных заказов")
+
+    class Meta:
+        verbose_name = 'Рекомендация'
+        verbose_name_plural = 'Рекомендации'
+        unique_together = ('product', 'rank')
+
+
+class TrendingState(models.Model):
+    # Одна строка: время прошлого пересчёта тренда, от него считается затухание в следующем запуске
+    last_run = models.FloatField(verbose_name="Последний пересчёт (Unix-время)")
+
+    class Meta:
+        verbose_name = 'Состояние тренда'
+        verbose_name_plural = 'Состояние тренда'
+
+
+class SearchTerm(models.Model):
+    term = models.CharField(max_length=64, verbose_name="Слово")
+    product = models.ForeignKey('Product', on_delete=models.CASCADE, related_name='search_terms',
+                                verbose_name="Товар")
+    weight = models.PositiveSmallIntegerField(verbose_name="Вес")
+
+    class Meta:
+        verbose_name = 'Поисковый индекс'
+        verbose_name_plural = 'Поисковый индекс'
+        unique_together = ('term', 'product')
+
+
+class OutgoingEmail(models.Model):
+    subject = models.CharField(max_length=255, verbose_name="Тема")
+    body = models.TextField(verbose_name="Текст")
+    html_body = models.TextField(blank=True, verbose_name="HTML")
+    from_email = models.CharField(max_length=254, blank=True, verbose_name="Отправитель")
+    to_email = models.EmailField(max_length=254, verbose_name="Получатель")
+    time_create = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True, verbose_name="Отправлено")
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name="Попыток")
+    next_attempt = models.DateTimeField(default=timezone.now, verbose_name="Следующая попытка")
+    last_error = models.TextField(blank=True, verbose_name="Последняя ошибка")
+
+    def __str__(self):
+        return '%s: %s' % (self.to_email, self.subject)
+
+    class Meta:
+        verbose_name = 'Письмо'
+        verbose_name_plural = 'Очередь писем'
+        indexes = [
+            models.Index(fields=['next_attempt'], name='outbox_pending_idx', condition=models.Q(sent_at__isnull=True)),
+        ]
@@ -0,0 +1,87 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Case, F, FloatField, Value, When
+from django.utils import timezone
+
+from .models import Order, OrderHeader, User
+from .sales import record_sales
+from .stock import OutOfStock, find_shortages, reservation_deadline, reserve_stock
+
+
+def create_order(cart, buyer=None):
+    """
+    Оформляет заказ из корзины и очищает её. Возвращает (номер заказа, сумма) или None для пустой корзины.
+    Номер заказа - id шапки OrderHeader из next_id, строки заказа ссылаются на шапку.
+    Если какого-то товара не хватает, выбрасывает OutOfStock, заказ не создаётся и корзина не меняется.
+
+    Товары корзина загружает одним запросом, продавец берётся из creator_id уже загруженного товара.
+    В одной транзакции товар резервируется одним условным UPDATE (reserve_stock) и все строки заказа
+    вставляются одним bulk_create, поэтому число запросов не зависит от количества позиций.
+    Резерв держится до reserved_until, после чего его снимает release_expired_reservations.
+    """
+    lines = [item for item in cart if 'product' in item]
+    if not lines:
+        return None
+    header = OrderHeader(buyer=buyer, total=float(sum(item['total_price'] for item in lines)))
+    reserved_until = reservation_deadline()
+    quantities = defaultdict(int)
+    for item in lines:
+        quantities[item['product'].pk] += item['quantity']
+    orders = [Order(name_seller_id=item['product'].creator_id, product=item['product'], price=item['price'],
+                    number=item['quantity'], header=header, order_number=header.pk, reserved_until=reserved_until)
+              for item in lines]
+    try:
+        with transaction.atomic():
+            reserve_stock(quantities)
+            header.save(force_insert=True)
+            Order.objects.bulk_create(orders)
+    except OutOfStock:
+        raise OutOfStock(find_shortages(quantities))
+    cart.clear()
+    return header.pk, sum(item['total_price'] for item in lines)
+
+
+def _grouped_delta(amounts):
+    return Case(*[When(pk=pk, then=Value(amount)) for pk, amount in amounts.items()],
+                default=Value(0.0), output_field=FloatField())
+
+
+def settle_order(order_number, amount):
+    """
+    Отмечает заказ оплаченным и зачисляет продавцам выручку. Товар уже списан при оформлении;
+    если резерв успел истечь, товар резервируется заново, а при нехватке заказ не оплачивается.
+
+    Всё делается в одной транзакции несколькими UPDATE над множеством строк: строки заказа
+    блокируются select_for_update и отбираются по paid=False, поэтому повторное или параллельное
+    уведомление об оплате ничего не зачислит второй раз. Продажи попадают в дневные сводки
+    продавцов (record_sales) в той же транзакции. Возвращает True, если заказ был оплачен.
+    """
+    with transaction.atomic():
+        lines = list(Order.objects.select_for_update()
+                     .filter(order_number=order_number, paid=False)
+                     .values_list('id', 'name_seller_id', 'product_id', 'price', 'number', 'reserved_until'))
+        if not lines:
+            return False
+        revenue = defaultdict(float)
+        released = defaultdict(float)
+        for pk, seller_id, product_id, price, number, reserved_until in lines:
+            revenue[seller_id] += price * number
+            if reserved_until is None:
+                released[product_id] += number
+        if amount < sum(revenue.values()):
+            return False
+        if released:
+            try:
+                reserve_stock(released)
+            except OutOfStock:
+                transaction.set_rollback(True)
+                return False
+
+        paid_at = timezone.now()
+        Order.objects.filter(pk__in=[line[0] for line in lines]).update(paid=True, paid_at=paid_at,
+                                                                        reserved_until=None)
+        User.objects.filter(pk__in=revenue).update(balance=F('balance') + _grouped_delta(revenue))
+        record_sales([(seller_id, product_id, price, number, order_number)
+                      for pk, seller_id, product_id, price, number, reserved_until in lines], paid_at)
+    return True
@@ -0,0 +1,141 @@
+from hashlib import md5
+from time import time, time_ns
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache
+from django.http import HttpResponse
+
+PAGE_CACHE_TIMEOUT = getattr(settings, 'PAGE_CACHE_TIMEOUT', 60 * 5)
+ALL_PAGES = 'all'
+# Блок «С этим товаром покупают» есть только на страницах товаров
+RECOMMENDATIONS = 'recommendations'
+# Кэши, которые видит только один процесс: сброс версии в одном воркере или в команде
+# manage.py не дойдёт до остальных воркеров
+PROCESS_LOCAL_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def page_cache_enabled():
+    """
+    Кэш страниц и версии групп работают только с общим для всех процессов кэшем (Redis, Memcached,
+    база, файлы). PAGE_CACHE_ENABLED включает или выключает его явно, например для тестов.
+    """
+    enabled = getattr(settings, 'PAGE_CACHE_ENABLED', None)
+    if enabled is None:
+        enabled = settings.CACHES[DEFAULT_CACHE_ALIAS]['BACKEND'] not in PROCESS_LOCAL_BACKENDS
+    return enabled
+
+
+@checks.register(checks.Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    if getattr(settings, 'PAGE_CACHE_ENABLED', None) is None and not page_cache_enabled():
+        return [checks.Warning(
+            'Кэш по умолчанию виден только одному процессу, кэш страниц каталога отключён.',
+            hint='Настройте в CACHES общий кэш (Redis или Memcached) или задайте PAGE_CACHE_ENABLED.',
+            id='accounts.W001',
+        )]
+    return []
+
+
+def _version_key(group):
+    return 'pagecache:version:%s' % group
+
+
+def home_group():
+    return 'home'
+
+
+def category_group(slug):
+    return 'category:%s' % slug
+
+
+def _versions(group):
+    keys = [_version_key(ALL_PAGES), _version_key(group)]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # Новая версия - текущее время, а не 1: если ключ версии вытеснили из кэша,
+            # старые страницы не должны снова стать доступными
+            versions[key] = time_ns()
+            cache.add(key, versions[key], None)
+    return versions[keys[0]], versions[keys[1]]
+
+
+def last_change(group):
+    """
+    Время последнего сброса страниц группы или всех страниц, в секундах. Без общего кэша версиям
+    верить нельзя, и вместо них возвращается начало текущего периода PAGE_CACHE_TIMEOUT.
+    """
+    if not page_cache_enabled():
+        return time() // PAGE_CACHE_TIMEOUT * PAGE_CACHE_TIMEOUT
+    return max(_versions(group)) / 10 ** 9
+
+
+def purge(*groups):
+    """Делает недействительными все закэшированные страницы групп. Сами страницы истекут по таймауту."""
+    cache.set_many({_version_key(group): time_ns() for group in groups}, None)
+
+
+def page_key(request, group):
+    all_version, group_version = _versions(group)
+    path = md5(request.get_full_path().encode()).hexdigest()
+    return 'pagecache:page:%s:%s:%s:%s' % (group, all_version, group_version, path)
+
+
+def is_cacheable(request):
+    if not page_cache_enabled():
+        return False
+    if request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+        return False
+    return not request.session.get(settings.CART_SESSION_ID)
+
+
+def cached_page(request, group):
+    """
+    (ключ, ответ из кэша или None) для страницы группы group. Ключ None, если страницу
+    этому посетителю кэшировать нельзя.
+    """
+    if not is_cacheable(request):
+        return None, None
+    key = page_key(request, group)
+    cached = cache.get(key)
+    if cached is None:
+        return key, None
+    content, content_type = cached
+    return key, HttpResponse(content, content_type=content_type)
+
+
+def _store(request, key, response):
+    # Страницы с CSRF-токеном или установкой cookie для всех одинаковыми не являются
+    if response.cookies or request.META.get('CSRF_COOKIE_USED'):
+        return
+    cache.set(key, (response.content, response['Content-Type']), PAGE_CACHE_TIMEOUT)
+
+
+def store_page(request, key, response):
+    """Сохраняет страницу под ключом из cached_page, когда шаблон будет отрисован."""
+    if key is not None and response.status_code == 200 and hasattr(response, 'add_post_render_callback'):
+        response.add_post_render_callback(lambda r: _store(request, key, r))
+    return response
+
+
+class PageCacheMixin:
+    """
+    Кэширует страницу целиком для анонимных посетителей с пустой корзиной.
+
+    Ключ строится из полного URL (в нём и сортировка, и курсор страницы) и версий двух групп:
+    группы страницы (get_page_group) и общей группы ALL_PAGES. Сигналы Product и Category
+    сбрасывают версии только затронутых групп.
+    """
+
+    def get_page_group(self):
+        return home_group()
+
+    def dispatch(self, request, *args, **kwargs):
+        key, cached = cached_page(request, self.get_page_group())
+        if cached is not None:
+            return cached
+        return store_page(request, key, super().dispatch(request, *args, **kwargs))
@@ -0,0 +1,201 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
+from collections.abc import Sequence
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class KeysetPage(Sequence):
+    """Страница, которую выдаёт KeysetPaginator. Вместо номеров соседних страниц хранит курсоры."""
+
+    def __init__(self, object_list, number, paginator, has_previous, has_next):
+        self.object_list = object_list
+        self.number = number
+        self.paginator = paginator
+        self._has_previous = has_previous
+        self._has_next = has_next
+
+    def __repr__(self):
+        return '<Page %s (keyset)>' % self.number
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_previous or self._has_next
+
+    @property
+    def next_cursor(self):
+        if not self._has_next:
+            return None
+        return self.paginator.encode_cursor('next', self.number + 1, self.object_list[-1])
+
+    @property
+    def previous_cursor(self):
+        # На первую страницу ведём без курсора, чтобы у неё был один канонический URL
+        if not self._has_previous or self.number <= 2:
+            return None
+        return self.paginator.encode_cursor('prev', self.number - 1, self.object_list[0])
+
+
+class KeysetPaginator:
+    """
+    Постраничная навигация по ключу сортировки вместо OFFSET.
+
+    ordering - список полей как в QuerySet.order_by(), последним должно идти уникальное поле (обычно id),
+    чтобы порядок был стабильным. Каждая страница - это один запрос с WHERE по значениям ключа
+    последней (или первой) записи и LIMIT per_page + 1, поэтому её стоимость не зависит от глубины,
+    а COUNT(*) не выполняется вовсе.
+    """
+
+    def __init__(self, object_list, per_page, ordering):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+        self.ordering = [(field.lstrip('-'), field.startswith('-')) for field in ordering]
+
+    def encode_cursor(self, direction, number, obj):
+        values = [getattr(obj, name) for name, desc in self.ordering]
+        data = json.dumps([direction, number, values], separators=(',', ':'))
+        return urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            data = urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            direction, number, values = json.loads(data)
+        except (BinasciiError, UnicodeDecodeError, ValueError, TypeError):
+            raise InvalidCursor('Неверный курсор')
+        if direction not in ('next', 'prev') or not isinstance(number, int) or number < 1 \
+                or not isinstance(values, list) or len(values) != len(self.ordering):
+            raise InvalidCursor('Неверный курсор')
+        return direction, number, values
+
+    def _seek(self, values, backwards):
+        # (a, b, id) > (x, y, z) разворачивается в a > x OR (a = x AND b > y) OR (a = x AND b = y AND id > z),
+        # направление сравнения для каждого поля берётся из сортировки. PostgreSQL не строит по такому OR
+        # границу поиска в индексе, поэтому перед ним стоит лишнее по смыслу условие a >= x: по нему
+        # индекс начинает чтение сразу с нужного места
+        condition = Q()
+        equal = {}
+        for (name, desc), value in zip(self.ordering, values):
+            lookup = 'lt' if desc != backwards else 'gt'
+            condition |= Q(**equal, **{'%s__%s' % (name, lookup): value})
+            equal[name] = value
+        (name, desc), value = self.ordering[0], values[0]
+        return Q(**{'%s__%s' % (name, 'lte' if desc != backwards else 'gte'): value}) & condition
+
+    def page(self, cursor=None):
+        if cursor:
+            direction, number, values = self.decode_cursor(cursor)
+        else:
+            direction, number, values = 'next', 1, None
+
+        backwards = direction == 'prev'
+        queryset = self.object_list
+        if backwards:
+            queryset = queryset.order_by(*[name if desc else '-' + name for name, desc in self.ordering])
+        else:
+            queryset = queryset.order_by(*['-' + name if desc else name for name, desc in self.ordering])
+        if values is not None:
+            queryset = queryset.filter(self._seek(values, backwards))
+
+        object_list = list(queryset[:self.per_page + 1])
+        has_more = len(object_list) > self.per_page
+        object_list = object_list[:self.per_page]
+
+        if backwards:
+            object_list.reverse()
+            return KeysetPage(object_list, number, self, has_previous=has_more, has_next=True)
+        return KeysetPage(object_list, number, self, has_previous=values is not None, has_next=has_more)
+
+
+# Начиная с какого числа строк точный COUNT(*) заменяется оценкой или закэшированным значением
+ESTIMATE_THRESHOLD = getattr(settings, 'PAGINATOR_ESTIMATE_THRESHOLD', 10000)
+COUNT_CACHE_TIMEOUT = getattr(settings, 'PAGINATOR_COUNT_CACHE_TIMEOUT', 60 * 10)
+
+
+def plain_table_scan(queryset):
+    """True для запроса по всей таблице: без условий, DISTINCT, GROUP BY/HAVING и среза."""
+    query = queryset.query
+    return (not query.where and not query.distinct and not query.group_by and not query.is_sliced
+            and not query.combinator)
+
+
+def estimated_count(queryset):
+    """
+    Оценка числа строк всей таблицы по pg_class.reltuples без COUNT(*). Возвращает None на
+    других базах и для таблиц, которые ещё не анализировались. Для запросов с условиями
+    оценка планировщика бывает неверной на порядки, поэтому они считаются через COUNT.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                       [queryset.model._meta.db_table])
+        row = cursor.fetchone()
+    if row is None or row[0] is None or row[0] <= 0:
+        return None
+    return int(row[0])
+
+
+def count_cache_key(queryset):
+    sql, params = queryset.query.sql_with_params()
+    return 'paginator:count:%s' % md5(repr((queryset.db, sql, params)).encode()).hexdigest()
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Пагинатор для больших списков. Для всей таблицы на PostgreSQL берёт оценку из статистики,
+    если она не меньше ESTIMATE_THRESHOLD. Остальные списки (с фильтрами, группировкой) сначала
+    считаются COUNT по первым ESTIMATE_THRESHOLD + 1 строкам: если строк меньше, это точное число.
+    Иначе выполняется полный COUNT(*), и он хранится в кэше COUNT_CACHE_TIMEOUT секунд.
+    Номера страниц в шаблонах (page_range, num_pages) строятся по этому числу, поэтому
+    последние страницы могут оказаться пустыми.
+    """
+    # True, если count - оценка или значение из кэша, а не результат COUNT(*) этого запроса
+    estimated = False
+
+    @cached_property
+    def count(self):
+        if not hasattr(self.object_list, 'query'):
+            return super().count
+        try:
+            key = count_cache_key(self.object_list)
+        except EmptyResultSet:
+            return 0
+        if plain_table_scan(self.object_list):
+            estimate = estimated_count(self.object_list)
+            if estimate is not None and estimate >= ESTIMATE_THRESHOLD:
+                self.estimated = True
+                return estimate
+        cached = cache.get(key)
+        if cached is not None:
+            self.estimated = True
+            return cached
+        count = self.object_list.order_by()[:ESTIMATE_THRESHOLD + 1].count()
+        if count <= ESTIMATE_THRESHOLD:
+            return count
+        count = super().count
+        cache.set(key, count, COUNT_CACHE_TIMEOUT)
+        return count
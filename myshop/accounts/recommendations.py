@@ -0,0 +1,131 @@
+import numpy as np
+from django.db import transaction
+from django.db.models import Max
+
+from .models import Order, ProductRecommendation
+from .pagecache import RECOMMENDATIONS, purge
+
+TOP_K = 8
+MIN_ORDERS = 2
+CHUNK_SIZE = 200000
+# Большие оптовые заказы дают квадратичное число пар и почти ничего не говорят о связи товаров
+MAX_BASKET = 50
+WRITE_BATCH = 1000
+
+
+def order_chunks(chunk_size=CHUNK_SIZE):
+    """
+    Отдаёт оплаченные строки заказов массивами (номер заказа, товар) примерно по chunk_size строк.
+    Строки читаются по индексу order_number, и заказ никогда не делится между кусками.
+    """
+    lines = (Order.objects.filter(paid=True).order_by('order_number')
+             .values_list('order_number', 'product_id').iterator(chunk_size=min(chunk_size, 10000)))
+    buffer = []
+    for line in lines:
+        if len(buffer) >= chunk_size and line[0] != buffer[-1][0]:
+            yield np.array(buffer, dtype=np.int64)
+            buffer = []
+        buffer.append(line)
+    if buffer:
+        yield np.array(buffer, dtype=np.int64)
+
+
+def basket_pairs(chunk, max_basket=MAX_BASKET):
+    """
+    Для куска строк возвращает (товары по заказам, пары товаров из одного заказа). Повторы товара
+    в заказе схлопываются, заказы больше max_basket товаров пропускаются. Каждая пара входит
+    дважды: (a, b) и (b, a).
+    """
+    order = np.lexsort((chunk[:, 1], chunk[:, 0]))
+    orders, products = chunk[order, 0], chunk[order, 1]
+    distinct = np.ones(len(orders), dtype=bool)
+    distinct[1:] = (orders[1:] != orders[:-1]) | (products[1:] != products[:-1])
+    orders, products = orders[distinct], products[distinct]
+
+    starts = np.flatnonzero(np.r_[True, orders[1:] != orders[:-1]])
+    sizes = np.diff(np.r_[starts, len(orders)])
+    line_sizes = np.repeat(sizes, sizes)
+    line_starts = np.repeat(starts, sizes)
+    small = line_sizes <= max_basket
+    products = products[small]
+    line_sizes, line_starts = line_sizes[small], line_starts[small] - np.cumsum(~small)[small]
+
+    # Каждая строка i заказа [s, s + n) соединяется со строками s..s+n-1, из них оставляем j > i
+    lines = np.arange(len(products))
+    left = np.repeat(lines, line_sizes)
+    offsets = np.arange(len(left)) - np.repeat(np.cumsum(line_sizes) - line_sizes, line_sizes)
+    right = np.repeat(line_starts, line_sizes) + offsets
+    upper = right > left
+    left, right = products[left[upper]], products[right[upper]]
+    return products, np.concatenate([left, right]), np.concatenate([right, left])
+
+
+def _merge(keys, counts, new_keys, new_counts):
+    keys, inverse = np.unique(np.concatenate([keys, new_keys]), return_inverse=True)
+    counts = np.bincount(inverse.ravel(), weights=np.concatenate([counts, new_counts]))
+    return keys, counts.astype(np.int64)
+
+
+def cooccurrence(chunks, size, max_basket=MAX_BASKET):
+    """
+    Разреженная матрица совместных покупок: ключ пары a * size + b и число заказов, где они
+    встретились вместе, плюс число заказов с каждым товаром. size - больше наибольшего id товара.
+    Память занимают только различные пары и один кусок строк.
+    """
+    keys = np.empty(0, dtype=np.int64)
+    counts = np.empty(0, dtype=np.int64)
+    item_orders = np.zeros(size, dtype=np.int64)
+    for chunk in chunks:
+        products, left, right = basket_pairs(chunk, max_basket)
+        item_orders += np.bincount(products, minlength=size)
+        chunk_keys, chunk_counts = np.unique(left * size + right, return_counts=True)
+        keys, counts = _merge(keys, counts, chunk_keys, chunk_counts)
+    return keys, counts, item_orders
+
+
+def top_neighbours(keys, counts, item_orders, size, top_k=TOP_K, min_orders=MIN_ORDERS):
+    """
+    Оценивает пары косинусной мерой count(a, b) / sqrt(count(a) * count(b)) и оставляет для каждого
+    товара top_k лучших соседей. Возвращает массивы (товар, сосед, место, оценка, совместных заказов).
+    """
+    frequent = counts >= min_orders
+    keys, counts = keys[frequent], counts[frequent]
+    products, neighbours = keys // size, keys % size
+    scores = counts / np.sqrt(item_orders[products] * item_orders[neighbours])
+
+    order = np.lexsort((neighbours, -scores, products))
+    products, neighbours, scores, counts = products[order], neighbours[order], scores[order], counts[order]
+    starts = np.flatnonzero(np.r_[True, products[1:] != products[:-1]]) if len(products) else np.empty(0, int)
+    ranks = np.arange(len(products)) - np.repeat(starts, np.diff(np.r_[starts, len(products)]))
+    top = ranks < top_k
+    return products[top], neighbours[top], ranks[top], scores[top], counts[top]
+
+
+def build_recommendations(top_k=TOP_K, min_orders=MIN_ORDERS, chunk_size=CHUNK_SIZE, max_basket=MAX_BASKET):
+    """
+    Пересчитывает таблицу «С этим товаром покупают» по всем оплаченным заказам и возвращает
+    число записанных рекомендаций. Старые рекомендации заменяются в одной транзакции.
+    """
+    max_id = Order.objects.filter(paid=True).aggregate(max_id=Max('product_id'))['max_id']
+    rows = []
+    if max_id is not None:
+        size = max_id + 1
+        keys, counts, item_orders = cooccurrence(order_chunks(chunk_size), size, max_basket)
+        rows = zip(*(array.tolist() for array in top_neighbours(keys, counts, item_orders, size,
+                                                                 top_k, min_orders)))
+    written = 0
+    with transaction.atomic():
+        ProductRecommendation.objects.all().delete()
+        batch = []
+        for product, recommended, rank, score, orders in rows:
+            batch.append(ProductRecommendation(product_id=product, recommended_id=recommended, rank=rank,
+                                               score=score, orders=orders))
+            if len(batch) >= WRITE_BATCH:
+                ProductRecommendation.objects.bulk_create(batch)
+                written += len(batch)
+                batch = []
+        ProductRecommendation.objects.bulk_create(batch)
+        written += len(batch)
+    # Меняются только ETag страниц товаров, списки товаров остаются в кэше
+    purge(RECOMMENDATIONS)
+    return written
@@ -0,0 +1,120 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Case, Count, F, FloatField, IntegerField, Sum, Value, When
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Order, ProductDailySales, SellerDailySales
+
+REBUILD_BATCH = 1000
+TOP_PRODUCTS = 10
+
+
+def sales_day(value=None):
+    """День, к которому относится продажа, в часовом поясе сайта."""
+    value = value or timezone.now()
+    return timezone.localdate(value) if timezone.is_aware(value) else value.date()
+
+
+def _delta(field, values, output_field):
+    return Case(*[When(**{field: key}, then=Value(value)) for key, value in values.items()],
+                default=Value(0), output_field=output_field)
+
+
+def record_sales(lines, paid_at):
+    """
+    Добавляет оплаченные строки заказа в дневные сводки. lines - кортежи
+    (продавец, товар, цена, количество, номер заказа).
+
+    Недостающие строки сводок создаются bulk_create(ignore_conflicts=True), затем на каждую
+    таблицу выполняется один UPDATE с приращениями через CASE, поэтому параллельные оплаты
+    не теряют друг друга. Вызывается внутри транзакции settle_order.
+    """
+    day = sales_day(paid_at)
+    sellers = defaultdict(lambda: {'units': 0.0, 'revenue': 0.0, 'orders': set()})
+    products = defaultdict(lambda: {'seller': None, 'units': 0.0, 'revenue': 0.0})
+    for seller_id, product_id, price, number, order_number in lines:
+        sellers[seller_id]['units'] += number
+        sellers[seller_id]['revenue'] += price * number
+        sellers[seller_id]['orders'].add(order_number)
+        products[product_id]['seller'] = seller_id
+        products[product_id]['units'] += number
+        products[product_id]['revenue'] += price * number
+    if not sellers:
+        return
+
+    SellerDailySales.objects.bulk_create([SellerDailySales(seller_id=pk, day=day) for pk in sellers],
+                                         ignore_conflicts=True)
+    SellerDailySales.objects.filter(day=day, seller__in=sellers).update(
+        units=F('units') + _delta('seller_id', {pk: s['units'] for pk, s in sellers.items()}, FloatField()),
+        revenue=F('revenue') + _delta('seller_id', {pk: s['revenue'] for pk, s in sellers.items()}, FloatField()),
+        orders=F('orders') + _delta('seller_id', {pk: len(s['orders']) for pk, s in sellers.items()},
+                                    IntegerField()),
+    )
+    ProductDailySales.objects.bulk_create([ProductDailySales(product_id=pk, seller_id=p['seller'], day=day)
+                                           for pk, p in products.items()], ignore_conflicts=True)
+    ProductDailySales.objects.filter(day=day, product__in=products).update(
+        units=F('units') + _delta('product_id', {pk: p['units'] for pk, p in products.items()}, FloatField()),
+        revenue=F('revenue') + _delta('product_id', {pk: p['revenue'] for pk, p in products.items()},
+                                      FloatField()),
+    )
+
+
+def _bulk(model, objects):
+    batch = []
+    for obj in objects:
+        batch.append(obj)
+        if len(batch) >= REBUILD_BATCH:
+            model.objects.bulk_create(batch)
+            batch = []
+    model.objects.bulk_create(batch)
+
+
+def rebuild_sales(since=None):
+    """
+    Пересчитывает сводки по оплаченным строкам заказов: все или начиная с дня since.
+    Строки, оплаченные до появления paid_at, в сводки не попадают.
+    """
+    paid = Order.objects.filter(paid=True, paid_at__isnull=False).annotate(day=TruncDate('paid_at'))
+    seller_rollups = SellerDailySales.objects.all()
+    product_rollups = ProductDailySales.objects.all()
+    if since is not None:
+        paid = paid.filter(day__gte=since)
+        seller_rollups = seller_rollups.filter(day__gte=since)
+        product_rollups = product_rollups.filter(day__gte=since)
+    revenue = Sum(F('price') * F('number'), output_field=FloatField())
+
+    with transaction.atomic():
+        seller_rollups.delete()
+        product_rollups.delete()
+        _bulk(SellerDailySales, (
+            SellerDailySales(seller_id=row['name_seller'], day=row['day'], units=row['units'],
+                             revenue=row['revenue'], orders=row['orders'])
+            for row in paid.values('name_seller', 'day').order_by()
+            .annotate(units=Sum('number'), revenue=revenue, orders=Count('order_number', distinct=True))
+            .iterator()))
+        _bulk(ProductDailySales, (
+            ProductDailySales(product_id=row['product'], seller_id=row['name_seller'], day=row['day'],
+                              units=row['units'], revenue=row['revenue'])
+            for row in paid.values('product', 'name_seller', 'day').order_by()
+            .annotate(units=Sum('number'), revenue=revenue)
+            .iterator()))
+
+
+def seller_dashboard(seller, days):
+    """Данные панели продавца за последние days дней. Читаются только сводки, таблица заказов не трогается."""
+    since = sales_day() - timedelta(days=days - 1)
+    rows = SellerDailySales.objects.filter(seller=seller, day__gte=since)
+    totals = rows.aggregate(units=Sum('units'), revenue=Sum('revenue'), orders=Sum('orders'))
+    top = (ProductDailySales.objects.filter(seller=seller, day__gte=since)
+           .values('product', 'product__title', 'product__slug').order_by()
+           .annotate(units=Sum('units'), revenue=Sum('revenue'))
+           .order_by('-revenue')[:TOP_PRODUCTS])
+    return {
+        'since': since,
+        'daily': list(rows.order_by('-day').values('day', 'units', 'revenue', 'orders')),
+        'totals': {key: value or 0 for key, value in totals.items()},
+        'top_products': list(top),
+    }
@@ -0,0 +1,71 @@
+import re
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count, Sum
+from .models import Product, SearchTerm, translit_ru
+
+WORD_RE = re.compile(r'\w+')
+TITLE_WEIGHT = 3
+MAX_WEIGHT = 32767
+MAX_TERMS = 10
+
+
+def tokenize(text):
+    """
+    Разбивает текст на слова для индекса. Кириллица переводится в латиницу тем же transliterate,
+    что и в get_slug, поэтому запрос "videokarta" находит товар "Видеокарта".
+    """
+    text = translit_ru(text, reversed=True).replace("'", '').lower()
+    return [word[:64] for word in WORD_RE.findall(text) if len(word) > 1]
+
+
+def product_terms(product):
+    weights = Counter()
+    for word in tokenize(product.title):
+        weights[word] += TITLE_WEIGHT
+    for word in tokenize(product.content):
+        weights[word] += 1
+    return {term: min(weight, MAX_WEIGHT) for term, weight in weights.items()}
+
+
+def index_products(products, replace=True):
+    """
+    Перестраивает записи индекса для переданных товаров: одно удаление и один bulk_create.
+    Для только что созданных товаров удаление можно пропустить (replace=False).
+    """
+    products = list(products)
+    terms = [SearchTerm(term=term, product_id=product.pk, weight=weight)
+             for product in products
+             for term, weight in product_terms(product).items()]
+    with transaction.atomic():
+        if replace:
+            SearchTerm.objects.filter(product__in=[product.pk for product in products]).delete()
+        SearchTerm.objects.bulk_create(terms, batch_size=1000)
+    return len(terms)
+
+
+def search_products(query, category=None, published=True):
+    """
+    Возвращает QuerySet словарей {'product', 'score'} с товарами, в которых есть все слова запроса,
+    по убыванию релевантности. Поиск идёт по индексу (term, product), таблица товаров
+    не сканируется. published=False ищет и среди снятых с публикации товаров (для админки).
+    """
+    terms = list(dict.fromkeys(tokenize(query)))[:MAX_TERMS]
+    if not terms:
+        return SearchTerm.objects.none().values('product')
+    result = SearchTerm.objects.filter(term__in=terms)
+    if published:
+        result = result.filter(product__is_published=True)
+    if category is not None:
+        result = result.filter(product__category=category)
+    return (result.values('product')
+            .annotate(matched=Count('id'), score=Sum('weight'))
+            .filter(matched=len(terms))
+            .order_by('-score', '-product'))
+
+
+def load_products(rows):
+    """Загружает товары для страницы результатов одним запросом, сохраняя порядок."""
+    products = Product.objects.in_bulk([row['product'] for row in rows])
+    return [products[row['product']] for row in rows if row['product'] in products]
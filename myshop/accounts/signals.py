@@ -0,0 +1,113 @@
+from django.db.models import F
+from django.db.models.signals import post_delete, post_init, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .images import build_variants
+from .models import Category, Product
+from .pagecache import ALL_PAGES, category_group, home_group, purge
+from .search import index_products
+from .utils import reset_categories_cache
+
+_UNKNOWN = object()
+
+
+def _counted_category_id(instance):
+    # Категория, в product_count которой учтён товар, или None для неопубликованного.
+    # Читаем только из __dict__, чтобы не вызвать догрузку отложенных полей.
+    if 'is_published' not in instance.__dict__ or 'category_id' not in instance.__dict__:
+        return _UNKNOWN
+    return instance.category_id if instance.is_published else None
+
+
+def _change_count(category_id, delta):
+    """Меняет счётчик и возвращает True, если категория стала пустой или перестала быть пустой."""
+    categories = Category.objects.filter(pk=category_id)
+    if delta < 0:
+        categories = categories.filter(product_count__gte=-delta)
+    categories.update(product_count=F('product_count') + delta)
+    count = Category.objects.filter(pk=category_id).values_list('product_count', flat=True).first()
+    return count == (delta if delta > 0 else 0)
+
+
+def _purge_catalog_pages(category_ids, sidebar_changed=False):
+    # Товар виден на главной и на странице своей категории, остальные страницы не трогаем.
+    # Боковое меню есть на всех страницах, поэтому при его изменении сбрасываем всё.
+    groups = [home_group()]
+    groups += [category_group(slug) for slug in Category.objects.filter(pk__in=category_ids)
+               .values_list('slug', flat=True)]
+    if sidebar_changed:
+        groups.append(ALL_PAGES)
+    purge(*groups)
+
+
+@receiver(post_init, sender=Product)
+def remember_counted_category(sender, instance, **kwargs):
+    instance._counted_category_id = _counted_category_id(instance) if instance.pk else None
+
+
+@receiver(post_init, sender=Product)
+def remember_photo(sender, instance, **kwargs):
+    instance._processed_photo = str(instance.__dict__.get('photo') or '') if instance.pk else ''
+
+
+@receiver(pre_save, sender=Product)
+@receiver(pre_delete, sender=Product)
+def load_counted_category(sender, instance, **kwargs):
+    # Для товара с отложенными полями (например, после .only()) учтённая категория читается
+    # одним запросом, пока строка ещё в базе
+    if instance._counted_category_id is _UNKNOWN:
+        saved = Product.objects.filter(pk=instance.pk).values_list('category_id', 'is_published').first()
+        instance._counted_category_id = saved[0] if saved and saved[1] else None
+
+
+@receiver(post_save, sender=Product)
+def update_category_count(sender, instance, raw=False, **kwargs):
+    old = instance._counted_category_id
+    new = instance.category_id if instance.is_published else None
+    categories = {old, new} - {None}
+    if not categories:
+        return
+    sidebar_changed = False
+    if old != new:
+        if old is not None:
+            sidebar_changed |= _change_count(old, -1)
+        if new is not None:
+            sidebar_changed |= _change_count(new, 1)
+        instance._counted_category_id = new
+        reset_categories_cache()
+    _purge_catalog_pages(categories, sidebar_changed)
+
+
+@receiver(post_save, sender=Product)
+def process_photo(sender, instance, raw=False, **kwargs):
+    if raw or 'photo' not in instance.__dict__ or not instance.photo:
+        return
+    name = instance.photo.name
+    if name == instance._processed_photo and instance.photo_width:
+        return
+    instance._processed_photo = name
+    size = build_variants(name)
+    if size:
+        instance.photo_width, instance.photo_height = size
+        Product.objects.filter(pk=instance.pk).update(photo_width=size[0], photo_height=size[1])
+
+
+@receiver(post_save, sender=Product)
+def update_search_index(sender, instance, raw=False, **kwargs):
+    if not raw:
+        index_products([instance])
+
+
+@receiver(post_delete, sender=Product)
+def release_category_count(sender, instance, **kwargs):
+    if instance._counted_category_id is not None:
+        sidebar_changed = _change_count(instance._counted_category_id, -1)
+        reset_categories_cache()
+        _purge_catalog_pages([instance._counted_category_id], sidebar_changed)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def reset_categories(sender, **kwargs):
+    reset_categories_cache()
+    purge(ALL_PAGES)
@@ -0,0 +1,72 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, FloatField, Value, When
+from django.utils import timezone
+
+from .models import Order, Product
+
+# Сколько секунд товар держится за неоплаченным заказом
+RESERVATION_TTL = getattr(settings, 'STOCK_RESERVATION_TTL', 15 * 60)
+
+
+class OutOfStock(Exception):
+    def __init__(self, product_ids=()):
+        super().__init__('Недостаточно товара: %s' % ', '.join(map(str, product_ids)))
+        self.product_ids = list(product_ids)
+
+
+def _per_product(quantities, default=None):
+    return Case(*[When(pk=pk, then=Value(quantity)) for pk, quantity in quantities.items()],
+                default=default, output_field=FloatField())
+
+
+def reserve_stock(quantities):
+    """
+    Списывает со склада {id товара: количество} одним условным UPDATE:
+    number = number - q для всех строк, где number >= q. Строки не блокируются заранее, поэтому
+    оформление заказов на один и тот же товар не выстраивается в очередь на блокировках.
+
+    Вызывается внутри transaction.atomic(). Если обновилось меньше строк, чем товаров, выбрасывает
+    OutOfStock, и часть уже списанного товара должна откатиться вместе с транзакцией вызывающего.
+    """
+    needed = _per_product(quantities)
+    updated = Product.objects.filter(pk__in=quantities, number__gte=needed).update(number=F('number') - needed)
+    if updated != len(quantities):
+        raise OutOfStock()
+
+
+def find_shortages(quantities):
+    """Товары, которых сейчас меньше, чем нужно. Вызывать после отката неудачного reserve_stock."""
+    available = dict(Product.objects.filter(pk__in=quantities).values_list('pk', 'number'))
+    return [pk for pk, quantity in quantities.items() if available.get(pk, 0) < quantity]
+
+
+def release_stock(quantities):
+    Product.objects.filter(pk__in=quantities).update(number=F('number') + _per_product(quantities, Value(0.0)))
+
+
+def reservation_deadline():
+    return timezone.now() + timedelta(seconds=RESERVATION_TTL)
+
+
+def release_expired_reservations(batch_size=500):
+    """
+    Возвращает на склад товар из неоплаченных заказов с истёкшей резервацией. Строки, которые
+    сейчас оплачивает settle_order, пропускаются (skip_locked). Возвращает число освобождённых строк.
+    """
+    with transaction.atomic():
+        lines = list(Order.objects.select_for_update(skip_locked=True)
+                     .filter(paid=False, reserved_until__lt=timezone.now())
+                     .order_by('reserved_until')
+                     .values_list('id', 'product_id', 'number')[:batch_size])
+        if not lines:
+            return 0
+        quantities = defaultdict(float)
+        for pk, product_id, number in lines:
+            quantities[product_id] += number
+        Order.objects.filter(pk__in=[line[0] for line in lines]).update(reserved_until=None)
+        release_stock(quantities)
+    return len(lines)
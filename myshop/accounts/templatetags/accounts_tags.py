@@ -1,7 +1,10 @@
 from django import template
-from django.db.models import Count
+from django.core.files.storage import default_storage
+from django.utils.html import format_html
 
+from accounts.images import variant_name, variant_widths
 from accounts.models import *
+from accounts.utils import get_categories as get_sidebar_categories
 
 register = template.Library()
 
@@ -17,9 +20,9 @@ def get_categories(id_category=None):
 @register.inclusion_tag('accounts/list_categories.html')
 def show_categories(sort=None, selected_category=0):
     if not sort:
-        category = Category.objects.annotate(Count('product'))
+        category = get_sidebar_categories()
     else:
-        category = Category.objects.order_by(sort)
+        category = Category.objects.filter(product_count__gt=0).order_by(sort)
 
     return {"category": category, "selected_category": selected_category}
 
@@ -32,3 +35,26 @@ def show_menu():
             {'title': "Войти", 'url_name': 'login'}
             ]
     return {"menu": menu}
+
+
+@register.simple_tag()
+def product_image(product, css_class='img-article-left', sizes='300px'):
+    """
+    <picture> с уменьшенными копиями фотографии в srcset. Размеры берутся из модели,
+    поэтому файл с диска не читается. Для необработанных фотографий выводится обычный <img>.
+    """
+    name = product.photo.name
+    if not product.photo_width:
+        return format_html('<img class="{}" src="{}">', css_class, product.photo.url)
+
+    widths = variant_widths(product.photo_width)
+    webp = ['%s %sw' % (default_storage.url(variant_name(name, w, 'webp')), w) for w in widths]
+    jpeg = ['%s %sw' % (default_storage.url(variant_name(name, w, 'jpg')), w) for w in widths]
+    jpeg.append('%s %sw' % (product.photo.url, product.photo_width))
+    source = ''
+    if webp:
+        source = format_html('<source type="image/webp" srcset="{}" sizes="{}">', ', '.join(webp), sizes)
+    return format_html('<picture>{}<img class="{}" src="{}" srcset="{}" sizes="{}" width="{}" height="{}" '
+                       'loading="lazy"></picture>',
+                       source, css_class, product.photo.url, ', '.join(jpeg), sizes,
+                       product.photo_width, product.photo_height)
@@ -1,6 +1,57 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import random
+import tempfile
+import threading
+from datetime import timedelta
+from io import BytesIO, StringIO
+from smtplib import SMTPException
+from time import sleep
+from unittest.mock import patch
 
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.mail import get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections, transaction
+from django.db.models import Count
+from django.test import TestCase, TransactionTestCase, modify_settings, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from django.utils.http import http_date
+from PIL import Image
+
+from .benchmarks import run_benchmarks
+from .counters import ViewCounter, get_view_counter, set_view_counter
+from .ids import MAX_SEQUENCE, MAX_WORKER, SEQUENCE_BITS, IdGenerator, check_id_worker
+from .images import build_variants, variant_name
+from .mail import RETRY_DELAY, queue_email, send_queued_emails
+from .middleware import QUERY_BUDGETS, fingerprint, query_report
 from .models import *
+from .orders import settle_order
+from .pagecache import check_shared_cache, page_cache_enabled
+from .paginator import EstimatedCountPaginator
+from .recommendations import build_recommendations
+from .sales import sales_day
+from .search import load_products, search_products
+from .trending import HALF_LIFE, SALE_WEIGHT, update_trending
+from .stock import OutOfStock, release_expired_reservations, reserve_stock
+from .utils import rebuild_category_counts
+
+
+def swap_view_counter(test):
+    """Даёт тесту собственный буфер просмотров без сброса по таймеру."""
+    counter = ViewCounter(flush_interval=None, flush_size=1000)
+    test.addCleanup(set_view_counter, set_view_counter(counter))
+    return counter
 
 
 class LoginViewTest(TestCase):
@@ -188,3 +239,1492 @@ class CheckOrderViewTest(TestCase):
                 int_balance = int(user.balance)
                 self.assertEquals(str(int_balance), '55')
                 self.assertEquals(str(int_balance), '66')
+
+
+class CatalogPaginationTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create(username='test', password='123testpass', email='09mn@mail.ru')
+        category = Category.objects.create(name='category1', slug='category1')
+        for i in range(11):
+            Product.objects.create(title='rtx' + str(i), content='test', price=100 + i % 4, number='1',
+                                   views=i % 3, is_published=True, category=category, creator=user)
+        Product.objects.create(title='hidden', content='test', price='1', number='1', is_published=False,
+                               category=category, creator=user)
+
+    def setUp(self):
+        cache.clear()
+
+    def walk(self, url):
+        ids = []
+        resp = self.client.get(url)
+        while True:
+            ids += [p.id for p in resp.context['product']]
+            if not resp.context['page_obj'].has_next():
+                return ids, resp
+            resp = self.client.get(url, {'cursor': resp.context['page_obj'].next_cursor})
+
+    def test_home_pages_follow_ordering(self):
+        ids, resp = self.walk(reverse('home'))
+        expected = list(Product.objects.filter(is_published=True).order_by('-views', '-id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+        self.assertEqual(resp.context['page_obj'].number, 3)
+
+    def test_category_sorted_by_price(self):
+        ids, resp = self.walk(reverse('sort_price_up', kwargs={'category_slug': 'category1'}))
+        expected = list(Product.objects.filter(is_published=True).order_by('price', 'id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+
+    def test_previous_page(self):
+        url = reverse('home_sort_price_down')
+        first = self.client.get(url)
+        second = self.client.get(url, {'cursor': first.context['page_obj'].next_cursor})
+        third = self.client.get(url, {'cursor': second.context['page_obj'].next_cursor})
+        back = self.client.get(url, {'cursor': third.context['page_obj'].previous_cursor})
+        self.assertEqual(list(back.context['product']), list(second.context['product']))
+        self.assertTrue(back.context['page_obj'].has_previous())
+        self.assertIsNone(second.context['page_obj'].previous_cursor)
+
+    def test_deep_page_costs_the_same(self):
+        url = reverse('home')
+        first = self.client.get(url)
+        cursor = self.client.get(url, {'cursor': first.context['page_obj'].next_cursor}).context['page_obj'].next_cursor
+        cache.clear()
+        with CaptureQueriesContext(connection) as first_page:
+            self.client.get(url)
+        cache.clear()
+        with CaptureQueriesContext(connection) as last_page:
+            self.client.get(url, {'cursor': cursor})
+        self.assertEqual(len(first_page), len(last_page))
+        self.assertFalse(any('COUNT' in q['sql'] and 'accounts_product' in q['sql'] and 'GROUP BY' not in q['sql']
+                             for q in last_page.captured_queries))
+
+    def test_wrong_cursor(self):
+        resp = self.client.get(reverse('home'), {'cursor': 'wrong'})
+        self.assertEqual(resp.status_code, 404)
+
+    def test_unknown_category(self):
+        resp = self.client.get(reverse('category', kwargs={'category_slug': 'wrong'}))
+        self.assertEqual(resp.status_code, 404)
+
+
+class CategoryCountTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='test', password='123testpass', email='09mn@mail.ru')
+        self.first = Category.objects.create(name='category1', slug='category1')
+        self.second = Category.objects.create(name='category2', slug='category2')
+
+    def counts(self):
+        return list(Category.objects.order_by('id').values_list('product_count', flat=True))
+
+    def create_product(self, title='rtx', category=None, **kwargs):
+        return Product.objects.create(title=title, content='test', price='123', number='1',
+                                      category=category or self.first, creator=self.user, **kwargs)
+
+    def test_create_and_delete(self):
+        product = self.create_product()
+        self.create_product(title='gtx', is_published=False)
+        self.assertEqual(self.counts(), [1, 0])
+        product.delete()
+        self.assertEqual(self.counts(), [0, 0])
+
+    def test_bulk_delete_with_deferred_fields(self):
+        self.create_product()
+        self.create_product(title='gtx', category=self.second)
+        self.create_product(title='gt', is_published=False)
+        Product.objects.filter(category=self.first).only('title').delete()
+        self.assertEqual(self.counts(), [0, 1])
+        Product.objects.only('title').delete()
+        self.assertEqual(self.counts(), [0, 0])
+
+    def test_publish_and_move(self):
+        product = self.create_product(is_published=False)
+        product = Product.objects.get(pk=product.pk)
+        product.is_published = True
+        product.save()
+        self.assertEqual(self.counts(), [1, 0])
+        product.category = self.second
+        product.save()
+        self.assertEqual(self.counts(), [0, 1])
+        product.is_published = False
+        product.save()
+        self.assertEqual(self.counts(), [0, 0])
+
+    def test_rebuild(self):
+        self.create_product()
+        Category.objects.update(product_count=5)
+        self.assertEqual(rebuild_category_counts(), 2)
+        self.assertEqual(self.counts(), [1, 0])
+
+    def test_sidebar_hides_empty_categories(self):
+        self.create_product()
+        resp = self.client.get(reverse('home'))
+        self.assertEqual(list(resp.context['category']), [self.first])
+        self.assertNotContains(resp, 'category2')
+
+
+class ViewCounterTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create(username='test', password='123testpass', email='09mn@mail.ru')
+        category = Category.objects.create(name='category1', slug='category1')
+        cls.first = Product.objects.create(title='rtx', content='test', price='123', number='1',
+                                           category=category, creator=user)
+        cls.second = Product.objects.create(title='gtx', content='test', price='123', number='1',
+                                            category=category, creator=user)
+
+    def setUp(self):
+        self.spill_file = os.path.join(tempfile.mkdtemp(), 'views.jsonl')
+        self.counter = ViewCounter(flush_interval=3600, flush_size=5, spill_file=self.spill_file)
+
+    def views(self):
+        return list(Product.objects.order_by('id').values_list('views', flat=True))
+
+    def test_views_are_buffered(self):
+        self.counter.add(self.first.pk)
+        self.counter.add(self.second.pk)
+        self.assertEqual(self.views(), [0, 0])
+        self.assertEqual(self.counter.pending_for(self.first.pk), 1)
+
+    def test_flush_is_one_update(self):
+        for i in range(3):
+            self.counter.add(self.first.pk)
+        self.counter.add(self.second.pk)
+        with self.assertNumQueries(1):
+            self.counter.add(self.second.pk)
+        self.assertEqual(self.views(), [3, 2])
+
+    def test_spill_and_restore(self):
+        self.counter.add(self.first.pk)
+        self.counter.spill()
+        self.assertTrue(os.path.exists(self.spill_file))
+        restarted = ViewCounter(flush_interval=3600, flush_size=5, spill_file=self.spill_file)
+        restarted.add(self.second.pk)
+        restarted.shutdown()
+        self.assertEqual(self.views(), [1, 1])
+        self.assertFalse(os.path.exists(self.spill_file))
+
+    def test_product_page_does_not_write(self):
+        counter = swap_view_counter(self)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.first.get_absolute_url())
+        self.assertFalse(any(q['sql'].startswith('UPDATE') for q in queries.captured_queries))
+        self.assertEqual(counter.pending_for(self.first.pk), 1)
+
+    @override_settings(VIEW_COUNTER_WRITE_BEHIND=False)
+    def test_counter_without_write_behind(self):
+        counter = get_view_counter()
+        self.assertIsNone(counter.flush_interval)
+        self.assertIsNone(counter.spill_file)
+        self.assertIs(get_view_counter(), counter)
+
+
+class CreateOrderTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.buyer = User.objects.create_user(username='buyer', password='123testpass', email='09mn@mail.ru')
+        sellers = [User.objects.create(username='seller' + str(i), password='123testpass', email='09mn@mail.ru')
+                   for i in range(3)]
+        category = Category.objects.create(name='category1', slug='category1')
+        cls.products = [Product.objects.create(title='rtx' + str(i), content='test', price=10 + i, number='100',
+                                               category=category, creator=sellers[i % 3])
+                        for i in range(30)]
+
+    def setUp(self):
+        self.client.login(username='buyer', password='123testpass')
+
+    def fill_cart(self, products):
+        for product in products:
+            self.client.post(reverse('cart:cart_add', kwargs={'product_id': product.id}), {'quantity': 2})
+
+    def test_order_lines(self):
+        self.fill_cart(self.products[:3])
+        resp = self.client.post(reverse('create_order'))
+        order_number = resp.context['order_number']
+        orders = Order.objects.filter(order_number=order_number).order_by('product_id')
+        self.assertEqual([(o.name_seller_id, o.product_id, o.price, o.number) for o in orders],
+                         [(p.creator_id, p.id, p.price, 2) for p in self.products[:3]])
+        self.assertEqual(resp.context['price'], 66)
+        self.assertContains(resp, 'value="%s"' % order_number)
+        self.assertFalse(self.client.session.get(settings.CART_SESSION_ID))
+
+    def test_get_does_not_create_order(self):
+        self.fill_cart(self.products[:1])
+        resp = self.client.get(reverse('create_order'))
+        self.assertEqual(resp.status_code, 200)
+        self.assertFalse(Order.objects.exists())
+
+    def test_query_count_does_not_depend_on_cart_size(self):
+        self.fill_cart(self.products[:1])
+        with CaptureQueriesContext(connection) as small:
+            self.client.post(reverse('create_order'))
+        self.fill_cart(self.products)
+        with CaptureQueriesContext(connection) as large:
+            self.client.post(reverse('create_order'))
+        self.assertEqual(len(small), len(large))
+        self.assertEqual(Order.objects.count(), 31)
+
+
+class SettleOrderTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sellers = [User.objects.create(username='seller' + str(i), password='123testpass', email='09mn@mail.ru')
+                       for i in range(2)]
+        category = Category.objects.create(name='category1', slug='category1')
+        cls.products = [Product.objects.create(title='rtx' + str(i), content='test', price=10, number='50',
+                                               category=category, creator=cls.sellers[i % 2])
+                        for i in range(10)]
+        Order.objects.create(name_seller=cls.sellers[0], product=cls.products[0], price=10, number=2,
+                             order_number=1)
+        Order.objects.bulk_create([Order(name_seller=p.creator, product=p, price=10, number=1, order_number=2)
+                                   for p in cls.products])
+
+    def balances(self):
+        return list(User.objects.filter(pk__in=[s.pk for s in self.sellers]).order_by('id')
+                    .values_list('balance', flat=True))
+
+    def test_settle(self):
+        self.assertTrue(settle_order(2, 100))
+        self.assertEqual(self.balances(), [50, 50])
+        self.assertEqual(set(Product.objects.values_list('number', flat=True)), {49})
+        self.assertFalse(Order.objects.filter(order_number=2, paid=False).exists())
+
+    def test_settle_only_once(self):
+        self.client.post(reverse('CheckOrder'), {'amount': '20', 'label': '1'})
+        self.client.post(reverse('CheckOrder'), {'amount': '20', 'label': '1'})
+        self.assertEqual(self.balances(), [20, 0])
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).number, 48)
+
+    def test_amount_too_small(self):
+        self.assertFalse(settle_order(2, 99))
+        self.assertEqual(self.balances(), [0, 0])
+
+    def test_query_count_does_not_depend_on_lines(self):
+        with CaptureQueriesContext(connection) as one_line:
+            settle_order(1, 20)
+        with CaptureQueriesContext(connection) as many_lines:
+            settle_order(2, 100)
+        self.assertEqual(len(one_line), len(many_lines))
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ProductImageTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='test', password='123testpass', email='09mn@mail.ru')
+        cls.category = Category.objects.create(name='category1', slug='category1')
+
+    def setUp(self):
+        cache.clear()
+
+    def create_product(self):
+        buffer = BytesIO()
+        Image.new('RGB', (800, 400), 'red').save(buffer, 'PNG')
+        photo = SimpleUploadedFile('photo.png', buffer.getvalue(), content_type='image/png')
+        return Product.objects.create(title='rtx', content='test', price='123', number='1', photo=photo,
+                                      category=self.category, creator=self.user)
+
+    def test_variants_on_save(self):
+        product = self.create_product()
+        product = Product.objects.get(pk=product.pk)
+        self.assertEqual((product.photo_width, product.photo_height), (800, 400))
+        for width in (150, 300, 600):
+            with default_storage.open(variant_name(product.photo.name, width, 'webp')) as f:
+                self.assertEqual(Image.open(f).size, (width, width // 2))
+            self.assertTrue(default_storage.exists(variant_name(product.photo.name, width, 'jpg')))
+
+    def test_rebuild_removes_stale_variants(self):
+        name = self.create_product().photo.name
+        stale = [variant_name(name, 1200, 'avif'), variant_name(name, 75, 'jpg')]
+        for path in stale:
+            default_storage.save(path, ContentFile(b'old'))
+        other = default_storage.save(os.path.join(os.path.dirname(name), 'other_w150.jpg'), ContentFile(b'x'))
+        with patch('accounts.images.VARIANT_WIDTHS', (150, 300)), \
+                patch('accounts.images.VARIANT_FORMATS', (('webp', 'WEBP'),)):
+            self.assertEqual(build_variants(name), (800, 400))
+        for path in stale + [variant_name(name, 600, 'webp'), variant_name(name, 150, 'jpg')]:
+            self.assertFalse(default_storage.exists(path), path)
+        for path in (name, other, variant_name(name, 150, 'webp'), variant_name(name, 300, 'webp')):
+            self.assertTrue(default_storage.exists(path), path)
+
+    def test_srcset(self):
+        product = self.create_product()
+        resp = self.client.get(reverse('home'))
+        self.assertContains(resp, variant_name(product.photo.url, 300, 'webp') + ' 300w')
+        self.assertContains(resp, 'width="800" height="400"')
+
+    def test_backfill(self):
+        product = self.create_product()
+        Product.objects.update(photo_width=None, photo_height=None)
+        call_command('build_thumbnails', stdout=StringIO())
+        product.refresh_from_db()
+        self.assertEqual((product.photo_width, product.photo_height), (800, 400))
+
+
+class SearchTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create(username='test', password='123testpass', email='09mn@mail.ru')
+        cls.cards = Category.objects.create(name='Видеокарты', slug='cards')
+        cls.cpus = Category.objects.create(name='Процессоры', slug='cpus')
+        cls.rtx = Product.objects.create(title='Видеокарта RTX 3080', content='Игровая видеокарта', price='100',
+                                         number='1', category=cls.cards, creator=user)
+        cls.gtx = Product.objects.create(title='Видеокарта GTX 1060', content='Старая модель', price='50',
+                                         number='1', category=cls.cards, creator=user)
+        cls.cpu = Product.objects.create(title='Процессор', content='Подходит к видеокарта rtx', price='70',
+                                         number='1', category=cls.cpus, creator=user)
+        Product.objects.create(title='Видеокарта скрытая', content='test', price='1', number='1',
+                               is_published=False, category=cls.cards, creator=user)
+
+    def search(self, query, category=None):
+        return load_products(search_products(query, category))
+
+    def test_ranking(self):
+        self.assertEqual(self.search('видеокарта rtx'), [self.rtx, self.cpu])
+
+    def test_latin_query_matches_cyrillic(self):
+        self.assertEqual(self.search('Videokarta GTX'), [self.gtx])
+
+    def test_category_filter(self):
+        self.assertEqual(self.search('rtx', self.cpus), [self.cpu])
+
+    def test_index_follows_changes(self):
+        self.gtx.title = 'Монитор'
+        self.gtx.save()
+        self.assertEqual(self.search('gtx'), [])
+        self.assertEqual(self.search('monitor'), [self.gtx])
+        self.rtx.delete()
+        self.assertEqual(self.search('rtx'), [self.cpu])
+
+    def test_search_view(self):
+        resp = self.client.get(reverse('search'), {'q': 'videokarta', 'category': 'cards'})
+        self.assertEqual(list(resp.context['product']), [self.rtx, self.gtx])
+        self.assertEqual(resp.context['page_query'], 'q=videokarta&category=cards&')
+
+
+class FailingEmailBackend(BaseEmailBackend):
+
+    def send_messages(self, email_messages):
+        raise SMTPException('Сервер недоступен')
+
+
+class EmailOutboxTest(TestCase):
+
+    def test_registration_queues_email(self):
+        self.client.post(reverse('registry'), {'username': 'test', 'email': '09mn@mail.ru',
+                                               'password1': 'Qwerty123testpass', 'password2': 'Qwerty123testpass'})
+        self.assertEqual(len(mail.outbox), 0)
+        email = OutgoingEmail.objects.get()
+        self.assertEqual(email.to_email, '09mn@mail.ru')
+        self.assertEqual(send_queued_emails(), (1, 0))
+        self.assertEqual(mail.outbox[0].to, ['09mn@mail.ru'])
+        self.assertIn('/activate/', mail.outbox[0].body)
+        self.assertEqual(send_queued_emails(), (0, 0))
+
+    def test_password_reset_queues_email(self):
+        User.objects.create_user(username='test', password='123testpass', email='09mn@mail.ru')
+        self.client.post(reverse('password_reset'), {'email': '09mn@mail.ru'})
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(send_queued_emails(), (1, 0))
+        self.assertEqual(mail.outbox[0].to, ['09mn@mail.ru'])
+
+    def test_batch_uses_one_connection(self):
+        for i in range(3):
+            queue_email('subject', 'body', 'user%s@mail.ru' % i)
+        with patch('accounts.mail.get_connection', wraps=get_connection) as connection:
+            self.assertEqual(send_queued_emails(), (3, 0))
+        self.assertEqual(connection.call_count, 1)
+        self.assertEqual(len(mail.outbox), 3)
+
+    @override_settings(EMAIL_BACKEND='accounts.tests.FailingEmailBackend')
+    def test_retry_with_backoff(self):
+        email = queue_email('subject', 'body', '09mn@mail.ru')
+        with self.assertLogs('accounts.mail', 'WARNING'):
+            self.assertEqual(send_queued_emails(), (0, 1))
+        email.refresh_from_db()
+        self.assertEqual(email.attempts, 1)
+        self.assertIn('Сервер недоступен', email.last_error)
+        self.assertEqual(send_queued_emails(), (0, 0))
+        OutgoingEmail.objects.update(next_attempt=timezone.now())
+        with self.assertLogs('accounts.mail', 'WARNING'):
+            send_queued_emails()
+        email.refresh_from_db()
+        self.assertEqual(email.attempts, 2)
+        self.assertGreater(email.next_attempt, timezone.now() + timedelta(seconds=RETRY_DELAY))
+
+
+@override_settings(PAGE_CACHE_ENABLED=True)
+class PageCacheTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='test', password='123testpass', email='09mn@mail.ru')
+        cls.first = Category.objects.create(name='category1', slug='category1')
+        cls.second = Category.objects.create(name='category2', slug='category2')
+        cls.rtx = Product.objects.create(title='rtx', content='test', price='100', number='1',
+                                         category=cls.first, creator=cls.user)
+        cls.gtx = Product.objects.create(title='gtx', content='test', price='50', number='1',
+                                         category=cls.first, creator=cls.user)
+        cls.cpu = Product.objects.create(title='cpu', content='test', price='70', number='1',
+                                         category=cls.second, creator=cls.user)
+
+    def setUp(self):
+        cache.clear()
+        self.urls = {'home': reverse('home'),
+                     'first': reverse('category', kwargs={'category_slug': 'category1'}),
+                     'second': reverse('sort_price_up', kwargs={'category_slug': 'category2'})}
+        for url in self.urls.values():
+            self.client.get(url)
+
+    def assertCached(self, name, cached=True):
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.client.get(self.urls[name])
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(queries) == 0, cached, name)
+        return resp
+
+    @override_settings(PAGE_CACHE_ENABLED=None,
+                       CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_process_local_cache_disables_page_cache(self):
+        self.assertFalse(page_cache_enabled())
+        self.assertEqual([error.id for error in check_shared_cache(None)], ['accounts.W001'])
+        self.assertCached('home', cached=False)
+
+    def test_anonymous_pages_are_cached(self):
+        for name in self.urls:
+            self.assertCached(name)
+
+    def test_product_change_purges_only_its_pages(self):
+        self.gtx.title = 'gtx 1060'
+        self.gtx.save()
+        self.assertContains(self.assertCached('home', False), 'gtx 1060')
+        self.assertContains(self.assertCached('first', False), 'gtx 1060')
+        self.assertCached('second')
+
+    def test_unpublished_product_purges_nothing(self):
+        Product.objects.create(title='draft', content='test', price='1', number='1', is_published=False,
+                               category=self.first, creator=self.user)
+        for name in self.urls:
+            self.assertCached(name)
+
+    def test_emptied_category_purges_sidebar(self):
+        self.cpu.delete()
+        self.assertNotContains(self.assertCached('home', False), 'category2')
+        self.assertCached('first', False)
+
+    def test_authenticated_users_and_carts_bypass_cache(self):
+        self.client.post(reverse('cart:cart_add', kwargs={'product_id': self.rtx.id}), {'quantity': 1})
+        self.assertCached('home', False)
+        self.client.login(username='test', password='123testpass')
+        self.assertCached('home', False)
+
+
+@override_settings(VIEW_COUNTER_WRITE_BEHIND=False)
+class QueryPlanTest(TestCase):
+    """Запросы каталога и поиска заказа на большом наборе данных должны идти по индексам, а не перебором таблицы."""
+
+    @classmethod
+    def setUpTestData(cls):
+        rnd = random.Random(1)
+        User.objects.bulk_create([User(username='seller%s' % i, email='seller%s@mail.ru' % i) for i in range(50)])
+        sellers = list(User.objects.values_list('id', flat=True))
+        Category.objects.bulk_create([Category(name='category%s' % i, slug='category%s' % i) for i in range(20)])
+        categories = list(Category.objects.values_list('id', flat=True))
+        Product.objects.bulk_create([
+            Product(title='product%s' % i, slug='product%s' % i, content='test', price=rnd.randint(1, 1000),
+                    number=10, views=rnd.randint(0, 10000), is_published=rnd.random() < 0.9,
+                    category_id=rnd.choice(categories), creator_id=rnd.choice(sellers))
+            for i in range(5000)], batch_size=500)
+        products = list(Product.objects.values_list('id', 'creator_id'))
+        OrderHeader.objects.bulk_create([OrderHeader(id=i, buyer_id=rnd.choice(sellers)) for i in range(1667)],
+                                        batch_size=500)
+        orders = []
+        for i in range(5000):
+            product_id, seller_id = rnd.choice(products)
+            orders.append(Order(name_seller_id=seller_id, product_id=product_id, price=10, number=1,
+                                order_number=i // 3, header_id=i // 3))
+        Order.objects.bulk_create(orders, batch_size=500)
+        rebuild_category_counts()
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def setUp(self):
+        cache.clear()
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                return '\n'.join(row[-1] for row in cursor.fetchall())
+            cursor.execute('EXPLAIN ' + sql)
+            return '\n'.join(row[0] for row in cursor.fetchall())
+
+    def assertIndexScan(self, sql, table):
+        plan = self.explain(sql)
+        if connection.vendor == 'sqlite':
+            self.assertNotRegex(plan, r'SCAN "?%s"?\s*(\n|$)' % table, sql)
+            self.assertNotIn('USE TEMP B-TREE FOR ORDER BY', plan, sql)
+        else:
+            self.assertNotIn('Seq Scan on %s' % table, plan, sql)
+
+    def table_queries(self, table, url, data=None, method='get'):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            getattr(self.client, method)(url, data)
+        sqls = [q['sql'] for q in queries.captured_queries
+                if q['sql'].startswith('SELECT') and 'FROM "%s"' % table in q['sql']]
+        self.assertTrue(sqls, url)
+        return sqls
+
+    def assertSeekBound(self, sql, field):
+        """Глубокая страница начинает чтение индекса со значения курсора, а не фильтрует всё до него."""
+        self.assertRegex(sql, r'"accounts_product"\."%s" [<>]= ' % field)
+        plan = self.explain(sql)
+        if connection.vendor == 'sqlite':
+            self.assertRegex(plan, r'SEARCH .*USING (COVERING )?INDEX .*\b%s[<>]' % field, sql)
+        else:
+            self.assertRegex(plan, r'Index Cond: .*\b%s [<>]=' % field, sql)
+
+    def test_catalog_pages(self):
+        category = Category.objects.filter(product_count__gt=0).first().slug
+        urls = [(reverse('home'), 'views'), (reverse('home_sort_price_down'), 'price'),
+                (reverse('home_sort_price_up'), 'price'),
+                (reverse('category', kwargs={'category_slug': category}), 'views'),
+                (reverse('sort_price_down', kwargs={'category_slug': category}), 'price'),
+                (reverse('sort_price_up', kwargs={'category_slug': category}), 'price'),
+                (reverse('home_sort_trending'), 'trending'),
+                (reverse('sort_trending', kwargs={'category_slug': category}), 'trending')]
+        for url, field in urls:
+            resp = self.client.get(url)
+            deep = {'cursor': resp.context['page_obj'].next_cursor}
+            for sql in self.table_queries('accounts_product', url):
+                self.assertIndexScan(sql, 'accounts_product')
+            for sql in self.table_queries('accounts_product', url, deep):
+                self.assertIndexScan(sql, 'accounts_product')
+                self.assertSeekBound(sql, field)
+
+    def test_product_page(self):
+        product = Product.objects.filter(is_published=True).first()
+        for sql in self.table_queries('accounts_product', product.get_absolute_url()):
+            self.assertIndexScan(sql, 'accounts_product')
+
+    def test_order_lookup(self):
+        for sql in self.table_queries('accounts_order', reverse('CheckOrder'), {'amount': '1', 'label': '42'}, 'post'):
+            self.assertIndexScan(sql, 'accounts_order')
+
+    def test_order_header_lookups(self):
+        self.assertIndexScan(str(OrderHeader.objects.filter(buyer_id=3).query), 'accounts_orderheader')
+        self.assertIndexScan(str(OrderHeader.objects.filter(pk=42).query), 'accounts_orderheader')
+        self.assertIndexScan(str(Order.objects.filter(header_id=42).query), 'accounts_order')
+        self.assertIndexScan(str(Order.objects.filter(name_seller_id=3).query), 'accounts_order')
+
+
+@override_settings(VIEW_COUNTER_WRITE_BEHIND=False)
+class BenchmarkTest(TestCase):
+
+    def test_generate_and_run(self):
+        call_command('generate_catalog', sellers=5, categories=3, products=40, orders=30, batch_size=7, seed=1,
+                     prefix='test', stdout=StringIO())
+        self.assertEqual(User.objects.filter(is_seller=True).count(), 5)
+        self.assertEqual(Product.objects.count(), 40)
+        self.assertEqual(Order.objects.count(), 30)
+        self.assertEqual(sum(Category.objects.values_list('product_count', flat=True)),
+                         Product.objects.filter(is_published=True).count())
+
+        buyer = User.objects.create_user(username='buyer', password='123testpass', email='09mn@mail.ru')
+        self.client.force_login(buyer)
+        report = run_benchmarks(self.client, iterations=2, seed=1)
+        self.assertEqual(set(report['endpoints']), {'home', 'category', 'product', 'cart_add', 'cart_detail',
+                                                    'create_order', 'CheckOrder'})
+        for stats in report['endpoints'].values():
+            self.assertEqual(stats['requests'], 2)
+            self.assertEqual(stats['errors'], 0)
+            self.assertGreaterEqual(stats['p95_ms'], stats['p50_ms'])
+
+
+@override_settings(QUERY_STATS_HEADERS=True, VIEW_COUNTER_WRITE_BEHIND=False)
+@modify_settings(MIDDLEWARE={'append': 'accounts.middleware.QueryCountMiddleware'})
+class QueryBudgetTest(TestCase):
+    """Каждая страница укладывается в бюджет SQL-запросов из QUERY_BUDGETS."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user(username='seller', password='123testpass', email='09mn@mail.ru',
+                                              is_seller=True)
+        User.objects.create_user(username='buyer', password='123testpass', email='09mn@mail.ru')
+        category = Category.objects.create(name='category1', slug='category1')
+        cls.products = [Product.objects.create(title='rtx%s' % i, content='test', price=100, number=10,
+                                               category=category, creator=cls.seller)
+                        for i in range(6)]
+
+    def setUp(self):
+        cache.clear()
+        query_report.reset()
+        self.client.login(username='buyer', password='123testpass')
+        for product in self.products[:3]:
+            self.client.post(reverse('cart:cart_add', kwargs={'product_id': product.id}), {'quantity': 1})
+
+    def assertWithinBudget(self, url_name, resp):
+        queries = int(resp['X-DB-Queries'])
+        self.assertLessEqual(queries, QUERY_BUDGETS[url_name], url_name)
+        self.assertEqual(resp['X-DB-Duplicates'], '0', url_name)
+
+    def test_pages(self):
+        pages = {
+            'home': reverse('home'),
+            'home_sort_price_up': reverse('home_sort_price_up'),
+            'home_sort_trending': reverse('home_sort_trending'),
+            'category': reverse('category', kwargs={'category_slug': 'category1'}),
+            'sort_price_down': reverse('sort_price_down', kwargs={'category_slug': 'category1'}),
+            'product': self.products[0].get_absolute_url(),
+            'search': reverse('search') + '?q=rtx1',
+            'profile': reverse('profile', kwargs={'profile_id': self.seller.pk}),
+            'cart:cart_detail': reverse('cart:cart_detail'),
+        }
+        for url_name, url in pages.items():
+            self.assertWithinBudget(url_name, self.client.get(url))
+
+    def test_checkout(self):
+        self.assertWithinBudget('cart:cart_add', self.client.post(
+            reverse('cart:cart_add', kwargs={'product_id': self.products[4].id}), {'quantity': 1}))
+        resp = self.client.post(reverse('create_order'))
+        self.assertWithinBudget('create_order', resp)
+        self.assertWithinBudget('CheckOrder', self.client.post(
+            reverse('CheckOrder'), {'amount': '400', 'label': resp.context['order_number']}))
+        self.assertTrue(Order.objects.filter(paid=True).exists())
+
+    def test_report(self):
+        self.client.get(reverse('home'))
+        self.client.get(reverse('home'))
+        report = query_report.as_dict()
+        self.assertEqual(report['home']['requests'], 2)
+        self.assertEqual(report['home']['budget'], QUERY_BUDGETS['home'])
+        self.assertEqual(report['cart:cart_add']['requests'], 3)
+
+    def test_fingerprint(self):
+        self.assertEqual(fingerprint('SELECT 1 FROM a WHERE id IN (%s, %s, %s)'),
+                         fingerprint('SELECT 1 FROM a WHERE id IN (%s)'))
+
+
+class ImportProductsTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user(username='seller', password='123testpass', email='09mn@mail.ru',
+                                              is_seller=True)
+        User.objects.create_user(username='buyer', password='123testpass', email='09mn@mail.ru')
+        cls.category = Category.objects.create(name='category1', slug='category1')
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+
+    def write(self, name, text):
+        path = os.path.join(self.dir.name, name)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(text)
+        return path
+
+    def test_same_title_slugs_are_unique(self):
+        slugs = {get_slug('Видеокарта') for _ in range(1000)}
+        self.assertEqual(len(slugs), 1000)
+        self.assertTrue(get_slug('!!!').startswith('product-'))
+
+    def test_import_csv(self):
+        path = self.write('products.csv',
+                          'title,content,price,number,category,creator,is_published\n'
+                          'Видеокарта,быстрая,100,5,category1,seller,1\n'
+                          'Видеокарта,тихая,"150,5",2,%s,,1\n'
+                          'Процессор,скрытый,300,1,category1,,0\n'
+                          ',без названия,100,1,category1,,1\n'
+                          'Монитор,дешёвый,0,1,category1,,1\n'
+                          'Мышь,нет категории,10,1,missing,,1\n'
+                          'Клавиатура,чужая,10,1,category1,buyer,1\n' % self.category.pk)
+        out, err = StringIO(), StringIO()
+        call_command('import_products', path, creator='seller', batch_size=2, stdout=out, stderr=err)
+
+        self.assertIn('Загружено товаров: 3, строк с ошибками: 4', out.getvalue())
+        for line in (5, 6, 7, 8):
+            self.assertIn('Строка %s:' % line, err.getvalue())
+        products = Product.objects.filter(title='Видеокарта')
+        self.assertEqual(products.count(), 2)
+        self.assertEqual(len({product.slug for product in products}), 2)
+        self.assertEqual(products.get(content='тихая').price, 150.5)
+        self.assertFalse(Product.objects.get(title='Процессор').is_published)
+        self.category.refresh_from_db()
+        self.assertEqual(self.category.product_count, 2)
+        self.assertEqual(len(search_products('videokarta')), 2)
+
+    def test_import_jsonl(self):
+        path = self.write('products.jsonl',
+                          '{"title": "Монитор", "content": "большой", "price": 500, "number": 3, '
+                          '"category": "category1", "creator": "seller"}\n'
+                          '\n'
+                          '{"title": "Монитор"\n'
+                          '{"title": "Монитор", "content": "без продавца", "price": 500, "number": 3, '
+                          '"category": "category1"}\n')
+        out, err = StringIO(), StringIO()
+        call_command('import_products', path, stdout=out, stderr=err)
+
+        self.assertIn('Загружено товаров: 1, строк с ошибками: 2', out.getvalue())
+        self.assertIn('Строка 3: некорректный JSON', err.getvalue())
+        self.assertIn('Строка 4: не указан продавец', err.getvalue())
+        self.assertEqual(Product.objects.get(title='Монитор').creator, self.seller)
+
+    def test_dry_run(self):
+        path = self.write('products.csv', 'title,content,price,number,category\n'
+                                          'Видеокарта,быстрая,100,5,category1\n')
+        out = StringIO()
+        call_command('import_products', path, creator='seller', dry_run=True, stdout=out, stderr=StringIO())
+        self.assertIn('строк с ошибками: 0', out.getvalue())
+        self.assertFalse(Product.objects.exists())
+
+
+class SellerExportTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user(username='seller', password='123testpass', email='09mn@mail.ru',
+                                              is_seller=True)
+        other = User.objects.create_user(username='other', password='123testpass', email='09mn@mail.ru',
+                                         is_seller=True)
+        User.objects.create_user(username='buyer', password='123testpass', email='09mn@mail.ru')
+        cls.category = Category.objects.create(name='category1', slug='category1')
+        cls.products = [Product.objects.create(title='Видеокарта %s' % i, content='быстрая, тихая', price=100 + i,
+                                               number=5, category=cls.category, creator=cls.seller)
+                        for i in range(3)]
+        Product.objects.create(title='чужой', content='test', price=1, number=1, category=cls.category,
+                               creator=other)
+        Order.objects.create(name_seller=cls.seller, product=cls.products[0], price=100, number=2, order_number=1)
+        Order.objects.create(name_seller=other, product=cls.products[0], price=100, number=1, order_number=2)
+
+    def export(self, name, fmt):
+        self.client.login(username='seller', password='123testpass')
+        resp = self.client.get(reverse(name, kwargs={'fmt': fmt}))
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.streaming)
+        return resp
+
+    def test_products_csv(self):
+        resp = self.export('export_products', 'csv')
+        self.assertEqual(resp['Content-Disposition'], 'attachment; filename="products.csv"')
+        lines = b''.join(resp.streaming_content).decode('utf-8-sig').splitlines()
+        self.assertEqual(lines[0].split(',')[:3], ['id', 'title', 'slug'])
+        self.assertEqual(len(lines), 4)
+        self.assertIn('"быстрая, тихая"', lines[1])
+
+    def test_orders_jsonl(self):
+        resp = self.export('export_orders', 'jsonl')
+        rows = [json.loads(line) for line in b''.join(resp.streaming_content).decode().splitlines()]
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['product_title'], 'Видеокарта 0')
+        self.assertEqual(rows[0]['number'], 2)
+        self.assertEqual(rows[0]['order_number'], str(Order.objects.get(pk=rows[0]['id']).order_number))
+
+    def test_rows_are_read_lazily(self):
+        resp = self.export('export_products', 'csv')
+        content = iter(resp.streaming_content)
+        with self.assertNumQueries(0):
+            self.assertTrue(next(content).decode('utf-8-sig').startswith('id,'))
+        with self.assertNumQueries(1):
+            self.assertEqual(len(list(content)), 3)
+
+    def test_export_can_be_imported(self):
+        resp = self.export('export_products', 'csv')
+        with tempfile.NamedTemporaryFile('wb', suffix='.csv', delete=False) as file:
+            file.write(b''.join(resp.streaming_content))
+        self.addCleanup(os.remove, file.name)
+        out = StringIO()
+        call_command('import_products', file.name, creator='seller', stdout=out, stderr=StringIO())
+        self.assertIn('Загружено товаров: 3, строк с ошибками: 0', out.getvalue())
+
+    def test_access(self):
+        url = reverse('export_products', kwargs={'fmt': 'csv'})
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.login(username='buyer', password='123testpass')
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.login(username='seller', password='123testpass')
+        self.assertEqual(self.client.get(reverse('export_products', kwargs={'fmt': 'xml'})).status_code, 404)
+        resp = self.client.get(reverse('profile', kwargs={'profile_id': self.seller.pk}))
+        self.assertContains(resp, reverse('export_orders', kwargs={'fmt': 'jsonl'}))
+
+
+class SalesRollupTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user(username='seller', password='123testpass', email='09mn@mail.ru',
+                                              is_seller=True)
+        cls.other = User.objects.create_user(username='other', password='123testpass', email='09mn@mail.ru',
+                                             is_seller=True)
+        User.objects.create_user(username='buyer', password='123testpass', email='09mn@mail.ru')
+        category = Category.objects.create(name='category1', slug='category1')
+        cls.first = Product.objects.create(title='rtx', content='test', price=100, number=10, category=category,
+                                           creator=cls.seller)
+        cls.second = Product.objects.create(title='gtx', content='test', price=30, number=10, category=category,
+                                            creator=cls.seller)
+        cls.third = Product.objects.create(title='amd', content='test', price=50, number=10, category=category,
+                                           creator=cls.other)
+
+    def order(self, order_number, *lines):
+        for product, number in lines:
+            Order.objects.create(name_seller=product.creator, product=product, price=product.price, number=number,
+                                 order_number=order_number)
+        self.assertTrue(settle_order(order_number, 10 ** 6))
+
+    def rollups(self):
+        return (list(SellerDailySales.objects.order_by('seller').values_list('seller', 'units', 'revenue', 'orders')),
+                list(ProductDailySales.objects.order_by('product').values_list('product', 'seller', 'units',
+                                                                                'revenue')))
+
+    def test_incremental(self):
+        self.order(1, (self.first, 2), (self.third, 1))
+        self.order(2, (self.first, 1), (self.second, 3))
+        self.assertFalse(settle_order(2, 10 ** 6))
+
+        sellers, products = self.rollups()
+        self.assertEqual(sellers, [(self.seller.pk, 6, 390, 2), (self.other.pk, 1, 50, 1)])
+        self.assertEqual(products, [(self.first.pk, self.seller.pk, 3, 300), (self.second.pk, self.seller.pk, 3, 90),
+                                    (self.third.pk, self.other.pk, 1, 50)])
+        self.assertEqual(set(SellerDailySales.objects.values_list('day', flat=True)), {sales_day()})
+
+    def test_rebuild_matches_incremental(self):
+        self.order(1, (self.first, 2), (self.third, 1))
+        self.order(2, (self.first, 1), (self.second, 3))
+        Order.objects.create(name_seller=self.seller, product=self.first, price=100, number=5, order_number=3)
+        incremental = self.rollups()
+        SellerDailySales.objects.update(units=0)
+
+        call_command('rebuild_sales', stdout=StringIO())
+        self.assertEqual(self.rollups(), incremental)
+        call_command('rebuild_sales', since=sales_day(), stdout=StringIO())
+        self.assertEqual(self.rollups(), incremental)
+
+    def test_dashboard_reads_only_rollups(self):
+        self.order(1, (self.first, 2), (self.third, 1))
+        self.order(2, (self.second, 3))
+        self.client.login(username='seller', password='123testpass')
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.client.get(reverse('dashboard') + '?days=7')
+        self.assertEqual(resp.status_code, 200)
+        self.assertFalse([q['sql'] for q in queries if 'accounts_order' in q['sql']])
+        self.assertEqual(resp.context['totals'], {'units': 5, 'revenue': 290, 'orders': 2})
+        self.assertEqual([p['product'] for p in resp.context['top_products']], [self.first.pk, self.second.pk])
+        self.assertContains(resp, 'rtx')
+        self.assertNotContains(resp, 'amd')
+
+    def test_dashboard_access(self):
+        self.assertEqual(self.client.get(reverse('dashboard')).status_code, 302)
+        self.client.login(username='buyer', password='123testpass')
+        self.assertEqual(self.client.get(reverse('dashboard')).status_code, 403)
+
+
+@override_settings(ROOT_URLCONF='myshop.asgi_urls')
+class AsyncViewsTest(TestCase):
+    """
+    Асинхронные view из myshop.asgi_urls. AsyncClient в Django 3.2 не передаёт data и HTTP_* из extra:
+    строка запроса пишется в адресе, заголовки - под своими именами, тело формы - уже закодированным.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        seller = User.objects.create_user(username='seller', password='123testpass', email='09mn@mail.ru',
+                                          is_seller=True)
+        cls.buyer = User.objects.create_user(username='buyer', password='123testpass', email='09mn@mail.ru')
+        category = Category.objects.create(name='category1', slug='category1')
+        cls.products = [Product.objects.create(title='rtx%s' % i, content='test', price=100 + i, number=5,
+                                               views=i, category=category, creator=seller)
+                        for i in range(6)]
+
+    def setUp(self):
+        cache.clear()
+
+    def test_views_are_coroutines(self):
+        for url in (reverse('home'), reverse('sort_price_up', kwargs={'category_slug': 'category1'}),
+                    self.products[0].get_absolute_url(), reverse('cart:cart_detail')):
+            self.assertTrue(asyncio.iscoroutinefunction(resolve(url).func), url)
+        self.assertFalse(asyncio.iscoroutinefunction(resolve(reverse('search')).func))
+
+    async def test_catalog(self):
+        url = reverse('category', kwargs={'category_slug': 'category1'})
+        resp = await self.async_client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual([p.pk for p in resp.context['product']], [p.pk for p in self.products[::-1][:4]])
+        resp = await self.async_client.get('%s?cursor=%s' % (url, resp.context['page_obj'].next_cursor))
+        self.assertEqual([p.pk for p in resp.context['product']], [p.pk for p in self.products[1::-1]])
+        resp = await self.async_client.get(reverse('home_sort_price_up'))
+        self.assertEqual([p.pk for p in resp.context['product']], [p.pk for p in self.products[:4]])
+        resp = await self.async_client.get(reverse('category', kwargs={'category_slug': 'missing'}))
+        self.assertEqual(resp.status_code, 404)
+        resp = await self.async_client.get(url + '?cursor=wrong')
+        self.assertEqual(resp.status_code, 404)
+
+    async def test_product_counts_view(self):
+        counter = swap_view_counter(self)
+        product = self.products[0]
+        resp = await self.async_client.get(product.get_absolute_url())
+        self.assertContains(resp, product.title)
+        self.assertEqual(counter.pending_for(product.pk), 1)
+        again = await self.async_client.get(product.get_absolute_url(), **{'if-none-match': resp['ETag']})
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(counter.pending_for(product.pk), 2)
+
+    async def test_cart(self):
+        url = reverse('cart:cart_detail')
+        resp = await self.async_client.get(url)
+        self.assertEqual(resp.status_code, 302)
+        await sync_to_async(self.async_client.force_login)(self.buyer)
+        product = self.products[0]
+        await self.async_client.post(reverse('cart:cart_add', kwargs={'product_id': product.id}),
+                                     'quantity=2&update=on', content_type='application/x-www-form-urlencoded')
+        resp = await self.async_client.get(url)
+        self.assertContains(resp, product.title)
+
+
+class StockReservationTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user(username='seller', password='123testpass', email='09mn@mail.ru',
+                                              is_seller=True)
+        User.objects.create_user(username='buyer', password='123testpass', email='09mn@mail.ru')
+        category = Category.objects.create(name='category1', slug='category1')
+        cls.first = Product.objects.create(title='rtx', content='test', price=10, number=5, category=category,
+                                           creator=cls.seller)
+        cls.second = Product.objects.create(title='gtx', content='test', price=20, number=5, category=category,
+                                            creator=cls.seller)
+
+    def setUp(self):
+        self.client.login(username='buyer', password='123testpass')
+
+    def stock(self):
+        return list(Product.objects.order_by('id').values_list('number', flat=True))
+
+    def checkout(self, *lines):
+        for product, quantity in lines:
+            self.client.post(reverse('cart:cart_add', kwargs={'product_id': product.id}),
+                             {'quantity': quantity, 'update': 'on'})
+        return self.client.post(reverse('create_order'))
+
+    def test_order_reserves_stock(self):
+        resp = self.checkout((self.first, 2), (self.second, 5))
+        self.assertEqual(self.stock(), [3, 0])
+        self.assertFalse(Order.objects.filter(reserved_until__isnull=True).exists())
+        self.assertTrue(settle_order(resp.context['order_number'], 120))
+        self.assertEqual(self.stock(), [3, 0])
+        self.assertFalse(Order.objects.filter(reserved_until__isnull=False).exists())
+
+    def test_out_of_stock(self):
+        resp = self.checkout((self.first, 2), (self.second, 6))
+        self.assertContains(resp, 'Недостаточно товара')
+        self.assertEqual(resp.context['out_of_stock'], ['gtx'])
+        self.assertEqual(self.stock(), [5, 5])
+        self.assertFalse(Order.objects.exists())
+        self.assertTrue(self.client.session.get(settings.CART_SESSION_ID))
+
+    def test_expired_reservation_is_released(self):
+        resp = self.checkout((self.first, 2))
+        Order.objects.update(reserved_until=timezone.now() - timedelta(seconds=1))
+        out = StringIO()
+        call_command('release_reservations', stdout=out)
+        self.assertIn('Освобождено строк заказов: 1', out.getvalue())
+        self.assertEqual(self.stock(), [5, 5])
+        self.assertEqual(release_expired_reservations(), 0)
+
+        self.assertTrue(settle_order(resp.context['order_number'], 20))
+        self.assertEqual(self.stock(), [3, 5])
+
+    def test_late_payment_without_stock(self):
+        resp = self.checkout((self.first, 2))
+        Order.objects.update(reserved_until=timezone.now() - timedelta(seconds=1))
+        release_expired_reservations()
+        Product.objects.filter(pk=self.first.pk).update(number=1)
+        self.assertFalse(settle_order(resp.context['order_number'], 20))
+        self.assertEqual(self.stock(), [1, 5])
+        self.assertFalse(Order.objects.filter(paid=True).exists())
+        self.assertEqual(User.objects.get(pk=self.seller.pk).balance, 0)
+
+
+class StockContentionTest(TransactionTestCase):
+    """Параллельные покупатели не продают больше, чем есть на складе."""
+
+    def test_no_overselling(self):
+        seller = User.objects.create_user(username='seller', password='123testpass', email='09mn@mail.ru',
+                                          is_seller=True)
+        category = Category.objects.create(name='category1', slug='category1')
+        product = Product.objects.create(title='rtx', content='test', price=10, number=20, category=category,
+                                         creator=seller)
+        threads, attempts = 8, 10
+        results = []
+
+        def buyer():
+            reserved = done = 0
+            try:
+                for _ in range(attempts):
+                    while True:
+                        try:
+                            with transaction.atomic():
+                                reserve_stock({product.pk: 1})
+                            reserved += 1
+                        except OutOfStock:
+                            pass
+                        except OperationalError:
+                            # SQLite блокирует базу целиком, PostgreSQL сюда не попадает
+                            sleep(0.001)
+                            continue
+                        done += 1
+                        break
+            finally:
+                connections.close_all()
+            results.append((reserved, done))
+
+        workers = [threading.Thread(target=buyer) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join(timeout=30)
+        self.assertEqual([done for reserved, done in results], [attempts] * threads)
+        self.assertEqual(sum(reserved for reserved, done in results), 20)
+        self.assertEqual(Product.objects.get(pk=product.pk).number, 0)
+
+
+class OrderHeaderTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        seller = User.objects.create_user(username='seller', password='123testpass', email='09mn@mail.ru',
+                                          is_seller=True)
+        for name in ('first', 'second'):
+            User.objects.create_user(username=name, password='123testpass', email='09mn@mail.ru')
+        category = Category.objects.create(name='category1', slug='category1')
+        cls.products = [Product.objects.create(title='rtx%s' % i, content='test', price=10, number=50,
+                                               category=category, creator=seller)
+                        for i in range(2)]
+
+    def checkout(self, username):
+        self.client.login(username=username, password='123testpass')
+        for product in self.products:
+            self.client.post(reverse('cart:cart_add', kwargs={'product_id': product.id}), {'quantity': 2})
+        return self.client.post(reverse('create_order')).context['order_number']
+
+    @patch('accounts.ids.time', return_value=1700000000.0)
+    def test_same_second_checkouts_do_not_merge(self, time):
+        first, second = self.checkout('first'), self.checkout('second')
+        self.assertLess(first, second)
+        for number, username in ((first, 'first'), (second, 'second')):
+            header = OrderHeader.objects.get(pk=number)
+            self.assertEqual(header.buyer.username, username)
+            self.assertEqual(header.total, 40)
+            self.assertEqual(set(header.lines.values_list('order_number', flat=True)), {number})
+            self.assertEqual(header.lines.count(), 2)
+        self.assertTrue(settle_order(first, 40))
+        self.assertFalse(Order.objects.filter(order_number=second, paid=True).exists())
+
+    def test_ids_are_unique_across_threads(self):
+        generator = IdGenerator(worker=1)
+        ids = []
+
+        def take():
+            ids.extend(generator() for _ in range(5000))
+
+        threads = [threading.Thread(target=take) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(set(ids)), 20000)
+        self.assertLess(max(ids), 2 ** 63)
+
+    @patch('accounts.ids.time', return_value=1700000000.0)
+    def test_sequence_overflow_moves_to_next_millisecond(self, time):
+        generator = IdGenerator(worker=1)
+        ids = [generator() for _ in range(MAX_SEQUENCE + 10)]
+        self.assertEqual(ids, sorted(set(ids)))
+
+    @override_settings(ID_WORKER=None)
+    def test_worker_is_resolved_in_each_process(self):
+        generator = IdGenerator()
+        with patch('accounts.ids.os.getpid', return_value=1025):
+            self.assertIsNone(generator.worker)
+            generator()
+            self.assertEqual(generator.worker, 1)
+        generator.reset()
+        with patch('accounts.ids.os.getpid', return_value=7):
+            self.assertEqual(generator() >> SEQUENCE_BITS & MAX_WORKER, 7)
+
+    def test_worker_from_settings(self):
+        with override_settings(ID_WORKER=5):
+            self.assertEqual(IdGenerator()() >> SEQUENCE_BITS & MAX_WORKER, 5)
+            self.assertEqual(check_id_worker(None), [])
+        with override_settings(ID_WORKER=MAX_WORKER + 1):
+            with self.assertRaises(ImproperlyConfigured):
+                IdGenerator()()
+        with override_settings(ID_WORKER=None, DEBUG=False):
+            self.assertEqual([error.id for error in check_id_worker(None)], ['accounts.W002'])
+
+
+class AdminChangelistTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(username='admin', password='123testpass', email='09mn@mail.ru')
+        sellers = [User.objects.create_user(username='seller%s' % i, password='123testpass', email='09mn@mail.ru',
+                                            is_seller=True) for i in range(3)]
+        User.objects.create_user(username='idle-seller', password='123testpass', email='09mn@mail.ru',
+                                 is_seller=True)
+        category = Category.objects.create(name='Видеокарты', slug='cards')
+        cls.products = [Product.objects.create(title='Видеокарта 1%s' % i, content='test', price=10, number=5,
+                                               category=category, creator=sellers[i % 3],
+                                               is_published=i % 2 == 0)
+                        for i in range(6)]
+        cls.add_orders(5)
+
+    @classmethod
+    def add_orders(cls, count):
+        for i in range(count):
+            product = cls.products[i % len(cls.products)]
+            Order.objects.create(name_seller=product.creator, product=product, price=10, number=1,
+                                 order_number=1000 + i)
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def changelist(self, model, **params):
+        return self.client.get(reverse('admin:accounts_%s_changelist' % model), params)
+
+    def test_product_changelist_has_no_full_user_list(self):
+        resp = self.changelist('product')
+        self.assertEqual(resp.status_code, 200)
+        self.assertContains(resp, 'seller1')
+        self.assertContains(resp, 'creator__id__exact=')
+        self.assertNotContains(resp, 'idle-seller')
+
+    def test_order_changelist_queries_do_not_grow_with_rows(self):
+        with CaptureQueriesContext(connection) as before:
+            self.changelist('order')
+        self.add_orders(20)
+        with CaptureQueriesContext(connection) as after:
+            self.changelist('order')
+        self.assertEqual(len(after), len(before))
+
+    def test_product_search_uses_index(self):
+        resp = self.changelist('product', q='videokarta 13')
+        self.assertEqual(list(resp.context['cl'].result_list), [self.products[3]])
+        resp = self.changelist('product', q=str(self.products[0].pk))
+        self.assertIn(self.products[0], resp.context['cl'].result_list)
+
+    def test_user_search_by_prefix(self):
+        resp = self.changelist('user', q='seller')
+        self.assertEqual(sorted(user.username for user in resp.context['cl'].result_list),
+                         ['seller0', 'seller1', 'seller2'])
+
+    def test_order_search_by_number(self):
+        self.assertEqual(len(self.changelist('order', q='1002').context['cl'].result_list), 1)
+        self.assertEqual(len(self.changelist('order', q='abc').context['cl'].result_list), 0)
+
+    def test_estimated_count(self):
+        self.assertEqual(EstimatedCountPaginator(Product.objects.order_by('id'), 2).count, 6)
+        with patch('accounts.paginator.estimated_count', return_value=1000000):
+            paginator = EstimatedCountPaginator(Product.objects.order_by('id'), 20)
+            self.assertEqual(paginator.num_pages, 50000)
+
+
+class EstimatedCountPaginatorTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user(username='seller', password='123testpass', email='09mn@mail.ru',
+                                              is_seller=True)
+        cls.category = Category.objects.create(name='category1', slug='category1')
+        for i in range(12):
+            cls.add_product(i)
+
+    @classmethod
+    def add_product(cls, i):
+        Product.objects.create(title='rtx%s' % i, content='test', price=10, number=5, category=cls.category,
+                               creator=cls.seller)
+
+    def setUp(self):
+        cache.clear()
+
+    def paginator(self):
+        return EstimatedCountPaginator(Product.objects.filter(creator=self.seller).order_by('id'), 5)
+
+    def test_small_lists_are_counted_exactly(self):
+        self.assertEqual(self.paginator().count, 12)
+        self.add_product(12)
+        paginator = self.paginator()
+        self.assertEqual(paginator.count, 13)
+        self.assertFalse(paginator.estimated)
+
+    @patch('accounts.paginator.ESTIMATE_THRESHOLD', 10)
+    def test_large_counts_are_cached(self):
+        self.assertEqual(self.paginator().count, 12)
+        self.add_product(12)
+        paginator = self.paginator()
+        with self.assertNumQueries(0):
+            self.assertEqual(paginator.count, 12)
+        self.assertTrue(paginator.estimated)
+        self.assertEqual(list(paginator.page_range), [1, 2, 3])
+
+    @patch('accounts.paginator.ESTIMATE_THRESHOLD', 10)
+    def test_table_estimate(self):
+        with patch('accounts.paginator.estimated_count', return_value=5):
+            self.assertEqual(EstimatedCountPaginator(Product.objects.order_by('id'), 5).count, 12)
+        with patch('accounts.paginator.estimated_count', return_value=50000):
+            paginator = EstimatedCountPaginator(Product.objects.order_by('id'), 5)
+            with self.assertNumQueries(0):
+                self.assertEqual(paginator.num_pages, 10000)
+            self.assertEqual(len(paginator.page(2)), 5)
+
+    @patch('accounts.paginator.ESTIMATE_THRESHOLD', 10)
+    def test_filtered_lists_ignore_estimate(self):
+        with patch('accounts.paginator.estimated_count', return_value=50000) as estimate:
+            self.assertEqual(self.paginator().count, 12)
+            grouped = Product.objects.values('creator').annotate(total=Count('id')).filter(total__gt=0)
+            self.assertEqual(EstimatedCountPaginator(grouped.order_by('creator'), 5).count, 1)
+        estimate.assert_not_called()
+
+    def test_capped_count(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.paginator().count, 12)
+        self.assertEqual(len(queries), 1)
+        self.assertIn('LIMIT', queries[0]['sql'])
+
+    def test_profile_pages(self):
+        self.client.login(username='seller', password='123testpass')
+        resp = self.client.get(reverse('profile', kwargs={'profile_id': self.seller.pk}), {'page': 2})
+        self.assertIsInstance(resp.context['paginator'], EstimatedCountPaginator)
+        self.assertEqual(resp.context['paginator'].count, 12)
+        self.assertEqual(len(resp.context['product']), 2)
+
+
+@override_settings(PAGE_CACHE_ENABLED=True)
+class ConditionalGetTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username='test', password='123testpass', email='09mn@mail.ru')
+        cls.cards = Category.objects.create(name='category1', slug='category1')
+        cls.cpus = Category.objects.create(name='category2', slug='category2')
+        cls.product = Product.objects.create(title='rtx', content='test', price=10, number=5, category=cls.cards,
+                                             creator=user)
+        Product.objects.create(title='ryzen', content='test', price=10, number=5, category=cls.cpus, creator=user)
+
+    def setUp(self):
+        cache.clear()
+        self.view_counter = swap_view_counter(self)
+
+    def revalidate(self, url, resp):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=resp['ETag'])
+
+    def test_product_not_modified(self):
+        url = self.product.get_absolute_url()
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('no-cache', resp['Cache-Control'])
+        views = self.view_counter.pending_for(self.product.pk)
+        with self.assertNumQueries(1):
+            again = self.revalidate(url, resp)
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again.templates, [])
+        self.assertEqual(again['ETag'], resp['ETag'])
+        self.assertEqual(self.view_counter.pending_for(self.product.pk), views + 1)
+        resp = self.client.get(url, HTTP_IF_MODIFIED_SINCE=resp['Last-Modified'])
+        self.assertEqual(resp.status_code, 304)
+
+    def test_product_change_and_cart_change_etag(self):
+        url = self.product.get_absolute_url()
+        resp = self.client.get(url)
+        self.product.price = 20
+        self.product.save()
+        changed = self.revalidate(url, resp)
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], resp['ETag'])
+        self.client.post(reverse('cart:cart_add', kwargs={'product_id': self.product.id}), {'quantity': 1})
+        self.assertEqual(self.revalidate(url, changed).status_code, 200)
+        self.client.login(username='test', password='123testpass')
+        self.assertEqual(self.revalidate(url, changed).status_code, 200)
+
+    def test_catalog_not_modified(self):
+        home = reverse('home')
+        cpus = reverse('category', kwargs={'category_slug': 'category2'})
+        resp, cpus_resp = self.client.get(home), self.client.get(cpus)
+        self.assertEqual(self.revalidate(home, resp).status_code, 304)
+        self.product.title = 'rtx 3080'
+        self.product.save()
+        changed = self.revalidate(home, resp)
+        self.assertEqual(changed.status_code, 200)
+        self.assertContains(changed, 'rtx 3080')
+        self.assertEqual(self.revalidate(cpus, cpus_resp).status_code, 304)
+
+    def test_recommendations_change_only_product_pages(self):
+        home, url = reverse('home'), self.product.get_absolute_url()
+        home_resp, resp = self.client.get(home), self.client.get(url)
+        self.assertEqual(self.revalidate(url, resp).status_code, 304)
+        build_recommendations()
+        self.assertEqual(self.revalidate(url, resp).status_code, 200)
+        self.assertEqual(self.revalidate(home, home_resp).status_code, 304)
+
+
+@override_settings(PAGE_CACHE_ENABLED=False)
+class ConditionalGetWithoutSharedCacheTest(TestCase):
+    """Без общего кэша списки не проверяются, а ETag страницы товара строится по данным."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='test', password='123testpass', email='09mn@mail.ru')
+        cls.category = Category.objects.create(name='category1', slug='category1')
+        cls.product = Product.objects.create(title='rtx', content='test', price=10, number=5,
+                                             category=cls.category, creator=cls.user)
+
+    def setUp(self):
+        cache.clear()
+        swap_view_counter(self)
+
+    def revalidate(self, url, resp):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=resp['ETag'])
+
+    def test_catalog_is_not_revalidated(self):
+        home = reverse('home')
+        resp = self.client.get(home)
+        self.assertNotIn('ETag', resp)
+        Product.objects.create(title='gtx', content='test', price=10, number=5, category=self.category,
+                               creator=self.user)
+        changed = self.client.get(home, HTTP_IF_MODIFIED_SINCE=http_date())
+        self.assertEqual(changed.status_code, 200)
+        self.assertContains(changed, 'gtx')
+
+    def test_product_recommendations_change(self):
+        url = self.product.get_absolute_url()
+        resp = self.client.get(url)
+        self.assertEqual(self.revalidate(url, resp).status_code, 304)
+        other = Product.objects.create(title='psu', content='test', price=10, number=5,
+                                       category=self.category, creator=self.user)
+        ProductRecommendation.objects.create(product=self.product, recommended=other, rank=0, score=1, orders=2)
+        self.assertEqual(self.revalidate(url, resp).status_code, 200)
+
+
+@override_settings(VIEW_COUNTER_WRITE_BEHIND=False)
+class RecommendationTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user(username='seller', password='123testpass', email='09mn@mail.ru',
+                                              is_seller=True)
+        category = Category.objects.create(name='category1', slug='category1')
+        cls.gpu, cls.cpu, cls.ram, cls.psu = [
+            Product.objects.create(title=title, content='test', price=10, number=50, category=category,
+                                   creator=cls.seller)
+            for title in ('rtx', 'ryzen', 'ddr5', 'psu')]
+        baskets = [(cls.gpu, cls.psu)] * 4 + [(cls.gpu, cls.cpu, cls.psu)] * 2 + [(cls.cpu, cls.ram)] * 3 \
+            + [(cls.gpu, cls.ram)]
+        cls.add_orders(baskets, paid=True)
+        cls.add_orders([(cls.ram, cls.psu)] * 10, paid=False)
+
+    @classmethod
+    def add_orders(cls, baskets, paid):
+        start = Order.objects.count()
+        Order.objects.bulk_create([
+            Order(name_seller=cls.seller, product=product, price=10, number=1, paid=paid, order_number=start + i)
+            for i, basket in enumerate(baskets) for product in basket + basket[:1]])
+
+    def recommended(self, product):
+        return list(ProductRecommendation.objects.filter(product=product).order_by('rank')
+                    .values_list('recommended', 'orders'))
+
+    def test_neighbours(self):
+        self.assertEqual(build_recommendations(), 8)
+        self.assertEqual(self.recommended(self.gpu), [(self.psu.pk, 6), (self.cpu.pk, 2)])
+        self.assertEqual(self.recommended(self.ram), [(self.cpu.pk, 3)])
+        self.assertEqual(self.recommended(self.psu)[0], (self.gpu.pk, 6))
+        score = ProductRecommendation.objects.get(product=self.gpu, rank=0).score
+        self.assertAlmostEqual(score, 6 / (7 * 6) ** 0.5)
+
+    def test_chunks_and_limits(self):
+        build_recommendations()
+        expected = list(ProductRecommendation.objects.order_by('product', 'rank')
+                        .values_list('product', 'recommended', 'score'))
+        build_recommendations(chunk_size=3)
+        self.assertEqual(list(ProductRecommendation.objects.order_by('product', 'rank')
+                              .values_list('product', 'recommended', 'score')), expected)
+        build_recommendations(top_k=1, min_orders=1)
+        self.assertEqual(self.recommended(self.gpu), [(self.psu.pk, 6)])
+        build_recommendations(max_basket=2)
+        self.assertEqual(self.recommended(self.gpu), [(self.psu.pk, 4)])
+
+    def test_product_page(self):
+        call_command('build_recommendations', stdout=StringIO())
+        self.cpu.is_published = False
+        self.cpu.save()
+        resp = self.client.get(self.gpu.get_absolute_url())
+        self.assertEqual(resp.context['recommendations'], [self.psu])
+        self.assertContains(resp, 'С этим товаром покупают')
+
+
+class TrendingTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        seller = User.objects.create_user(username='seller', password='123testpass', email='09mn@mail.ru',
+                                          is_seller=True)
+        cls.category = Category.objects.create(name='category1', slug='category1')
+        cls.old, cls.viewed, cls.sold = [
+            Product.objects.create(title=title, content='test', price=10, number=5, category=cls.category,
+                                   creator=seller)
+            for title in ('old', 'viewed', 'sold')]
+        Product.objects.filter(pk=cls.old.pk).update(views=1000, views_seen=1000)
+        Product.objects.filter(pk=cls.viewed.pk).update(views=10)
+        ProductDailySales.objects.create(product=cls.sold, seller=seller, day=sales_day(), units=2, revenue=20)
+
+    def setUp(self):
+        cache.clear()
+
+    def scores(self):
+        return dict(Product.objects.values_list('pk', 'trending'))
+
+    def test_scores_decay(self):
+        self.assertEqual(update_trending(now=1000000), 2)
+        scores = self.scores()
+        self.assertEqual(scores[self.old.pk], 0)
+        self.assertEqual(scores[self.viewed.pk], 10)
+        self.assertEqual(scores[self.sold.pk], 2 * SALE_WEIGHT)
+        Product.objects.filter(pk=self.viewed.pk).update(views=14)
+        update_trending(now=1000000 + HALF_LIFE)
+        scores = self.scores()
+        self.assertEqual(scores[self.viewed.pk], 9)
+        self.assertEqual(scores[self.sold.pk], 2 * SALE_WEIGHT)
+
+    @patch('accounts.trending.time')
+    def test_decay_between_command_runs(self, time):
+        time.return_value = 1000000
+        call_command('update_trending', stdout=StringIO())
+        self.assertEqual(self.scores()[self.viewed.pk], 10)
+        # Следующий запуск - новый процесс с пустым кэшем
+        cache.clear()
+        time.return_value = 1000000 + HALF_LIFE
+        call_command('update_trending', stdout=StringIO())
+        self.assertEqual(self.scores()[self.viewed.pk], 5)
+        self.assertEqual(TrendingState.objects.get().last_run, 1000000 + HALF_LIFE)
+
+    def test_one_update_per_batch(self):
+        with CaptureQueriesContext(connection) as queries:
+            update_trending(now=1000000, batch_size=2)
+        self.assertEqual(len([q for q in queries.captured_queries
+                              if q['sql'].startswith('UPDATE "accounts_product"')]), 2)
+        self.assertEqual(update_trending(now=1000000), 0)
+
+    def test_sort(self):
+        update_trending(now=1000000)
+        for url in (reverse('home_sort_trending'), reverse('sort_trending', kwargs={'category_slug': 'category1'})):
+            resp = self.client.get(url)
+            self.assertEqual(list(resp.context['product']), [self.sold, self.viewed, self.old])
+            self.assertContains(resp, 'В тренде')
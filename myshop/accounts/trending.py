@@ -0,0 +1,89 @@
+from datetime import timedelta
+from time import time
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Case, FloatField, PositiveIntegerField, Value, When
+
+from .models import Product, ProductDailySales, TrendingState
+from .pagecache import ALL_PAGES, purge
+from .sales import sales_day
+
+# За HALF_LIFE секунд вклад просмотров и продаж в тренд уменьшается вдвое
+HALF_LIFE = getattr(settings, 'TRENDING_HALF_LIFE', 60 * 60 * 24)
+VIEW_WEIGHT = 1.0
+SALE_WEIGHT = 20.0
+SALES_DAYS = 14
+BATCH_SIZE = 500
+MIN_SCORE = 0.01
+
+
+def _case(ids, values, output_field):
+    return Case(*[When(pk=pk, then=Value(value)) for pk, value in zip(ids, values)], output_field=output_field)
+
+
+def sales_scores(today=None):
+    """Продажи за последние SALES_DAYS дней по сводкам с затуханием по возрасту дня: (id товаров, оценки)."""
+    today = today or sales_day()
+    rows = list(ProductDailySales.objects.filter(day__gt=today - timedelta(days=SALES_DAYS))
+                .values_list('product', 'day', 'units'))
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty(0)
+    products = np.array([row[0] for row in rows], dtype=np.int64)
+    ages = np.array([(today - row[1]).days for row in rows]) * 86400
+    units = np.array([row[2] for row in rows])
+    ids, index = np.unique(products, return_inverse=True)
+    return ids, np.bincount(index.ravel(), weights=SALE_WEIGHT * units * 0.5 ** (ages / HALF_LIFE))
+
+
+def update_trending(now=None, batch_size=BATCH_SIZE):
+    """
+    Пересчитывает Product.trending для всех товаров и возвращает число изменённых строк.
+
+    Просмотры с прошлого запуска (views - views_seen) добавляются к trend_views, который перед
+    этим затухает по времени, прошедшему с прошлого запуска. К нему прибавляются продажи из дневных
+    сводок. Товары читаются пачками по id, оценки считаются NumPy для всей пачки, а изменившиеся
+    строки записываются одним UPDATE ... CASE. Страницы каталога от этого столбца только читают.
+    Время запуска хранится в TrendingState, чтобы следующий запуск в другом процессе знал, сколько
+    прошло времени.
+    """
+    now = now or time()
+    last_run = TrendingState.objects.filter(pk=1).values_list('last_run', flat=True).first()
+    decay = 0.5 ** (max(now - last_run, 0) / HALF_LIFE) if last_run else 1.0
+    sale_ids, sale_scores = sales_scores()
+
+    changed = 0
+    last_id = 0
+    while True:
+        rows = list(Product.objects.filter(pk__gt=last_id).order_by('pk')
+                    .values_list('pk', 'views', 'views_seen', 'trend_views', 'trending')[:batch_size])
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        data = np.array(rows, dtype=np.float64)
+        ids = data[:, 0].astype(np.int64)
+        fresh = np.maximum(data[:, 1] - data[:, 2], 0)
+        trend_views = data[:, 3] * decay + VIEW_WEIGHT * fresh
+        trend_views[trend_views < MIN_SCORE] = 0
+        sales = np.zeros(len(ids))
+        if len(sale_ids):
+            position = np.minimum(np.searchsorted(sale_ids, ids), len(sale_ids) - 1)
+            found = sale_ids[position] == ids
+            sales[found] = sale_scores[position[found]]
+        trending = trend_views + sales
+
+        update = (data[:, 1] != data[:, 2]) | (trend_views != data[:, 3]) | (trending != data[:, 4])
+        if not update.any():
+            continue
+        ids = ids[update].tolist()
+        Product.objects.filter(pk__in=ids).update(
+            views_seen=_case(ids, data[update, 1].astype(np.int64).tolist(), PositiveIntegerField()),
+            trend_views=_case(ids, trend_views[update].tolist(), FloatField()),
+            trending=_case(ids, trending[update].tolist(), FloatField()),
+        )
+        changed += len(ids)
+
+    TrendingState.objects.update_or_create(pk=1, defaults={'last_run': now})
+    if changed:
+        purge(ALL_PAGES)
+    return changed
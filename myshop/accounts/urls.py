@@ -2,10 +2,27 @@ from django.contrib.auth import views
 from django.urls import path, include
 from .views import *
 
-urlpatterns = [
-    path('', Home.as_view(), name='home'),
-    path('sort_price_down', HomeSortPriceDown.as_view(), name='home_sort_price_down'),
-    path('sort_price_up', HomeSortPriceUp.as_view(), name='home_sort_price_up'),
+
+def catalog_urlpatterns(catalog, product):
+    """
+    Списки товаров и страница товара. catalog(sort) возвращает view списка с этой сортировкой.
+    myshop.asgi_urls собирает те же адреса с асинхронными view.
+    """
+    return [
+        path('', catalog('views'), name='home'),
+        path('sort_price_down', catalog('price_down'), name='home_sort_price_down'),
+        path('sort_price_up', catalog('price_up'), name='home_sort_price_up'),
+        path('sort_trending', catalog('trending'), name='home_sort_trending'),
+        path('product/<slug:product_slug>/', product, name='product'),
+        path('category/<slug:category_slug>/', catalog('views'), name='category'),
+        path('category/<slug:category_slug>/sort_price_down', catalog('price_down'), name='sort_price_down'),
+        path('category/<slug:category_slug>/sort_price_up', catalog('price_up'), name='sort_price_up'),
+        path('category/<slug:category_slug>/sort_trending', catalog('trending'), name='sort_trending'),
+    ]
+
+
+account_urlpatterns = [
+    path('search/', Search.as_view(), name='search'),
     path('info/', Info.as_view(), name='info'),
     path('registry/', Registry.as_view(), name='registry'),
     path('registry_seller/', RegistrySeller.as_view(), name='registry_seller'),
@@ -14,17 +31,17 @@ urlpatterns = [
     path('login/', LoginUser.as_view(), name='login'),
     path('logout/', logout_user, name='logout'),
     path('add_product/', AddProduct.as_view(), name='add_product'),
-    path('product/<slug:product_slug>/', ShowProduct.as_view(), name='product'),
-    path('category/<slug:category_slug>/', ShowCategory.as_view(), name='category'),
-    path('category/<slug:category_slug>/sort_price_down', ShowCategorySortPriceDown.as_view(), name='sort_price_down'),
-    path('category/<slug:category_slug>/sort_price_up', ShowCategorySortPriceUp.as_view(), name='sort_price_up'),
     path('profile/<int:profile_id>/', UserProfile.as_view(), name='profile'),
+    path('profile/dashboard/', SellerDashboard.as_view(), name='dashboard'),
+    path('profile/export/products.<str:fmt>', ExportProducts.as_view(), name='export_products'),
+    path('profile/export/orders.<str:fmt>', ExportOrders.as_view(), name='export_orders'),
     path('edit_user/', EditUser.as_view(), name='edit_user'),
     path('<slug:product_slug>/edit_product/', EditProduct.as_view(), name='edit_product'),
     path('<slug:product_slug>/delete_product/', DeleteProduct.as_view(), name='delete_product'),
     path('change_password/', ChangePassword.as_view(), name='change_password'),
     path('password_reset/',
-         views.PasswordResetView.as_view(template_name='accounts/password/password_reset.html'),
+         views.PasswordResetView.as_view(template_name='accounts/password/password_reset.html',
+                                          form_class=OutboxPasswordResetForm),
          name='password_reset'),
     path('password_reset/done/',
          views.PasswordResetDoneView.as_view(template_name='accounts/password/password_reset_done.html'),
@@ -39,3 +56,5 @@ urlpatterns = [
     path('check_order/', CheckOrder, name='CheckOrder'),
 
 ]
+
+urlpatterns = catalog_urlpatterns(lambda sort: Catalog.as_view(sort=sort), ShowProduct.as_view()) + account_urlpatterns
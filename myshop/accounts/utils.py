@@ -1,23 +1,70 @@
-from django.db.models import Count
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db.models import Count, Q
 
 from .models import *
+from .paginator import EstimatedCountPaginator
 
 menu = [{'title': "Информация", 'url_name': 'info'},
         ]
 
+CATEGORY_CACHE_KEY = 'accounts:categories'
+CATEGORY_CACHE_TIMEOUT = 60 * 15
+
+
+def get_categories():
+    """Непустые категории для бокового меню. Читаются из кэша, при промахе - одним запросом по счётчику."""
+    category = cache.get(CATEGORY_CACHE_KEY)
+    if category is None:
+        category = list(Category.objects.filter(product_count__gt=0))
+        cache.set(CATEGORY_CACHE_KEY, category, CATEGORY_CACHE_TIMEOUT)
+    return category
+
+
+def reset_categories_cache():
+    cache.delete(CATEGORY_CACHE_KEY)
+
+
+def rebuild_category_counts(category_ids=None):
+    """Пересчитывает product_count с нуля. Без аргументов - для всех категорий."""
+    categories = Category.objects.all()
+    if category_ids is not None:
+        categories = categories.filter(pk__in=category_ids)
+    categories = categories.annotate(published=Count('product', filter=Q(product__is_published=True)))
+    changed = [category for category in categories if category.product_count != category.published]
+    for category in changed:
+        category.product_count = category.published
+    Category.objects.bulk_update(changed, ['product_count'])
+    reset_categories_cache()
+    return len(changed)
+
+
+def user_context(request, **kwargs):
+    context = kwargs
+    category = get_categories()
+    if request.user.is_authenticated:
+        context['profile'] = [request.user]
+    user_menu = menu.copy()
+    context['menu'] = user_menu
+    context['category'] = category
+    if 'selected_category' not in context:
+        context['selected_category'] = 0
+    return context
+
+
+async def async_user_context(request, **kwargs):
+    """
+    get_user_context для асинхронных view. Категории читаются из кэша или базы, а request.user
+    загружается из сессии при первом обращении, поэтому всё это выполняется через sync_to_async.
+    После этого пользователь и сессия уже загружены, и шаблон обращается к ним без запросов.
+    """
+    return await sync_to_async(user_context)(request, **kwargs)
+
 
 class DataMixin:
     paginate_by = 4
+    paginator_class = EstimatedCountPaginator
 
     def get_user_context(self, **kwargs):
-        context = kwargs
-        category = Category.objects.annotate(Count('product'))
-        if self.request.user.is_authenticated:
-            profile = User.objects.filter(username=self.request.user)
-            context['profile'] = profile
-        user_menu = menu.copy()
-        context['menu'] = user_menu
-        context['category'] = category
-        if 'selected_category' not in context:
-            context['selected_category'] = 0
-        return context
+        return user_context(self.request, **kwargs)
+
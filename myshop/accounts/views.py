@@ -1,73 +1,165 @@
+from asgiref.sync import sync_to_async
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.contrib.auth.views import LoginView, PasswordChangeView, PasswordResetView
 from django.contrib.sites.shortcuts import get_current_site
 from django.db.models import F
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import HttpResponse, HttpResponseNotFound, Http404
+from django.http import HttpResponse, HttpResponseNotFound, Http404, JsonResponse
 from django.contrib.auth import authenticate, logout, login, get_user_model
 from django.template.loader import render_to_string
+from django.template.response import TemplateResponse
 from django.urls import reverse_lazy
 from django.utils.encoding import force_bytes, force_str
-from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
-from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView, TemplateView
-from django.core.mail import EmailMessage
-from time import time
+from django.utils.http import urlencode, urlsafe_base64_encode, urlsafe_base64_decode
+from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView, TemplateView, View
 
 from cart.cart import Cart
 from cart.forms import CartAddProductForm
+from .conditional import ConditionalGetMixin, add_validators, listing_validators, not_modified, product_validators
+from .counters import get_view_counter
+from .exports import EXPORT_FORMATS, ORDER_EXPORT_FIELDS, PRODUCT_EXPORT_FIELDS, export_response
 from .forms import *
+from .mail import queue_email
+from .middleware import query_report
 from .models import *
+from .orders import create_order, settle_order
+from .pagecache import PageCacheMixin, cached_page, category_group, home_group, store_page
+from .sales import seller_dashboard
+from .paginator import InvalidCursor, KeysetPaginator
+from .search import load_products, search_products
+from .stock import OutOfStock
 from .tokens import account_activation_token
 from .utils import *
 
 
-class Home(DataMixin, ListView):
+CATALOG_SORTS = {
+    'views': ['-views', '-id'],
+    'price_down': ['-price', '-id'],
+    'price_up': ['price', 'id'],
+    'trending': ['-trending', '-id'],
+}
+
+
+class Catalog(ConditionalGetMixin, PageCacheMixin, DataMixin, ListView):
     model = Product
     template_name = 'accounts/index.html'
     context_object_name = 'product'
-    ordering = ['-views']
+    sort = 'views'
 
-    def get_context_data(self, *, object_list=None, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context_mixin = self.get_user_context(title="Главная страница")
-        context['position'] = 'home'
-        return context | context_mixin
+    def get_page_group(self):
+        if 'category_slug' in self.kwargs:
+            return category_group(self.kwargs['category_slug'])
+        return home_group()
 
-    def get_queryset(self):
-        return super().get_queryset().filter(is_published=True)
+    def get_validators(self):
+        return listing_validators(self.request, self.get_page_group())
 
+    def get(self, request, *args, **kwargs):
+        self.category = None
+        if 'category_slug' in kwargs:
+            self.category = get_object_or_404(Category, slug=kwargs['category_slug'])
+        return super().get(request, *args, **kwargs)
 
-class HomeSortPriceDown(DataMixin, ListView):
-    model = Product
-    template_name = 'accounts/index.html'
-    context_object_name = 'product'
-    ordering = ['-price']
+    def get_ordering(self):
+        return CATALOG_SORTS[self.sort]
+
+    def get_queryset(self):
+        return catalog_queryset(super().get_queryset(), self.category)
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator, page = catalog_page(queryset, page_size, self.get_ordering(), self.category,
+                                       self.request.GET.get('cursor'))
+        return paginator, page, page.object_list, page.has_other_pages()
 
     def get_context_data(self, *, object_list=None, **kwargs):
         context = super().get_context_data(**kwargs)
-        context_mixin = self.get_user_context(title="Главная страница")
-        context['position'] = 'home'
+        context_mixin = self.get_user_context(**catalog_title(self.category))
+        context['position'] = 'home' if self.category is None else 'category'
+        context['sort'] = self.sort
+        context['cursor_pagination'] = True
         return context | context_mixin
 
-    def get_queryset(self):
-        return super().get_queryset().filter(is_published=True)
 
+def catalog_queryset(queryset, category):
+    queryset = queryset.filter(is_published=True)
+    if category is not None:
+        queryset = queryset.filter(category=category)
+    return queryset
 
-class HomeSortPriceUp(DataMixin, ListView):
-    model = Product
-    template_name = 'accounts/index.html'
+
+def catalog_page(queryset, page_size, ordering, category, cursor):
+    paginator = KeysetPaginator(queryset, page_size, ordering)
+    try:
+        page = paginator.page(cursor)
+    except InvalidCursor:
+        raise Http404('Неверный курсор')
+    if category is not None and page.number == 1 and not page.object_list:
+        raise Http404('Категория пуста')
+    return paginator, page
+
+
+def catalog_title(category):
+    if category is None:
+        return {'title': "Главная страница"}
+    return {'title': 'Категория - ' + str(category.name), 'selected_category': category.pk}
+
+
+def async_catalog(sort='views'):
+    """
+    Асинхронная версия Catalog.as_view(sort=sort) для ASGI (myshop.asgi_urls): те же условные
+    GET-запросы, кэш страниц и шаблон. В Django 3.2 нет асинхронного ORM, поэтому каждый запрос
+    к базе и кэшу отдельно уходит в sync_to_async, а между ними view отдаёт управление циклу событий.
+    """
+    async def catalog(request, category_slug=None):
+        group = home_group() if category_slug is None else category_group(category_slug)
+        validators = await sync_to_async(listing_validators)(request, group)
+        if validators is not None:
+            response = not_modified(request, validators)
+            if response is not None:
+                return add_validators(response, validators)
+        key, response = await sync_to_async(cached_page)(request, group)
+        if response is None:
+            category = None
+            if category_slug is not None:
+                category = await sync_to_async(get_object_or_404)(Category, slug=category_slug)
+            paginator, page = await sync_to_async(catalog_page)(
+                catalog_queryset(Product.objects.all(), category), DataMixin.paginate_by, CATALOG_SORTS[sort],
+                category, request.GET.get('cursor'))
+            context = await async_user_context(request, **catalog_title(category))
+            context.update(product=page.object_list, page_obj=page, paginator=paginator,
+                           is_paginated=page.has_other_pages(), sort=sort, cursor_pagination=True,
+                           position='home' if category is None else 'category')
+            response = store_page(request, key, TemplateResponse(request, 'accounts/index.html', context))
+        if validators is None or response.status_code != 200:
+            return response
+        return add_validators(response, validators)
+    return catalog
+
+
+class Search(DataMixin, ListView):
+    template_name = 'accounts/search.html'
     context_object_name = 'product'
-    ordering = ['price']
+
+    def get_queryset(self):
+        self.query = self.request.GET.get('q', '').strip()
+        self.category = None
+        if self.request.GET.get('category'):
+            self.category = get_object_or_404(Category, slug=self.request.GET['category'])
+        return search_products(self.query, self.category)
 
     def get_context_data(self, *, object_list=None, **kwargs):
         context = super().get_context_data(**kwargs)
-        context_mixin = self.get_user_context(title="Главная страница")
-        context['position'] = 'home'
+        context_mixin = self.get_user_context(title='Поиск - ' + self.query,
+                                              selected_category=None)
+        context['product'] = load_products(context['page_obj'].object_list)
+        context['query'] = self.query
+        context['search_category'] = self.category
+        params = {'q': self.query}
+        if self.category is not None:
+            params['category'] = self.category.slug
+        context['page_query'] = urlencode(params) + '&'
         return context | context_mixin
 
-    def get_queryset(self):
-        return super().get_queryset().filter(is_published=True)
-
 
 class Info(DataMixin, TemplateView):
     template_name = 'accounts/info.html'
@@ -118,7 +210,6 @@ class Registry(DataMixin, CreateView):
         user = form.save()
         user.is_active = False
         user.save()
-        print(user.password)
         current_site = get_current_site(self.request)
         mail_subject = 'Ссылка для подтверждения регистрации'
         message = render_to_string('accounts/activation_email.html', {
@@ -128,10 +219,7 @@ class Registry(DataMixin, CreateView):
             'token': account_activation_token.make_token(user),
         })
         to_email = form.cleaned_data.get('email')
-        email = EmailMessage(
-            mail_subject, message, to=[to_email]
-        )
-        email.send()
+        queue_email(mail_subject, message, to_email)
         login(self.request, user)
         return redirect('registry_done')
 
@@ -145,7 +233,6 @@ class RegistrySeller(DataMixin, CreateView):
         context = super().get_context_data(**kwargs)
         context_mixin = self.get_user_context(title="Регистрация продавца",
                                               selected_category=None)
-        print(context | context_mixin)
         return context | context_mixin
 
     def form_valid(self, form):
@@ -162,10 +249,7 @@ class RegistrySeller(DataMixin, CreateView):
             'token': account_activation_token.make_token(user),
         })
         to_email = form.cleaned_data.get('email')
-        email = EmailMessage(
-            mail_subject, message, to=[to_email]
-        )
-        email.send()
+        queue_email(mail_subject, message, to_email)
         user = form.save()
         login(self.request, user)
         return redirect('registry_done')
@@ -209,79 +293,67 @@ def logout_user(request):
     return redirect('login')
 
 
-class ShowProduct(DataMixin, DetailView):
+class ShowProduct(ConditionalGetMixin, DataMixin, DetailView):
     model = Product
     template_name = 'accounts/product.html'
     slug_url_kwarg = 'product_slug'
     context_object_name = 'product'
+    queryset = Product.objects.select_related('creator')
+
+    def get_object(self, queryset=None):
+        # Товар загружается один раз: сначала для проверки ETag, потом для отрисовки.
+        # Просмотр учитывается и тогда, когда страница не отрисовывается из-за ответа 304.
+        if not hasattr(self, '_product'):
+            self._product = super().get_object(queryset)
+            get_view_counter().add(self._product.pk)
+        return self._product
+
+    def get_recommendations(self):
+        if not hasattr(self, '_recommendations'):
+            self._recommendations = product_recommendations(self.get_object())
+        return self._recommendations
 
-    # def get_object(self, *args, **kwargs):
-    #     return Product.objects.filter(slug=Product.slug).update(views=F('views') + 1)
+    def get_validators(self):
+        return product_validators(self.request, self.get_object(), self.get_recommendations)
 
     def get_context_data(self, *, object_list=None, **kwargs):
         context = super().get_context_data(**kwargs)
         context_mixin = self.get_user_context(title=context['product'],
                                               selected_category=None)
-        context['other_profile'] = User.objects.filter(product__slug=self.kwargs['product_slug'])
+        context['other_profile'] = [context['product'].creator]
         cart_product_form = CartAddProductForm()
         context['cart_product_form'] = cart_product_form
-        Product.objects.filter(slug=self.kwargs['product_slug']).update(views=F('views') + 1)
-        return context | context_mixin
-
-
-class ShowCategory(DataMixin, ListView):
-    model = Product
-    template_name = 'accounts/index.html'
-    context_object_name = 'product'
-    allow_empty = False
-    ordering = ['-views']
-
-    def get_queryset(self):
-        return super().get_queryset().filter(category__slug=self.kwargs['category_slug'], is_published=True)
-
-    def get_context_data(self, *, object_list=None, **kwargs):
-        context = super().get_context_data(**kwargs)
-        category1 = Category.objects.get(slug=self.kwargs['category_slug'])
-        context_mixin = self.get_user_context(title='Категория - ' + str(category1.name),
-                                              selected_category=category1.pk)
-        context['position'] = 'category'
+        context['recommendations'] = self.get_recommendations()
         return context | context_mixin
 
 
-class ShowCategorySortPriceDown(DataMixin, ListView):
-    model = Product
-    template_name = 'accounts/index.html'
-    context_object_name = 'product'
-    allow_empty = False
-    ordering = ['-price']
-
-    def get_queryset(self):
-        return super().get_queryset().filter(category__slug=self.kwargs['category_slug'], is_published=True)
-
-    def get_context_data(self, *, object_list=None, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context_mixin = self.get_user_context(title='Категория - ' + str(context['product'][0].category),
-                                              selected_category=context['product'][0].category_id)
-        context['position'] = 'category'
-        return context | context_mixin
+def product_recommendations(product):
+    return [recommendation.recommended for recommendation in
+            ProductRecommendation.objects.filter(product=product, recommended__is_published=True)
+            .select_related('recommended').order_by('rank')]
 
 
-class ShowCategorySortPriceUp(DataMixin, ListView):
-    model = Product
-    template_name = 'accounts/index.html'
-    context_object_name = 'product'
-    allow_empty = False
-    ordering = ['price']
+async def show_product_async(request, product_slug):
+    """Асинхронная версия ShowProduct для ASGI (myshop.asgi_urls), запросы к базе - через sync_to_async."""
+    product = await sync_to_async(get_object_or_404)(ShowProduct.queryset, slug=product_slug)
+    await sync_to_async(get_view_counter().add)(product.pk)
+    recommendations = None
 
-    def get_queryset(self):
-        return super().get_queryset().filter(category__slug=self.kwargs['category_slug'], is_published=True)
+    def get_recommendations():
+        nonlocal recommendations
+        if recommendations is None:
+            recommendations = product_recommendations(product)
+        return recommendations
 
-    def get_context_data(self, *, object_list=None, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context_mixin = self.get_user_context(title='Категория - ' + str(context['product'][0].category),
-                                              selected_category=context['product'][0].category_id)
-        context['position'] = 'category'
-        return context | context_mixin
+    validators = await sync_to_async(product_validators)(request, product, get_recommendations)
+    response = not_modified(request, validators)
+    if response is None:
+        context = await async_user_context(request, title=product, selected_category=None)
+        context.update(product=product, object=product, other_profile=[product.creator],
+                       cart_product_form=CartAddProductForm(),
+                       recommendations=await sync_to_async(get_recommendations)())
+        response = TemplateResponse(request, 'accounts/product.html', context)
+    return add_validators(response, validators)
 
 
 class UserProfile(LoginRequiredMixin, DataMixin, ListView):
@@ -294,7 +366,7 @@ class UserProfile(LoginRequiredMixin, DataMixin, ListView):
     paginate_by = 10
 
     def get_queryset(self):
-        return Product.objects.filter(creator__id=self.kwargs['profile_id'])
+        return Product.objects.filter(creator__id=self.kwargs['profile_id']).order_by('id')
 
     def get_context_data(self, *, object_list=None, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -304,6 +376,55 @@ class UserProfile(LoginRequiredMixin, DataMixin, ListView):
         return context | context_mixin
 
 
+class SellerExportMixin(LoginRequiredMixin, UserPassesTestMixin):
+    """
+    Выгрузка данных продавца в CSV или JSONL без загрузки всех строк в память.
+    Представление задаёт fields, filename и get_queryset().
+    """
+    fields = ()
+    filename = ''
+
+    def test_func(self):
+        return self.request.user.is_seller
+
+    def get(self, request, fmt):
+        if fmt not in EXPORT_FORMATS:
+            raise Http404('Неизвестный формат')
+        return export_response(self.get_queryset().order_by('id'), self.fields, fmt, self.filename)
+
+
+class ExportProducts(SellerExportMixin, View):
+    fields = PRODUCT_EXPORT_FIELDS
+    filename = 'products'
+
+    def get_queryset(self):
+        return Product.objects.filter(creator=self.request.user)
+
+
+class ExportOrders(SellerExportMixin, View):
+    fields = ORDER_EXPORT_FIELDS
+    filename = 'orders'
+
+    def get_queryset(self):
+        return Order.objects.filter(name_seller=self.request.user)
+
+
+class SellerDashboard(LoginRequiredMixin, UserPassesTestMixin, DataMixin, TemplateView):
+    template_name = 'accounts/dashboard.html'
+    periods = (7, 30, 90, 365)
+
+    def test_func(self):
+        return self.request.user.is_seller
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        days = self.request.GET.get('days', '30')
+        days = int(days) if days.isdigit() and int(days) in self.periods else 30
+        context_mixin = self.get_user_context(title='Продажи', selected_category=None)
+        return context | seller_dashboard(self.request.user, days) | {'days': days, 'periods': self.periods} \
+            | context_mixin
+
+
 class EditUser(LoginRequiredMixin, DataMixin, UpdateView):
     form_class = EditUserForm
     template_name = 'accounts/edit_user.html'
@@ -370,41 +491,37 @@ class CreateOrder(LoginRequiredMixin, DataMixin, TemplateView):
         context = super().get_context_data(**kwargs)
         context_mixin = self.get_user_context(title="Оформление заказа",
                                               selected_category=None)
-        cart = Cart(self.request)
-        order_number = int(time())
-        total_price = 0
-        for item in cart:
-            name_seller = User.objects.filter(product__title=item['product'])
-            total_price += item['price']
-            Order.objects.create(name_seller=name_seller[0], product=item['product'], price=item['price'],
-                                 number=item['quantity'], order_number=order_number)
-            print(name_seller[0])
-            print(item)
-        cart.clear()
-        context['price'] = total_price
-        context['order_number'] = order_number
+        if 'price' not in context:
+            context['price'] = Cart(self.request).get_total_price()
         return context | context_mixin
 
+    def post(self, request, *args, **kwargs):
+        try:
+            order = create_order(Cart(request), buyer=request.user)
+        except OutOfStock as error:
+            out_of_stock = Product.objects.filter(pk__in=error.product_ids).values_list('title', flat=True)
+            return self.render_to_response(self.get_context_data(out_of_stock=list(out_of_stock)))
+        if order is None:
+            return self.render_to_response(self.get_context_data(price=0))
+        order_number, price = order
+        return self.render_to_response(self.get_context_data(price=price, order_number=order_number))
+
 
 def CheckOrder(request):
     if request.method == 'POST':
-        amount = request.POST.get('amount')
-        label = request.POST.get('label')
-        order = Order.objects.filter(order_number=label)
-        product = Product.objects.filter(order__order_number=label)
-        tmp = -1
-        for item in order:
-            tmp += 1
-            item.paid = True
-            item.save()
-            user = User.objects.get(username=item.name_seller)
-            if amount >= 0:
-                user.balance += product[tmp].price
-                amount -= product[tmp].price
-                product[tmp].number -= 1
-                user.save()
+        try:
+            # withdraw_amount - сколько заплатил покупатель, amount - сумма за вычетом комиссии
+            amount = float(request.POST.get('withdraw_amount') or request.POST.get('amount'))
+            label = int(request.POST.get('label'))
+        except (TypeError, ValueError):
+            return redirect('home')
+        settle_order(label, amount)
     return redirect('home')
 
 
+def query_stats(request):
+    return JsonResponse(query_report.as_dict(), json_dumps_params={'ensure_ascii': False, 'indent': 2})
+
+
 def pageNotFound(request, exception):
     return HttpResponseNotFound("<h1>Страница не найдена</h1>")
@@ -1,56 +1,94 @@
-from decimal import Decimal
+from decimal import ROUND_HALF_UP, Decimal
 from django.conf import settings
 from accounts.models import Product
 
+CART_VERSION = 2
+
+
+def to_minor(price):
+    return int((Decimal(str(price)) * 100).to_integral_value(ROUND_HALF_UP))
+
+
+def from_minor(amount):
+    return Decimal(amount).scaleb(-2)
+
 
 class Cart(object):
+    """
+    Корзина в сессии.
+
+    В сессии лежат параллельные списки: {'v': 2, 'ids': [...], 'qty': [...], 'price': [...]},
+    цены в копейках. Количество и сумма считаются по этим спискам без обращения к базе. Товары
+    загружаются только при первом обходе корзины, причём обход строит новые словари и не меняет
+    данные сессии. Сессия помечается изменённой, только если содержимое корзины действительно
+    поменялось.
+    """
+
+    legacy_summary_key = settings.CART_SESSION_ID + '_summary'
 
     def __init__(self, request):
         self.session = request.session
-        cart = self.session.get(settings.CART_SESSION_ID)
-        if not cart:
-            cart = self.session[settings.CART_SESSION_ID] = {}
-        self.cart = cart
+        self.items = self.decode(self.session.get(settings.CART_SESSION_ID))
+        self._lines = None
 
-    def __iter__(self):
-        product_ids = self.cart.keys()
-        products = Product.objects.filter(id__in=product_ids)
+    @staticmethod
+    def decode(data):
+        """{id товара: [количество, цена в копейках]} из сессии, в том числе из старого формата."""
+        if not data:
+            return {}
+        if data.get('v') == CART_VERSION:
+            return {pk: [qty, price] for pk, qty, price in zip(data['ids'], data['qty'], data['price'])}
+        # Формат до версии 2: {'<id>': {'quantity': n, 'price': '123.0'}}
+        return {int(pk): [item['quantity'], to_minor(item['price'])] for pk, item in data.items()}
 
-        cart = self.cart.copy()
-        for product in products:
-            cart[str(product.id)]['product'] = product
+    def encode(self):
+        if not self.items:
+            return None
+        return {'v': CART_VERSION,
+                'ids': list(self.items),
+                'qty': [qty for qty, price in self.items.values()],
+                'price': [price for qty, price in self.items.values()]}
 
-        for item in cart.values():
-            item['price'] = Decimal(item['price'])
-            item['total_price'] = item['price'] * item['quantity']
-            yield item
+    def __iter__(self):
+        if self._lines is None:
+            products = Product.objects.in_bulk(list(self.items))
+            self._lines = []
+            for product_id, (quantity, price) in self.items.items():
+                line = {'quantity': quantity, 'price': from_minor(price),
+                        'total_price': from_minor(price * quantity)}
+                if product_id in products:
+                    line['product'] = products[product_id]
+                self._lines.append(line)
+        return iter(self._lines)
 
     def __len__(self):
-        return sum(item['quantity'] for item in self.cart.values())
+        return sum(qty for qty, price in self.items.values())
 
     def add(self, product, quantity=1, update_quantity=False):
-        product_id = str(product.id)
-        if product_id not in self.cart:
-            self.cart[product_id] = {'quantity': 0,
-                                     'price': str(product.price)}
-        if update_quantity:
-            self.cart[product_id]['quantity'] = quantity
-        else:
-            self.cart[product_id]['quantity'] += quantity
+        current, price = self.items.get(product.id, (0, to_minor(product.price)))
+        self.items[product.id] = [quantity if update_quantity else current + quantity, price]
         self.save()
 
     def save(self):
-        self.session.modified = True
+        """Записывает корзину в сессию, если она отличается от сохранённой."""
+        self._lines = None
+        data = self.encode()
+        if self.legacy_summary_key in self.session:
+            self.session.pop(self.legacy_summary_key)
+        if data == self.session.get(settings.CART_SESSION_ID):
+            return
+        if data is None:
+            self.session.pop(settings.CART_SESSION_ID, None)
+        else:
+            self.session[settings.CART_SESSION_ID] = data
 
     def remove(self, product):
-        product_id = str(product.id)
-        if product_id in self.cart:
-            del self.cart[product_id]
+        if self.items.pop(product.id, None) is not None:
             self.save()
 
     def get_total_price(self):
-        return sum(Decimal(item['price']) * item['quantity'] for item in self.cart.values())
+        return from_minor(sum(qty * price for qty, price in self.items.values()))
 
     def clear(self):
-        del self.session[settings.CART_SESSION_ID]
+        self.items = {}
         self.save()
@@ -1,3 +1,134 @@
-from django.test import TestCase
+import json
+from decimal import Decimal
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.sessions.backends.db import SessionStore
+from django.db import connection
+from django.test import RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from accounts.models import *
+from .cart import CART_VERSION, Cart
+
+
+class CartSummaryTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username='test', password='123testpass', email='09mn@mail.ru')
+        category = Category.objects.create(name='category1', slug='category1')
+        cls.first = Product.objects.create(title='rtx', content='test', price='100.5', number='5',
+                                           category=category, creator=user)
+        cls.second = Product.objects.create(title='gtx', content='test', price='20', number='5',
+                                            category=category, creator=user)
+
+    def setUp(self):
+        self.client.login(username='test', password='123testpass')
+
+    def add(self, product, quantity, update=False):
+        data = {'quantity': quantity}
+        if update:
+            data['update'] = 'on'
+        self.client.post(reverse('cart:cart_add', kwargs={'product_id': product.id}), data)
+
+    def test_summary_follows_changes(self):
+        self.add(self.first, 2)
+        self.add(self.second, 1)
+        resp = self.client.get(reverse('home'))
+        self.assertEqual(len(resp.context['cart']), 3)
+        self.assertEqual(resp.context['cart'].get_total_price(), Decimal('221'))
+        self.add(self.first, 1, update=True)
+        self.client.get(reverse('cart:cart_remove', kwargs={'product_id': self.second.id}))
+        resp = self.client.get(reverse('home'))
+        self.assertEqual(len(resp.context['cart']), 1)
+        self.assertEqual(resp.context['cart'].get_total_price(), Decimal('100.5'))
+
+    def test_catalog_does_not_load_cart_products(self):
+        self.add(self.first, 2)
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.client.get(reverse('home'))
+        self.assertContains(resp, 'Корзина (2 позиций на сумму 201.00)')
+        product_queries = [q for q in queries.captured_queries if 'IN (' in q['sql'] and 'accounts_product' in q['sql']]
+        self.assertEqual(product_queries, [])
+
+    def test_detail_loads_products_once(self):
+        self.add(self.first, 2)
+        self.add(self.second, 1)
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.client.get(reverse('cart:cart_detail'))
+        self.assertContains(resp, 'rtx')
+        self.assertContains(resp, 'gtx')
+        product_queries = [q for q in queries.captured_queries if 'IN (' in q['sql'] and 'accounts_product' in q['sql']]
+        self.assertEqual(len(product_queries), 1)
+
+
+class CartEncodingTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username='test', password='123testpass', email='09mn@mail.ru')
+        category = Category.objects.create(name='category1', slug='category1')
+        cls.first = Product.objects.create(title='rtx', content='test', price='100.5', number='5',
+                                           category=category, creator=user)
+        cls.second = Product.objects.create(title='gtx', content='test', price='19.99', number='5',
+                                            category=category, creator=user)
+
+    def setUp(self):
+        self.request = RequestFactory().get('/')
+        self.request.session = SessionStore()
+
+    def cart(self):
+        self.request.session.modified = False
+        return Cart(self.request)
+
+    def test_compact_encoding(self):
+        cart = self.cart()
+        cart.add(self.first, 2)
+        cart.add(self.second, 1)
+        self.assertEqual(self.request.session[settings.CART_SESSION_ID],
+                         {'v': CART_VERSION, 'ids': [self.first.id, self.second.id], 'qty': [2, 1],
+                          'price': [10050, 1999]})
+        self.assertEqual(len(cart), 3)
+        self.assertEqual(cart.get_total_price(), Decimal('220.99'))
+        json.dumps(self.request.session[settings.CART_SESSION_ID])
+
+    def test_iteration_does_not_touch_session(self):
+        self.cart().add(self.first, 2)
+        stored = json.dumps(self.request.session[settings.CART_SESSION_ID])
+        cart = self.cart()
+        lines = list(cart)
+        self.assertEqual(lines[0]['product'], self.first)
+        self.assertEqual(lines[0]['total_price'], Decimal('201.00'))
+        self.assertEqual(json.dumps(self.request.session[settings.CART_SESSION_ID]), stored)
+        self.assertFalse(self.request.session.modified)
+
+    def test_unchanged_cart_is_not_written(self):
+        self.cart().add(self.first, 2)
+        cart = self.cart()
+        cart.add(self.first, 2, update_quantity=True)
+        cart.remove(self.second)
+        self.assertFalse(self.request.session.modified)
+        cart.add(self.first, 3, update_quantity=True)
+        self.assertTrue(self.request.session.modified)
+
+        self.request.session.flush()
+        cart = self.cart()
+        cart.clear()
+        self.assertFalse(self.request.session.modified)
+        self.assertNotIn(settings.CART_SESSION_ID, self.request.session)
+
+    def test_remove_last_item_drops_key(self):
+        self.cart().add(self.first, 1)
+        self.cart().remove(self.first)
+        self.assertNotIn(settings.CART_SESSION_ID, self.request.session)
+
+    def test_legacy_session_format(self):
+        self.request.session[settings.CART_SESSION_ID] = {str(self.first.id): {'quantity': 2, 'price': '100.5'}}
+        self.request.session[Cart.legacy_summary_key] = {'count': 2, 'total': '201.0'}
+        cart = self.cart()
+        self.assertEqual(len(cart), 2)
+        self.assertEqual(cart.get_total_price(), Decimal('201.00'))
+        cart.add(self.second, 1)
+        self.assertEqual(self.request.session[settings.CART_SESSION_ID]['ids'], [self.first.id, self.second.id])
+        self.assertNotIn(Cart.legacy_summary_key, self.request.session)
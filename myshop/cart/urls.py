@@ -4,9 +4,14 @@ from .views import *
 
 app_name = 'cart'
 
-urlpatterns = [
-    path('', CartDetail.as_view(), name='cart_detail'),
-    path('add/<int:product_id>/', views.cart_add, name='cart_add'),
-    path('remove/<int:product_id>/', views.cart_remove, name='cart_remove'),
 
-]
+def cart_urlpatterns(detail):
+    """Адреса корзины; myshop.asgi_urls подставляет асинхронную страницу корзины."""
+    return [
+        path('', detail, name='cart_detail'),
+        path('add/<int:product_id>/', views.cart_add, name='cart_add'),
+        path('remove/<int:product_id>/', views.cart_remove, name='cart_remove'),
+    ]
+
+
+urlpatterns = cart_urlpatterns(CartDetail.as_view())
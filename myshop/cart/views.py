@@ -1,10 +1,13 @@
+from asgiref.sync import sync_to_async
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.contrib.auth.views import redirect_to_login
 from django.shortcuts import redirect, get_object_or_404
+from django.template.response import TemplateResponse
 from django.views.decorators.http import require_POST
 from django.views.generic import TemplateView
 
 from accounts.models import *
-from accounts.utils import DataMixin
+from accounts.utils import DataMixin, async_user_context
 from .cart import Cart
 from .forms import CartAddProductForm
 
@@ -38,8 +41,21 @@ class CartDetail(LoginRequiredMixin, DataMixin, TemplateView):
         context = super().get_context_data(**kwargs)
         context_mixin = self.get_user_context(title="Корзина покупок",
                                               selected_category=None)
-        cart = Cart(self.request)
-        for item in cart:
-            item['update_quantity_form'] = CartAddProductForm(initial={'quantity': item['quantity'],
-                                                                       'update': True})
+        context['cart'] = cart_with_forms(Cart(self.request))
         return context | context_mixin
+
+
+def cart_with_forms(cart):
+    for item in cart:
+        item['update_quantity_form'] = CartAddProductForm(initial={'quantity': item['quantity'],
+                                                                   'update': True})
+    return cart
+
+
+async def cart_detail_async(request):
+    """Асинхронная версия CartDetail для ASGI (myshop.asgi_urls), товары корзины читаются через sync_to_async."""
+    if not await sync_to_async(lambda: request.user.is_authenticated)():
+        return redirect_to_login(request.get_full_path())
+    context = await async_user_context(request, title="Корзина покупок", selected_category=None)
+    context['cart'] = await sync_to_async(lambda: cart_with_forms(Cart(request)))()
+    return TemplateResponse(request, 'cart/detail.html', context)
@@ -0,0 +1,28 @@
+"""
+URLconf для запуска под ASGI: ROOT_URLCONF = 'myshop.asgi_urls'.
+
+Адреса и имена те же, что в myshop.urls, но каталог, страница товара и корзина
+обслуживаются async def view — запросы к базе и кэшу идут через sync_to_async.
+"""
+from django.conf.urls.static import static
+from django.contrib import admin
+from django.urls import path, include
+
+from accounts.urls import account_urlpatterns, catalog_urlpatterns
+from accounts.views import async_catalog, show_product_async, pageNotFound, query_stats
+from cart.urls import cart_urlpatterns
+from cart.views import cart_detail_async
+from myshop import settings
+
+urlpatterns = [
+    path('admin/', admin.site.urls),
+    path('cart/', include((cart_urlpatterns(cart_detail_async), 'cart'))),
+    path('', include(catalog_urlpatterns(async_catalog, show_product_async) + account_urlpatterns)),
+]
+
+if settings.DEBUG:
+    urlpatterns = [path('__debug__/', include('debug_toolbar.urls')),
+                   path('__queries__/', query_stats), ] + urlpatterns
+    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+
+handler404 = pageNotFound
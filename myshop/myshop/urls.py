@@ -16,7 +16,8 @@ if settings.DEBUG:
     import mimetypes
 
     # mimetypes.add_type("application/javascript", ".js", True)
-    urlpatterns = [path('__debug__/', include('debug_toolbar.urls')), ] + urlpatterns
+    urlpatterns = [path('__debug__/', include('debug_toolbar.urls')),
+                   path('__queries__/', query_stats), ] + urlpatterns
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
 
 handler404 = pageNotFound